@@ -1,11 +1,18 @@
 import asyncio
+import io
+import json
 import typing
 from datetime import datetime, timezone
 
 import discord
+import humanize
 from discord.ext import commands
 
+import cpupool
+import database
+import logsink
 import scheduler
+import serverconfig
 from timeconverter import time_converter
 
 
@@ -33,6 +40,10 @@ class AdminCommands(commands.Cog, command_attrs=dict(hidden=True)):
     async def die(self, ctx):
         await ctx.reply("✅ Shutting down.")
         await self.bot.close()
+        # cogs flush what they have queued for the db and log channels when they're unloaded by bot.close()
+        await logsink.close()
+        await database.close()
+        await cpupool.close()
         await self.bot.loop.shutdown_asyncgens()
         await self.bot.loop.shutdown_default_executor()
         self.bot.loop.stop()
@@ -47,6 +58,74 @@ class AdminCommands(commands.Cog, command_attrs=dict(hidden=True)):
             asyncio.create_task(ctx.message.delete())
         asyncio.create_task(channel.send(msg))
 
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        conf = serverconfig.stats()
+        await ctx.reply(f"**Server config cache**: {conf['guilds']} guild(s), {conf['hits']} hit(s), "
+                        f"{conf['misses']} miss(es) ({conf['hit_rate']:.1%} hit rate)")
+        if xpcog := self.bot.get_cog("Experience"):
+            cooldowns = xpcog.cooldowns.stats()
+            await ctx.reply(f"**XP cooldowns**: {cooldowns['entries']} "
+                            f"entr{'y' if cooldowns['entries'] == 1 else 'ies'} "
+                            f"({humanize.naturalsize(cooldowns['bytes'])}), {cooldowns['evicted']} evicted")
+
+    @commands.command()
+    @commands.is_owner()
+    async def logstats(self, ctx):
+        if bulklog := self.bot.get_cog("BulkLog"):
+            stats = bulklog.stats
+            queued = sum(len(queue) for queue in bulklog.queues.values())
+            await ctx.reply(f"**Bulk log**: {stats['queued']} entries logged in {stats['sent']} message(s), "
+                            f"{stats['merged']} merged, {stats['dropped']} dropped, {stats['failed']} failed, "
+                            f"{queued} waiting")
+
+    @commands.command()
+    @commands.is_owner()
+    async def schedulerstats(self, ctx, dump: bool = False):
+        """
+        show how late scheduled events run and how long they take
+        :param dump: attach the full stats as JSON
+        """
+        stats = await scheduler.stats()
+        loaded_until = int(datetime.fromisoformat(stats['loaded_until']).timestamp())
+        lines = [f"{stats['loaded']} event(s) loaded until <t:{loaded_until}:R>"]
+        if stats["last_catchup"]:
+            lines.append(f"last catch-up ran {stats['last_catchup']['events']} missed event(s) in "
+                         f"{stats['last_catchup']['seconds']:.2f}s")
+        for eventtype, event in stats["events"].items():
+            lines.append(f"**{eventtype}**: {event['stored']} stored, {event['running']} running, {event['runs']} run, "
+                         f"{event['failures']} failed. lag p50 {event['lag']['p50']:g}s p99 {event['lag']['p99']:g}s, "
+                         f"duration p50 {event['duration']['p50']:g}s p99 {event['duration']['p99']:g}s")
+        if dump:
+            with io.BytesIO(json.dumps(stats, indent=4).encode()) as buf:
+                await ctx.reply("\n".join(lines), file=discord.File(buf, filename="schedulerstats.json"))
+        else:
+            await ctx.reply("\n".join(lines))
+
+    @commands.command()
+    @commands.is_owner()
+    async def dbstats(self, ctx, dump: bool = False):
+        """
+        show the statements that have spent the most time in the database
+        :param dump: attach stats for every statement as JSON
+        """
+        stats = database.stats()
+        commits = database.group_commit_stats
+        lines = [f"{len(stats)} distinct statement(s), slow query threshold "
+                 f"{database.slow_query_threshold * 1000:g}ms",
+                 f"**Group commit**: {commits['writes']} write(s) in {commits['commits']} commit(s), "
+                 f"{commits['failed']} failed"]
+        for sql, query in list(stats.items())[:8]:
+            lines.append(f"`{sql[:80]}{'…' if len(sql) > 80 else ''}`: {query['calls']} call(s), "
+                         f"{query['total_seconds']:.3f}s total, p50 {query['duration']['p50'] * 1000:g}ms "
+                         f"p99 {query['duration']['p99'] * 1000:g}ms, {query['rows']} row(s)")
+        if dump:
+            with io.BytesIO(json.dumps(stats, indent=4).encode()) as buf:
+                await ctx.reply("\n".join(lines), file=discord.File(buf, filename="dbstats.json"))
+        else:
+            await ctx.reply("\n".join(lines))
+
     @commands.command()
     @commands.is_owner()
     async def testschedule(self, ctx, time: time_converter):
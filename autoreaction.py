@@ -33,10 +33,9 @@ class AutoReactionCog(commands.Cog, name="AutoReaction"):
         :param emoji: emoji to react with
         :param react_to_threads: should I react to threads of the channel?
         """
-        await database.db.execute(
+        await database.write(
             "REPLACE INTO auto_reactions(guild,channel,emoji,react_to_threads) VALUES (?,?,?,?)",
             (ctx.guild.id, channel.id, emoji.id, react_to_threads))
-        await database.db.commit()
         await ctx.reply(f"✔️ I will now react to all messages in {channel.mention} with {emoji}.")
         await modlog(
             f"{ctx.author.mention} (`{ctx.author}`) added new autoreaction rule ({emoji} in {channel.mention})",
@@ -57,11 +56,10 @@ class AutoReactionCog(commands.Cog, name="AutoReaction"):
         :param channel: channel of reactions
         :param emoji: emoji to no longer react with
         """
-        cur = await database.db.execute(
+        result = await database.write(
             "DELETE FROM auto_reactions WHERE channel=? AND emoji=?",
             (channel.id, emoji.id))
-        await database.db.commit()
-        if cur.rowcount > 0:
+        if result.rowcount > 0:
             await ctx.reply(f"✔️ Removed autoreaction rule for {channel.mention}.")
             await modlog(f"{ctx.author.mention} (`{ctx.author}`) removed autoreaction rule "
                          f"({emoji} in {channel.mention}).", ctx.guild.id, modid=ctx.author.id)
@@ -74,8 +72,8 @@ class AutoReactionCog(commands.Cog, name="AutoReaction"):
         """
         list all autoreaction rules
         """
-        async with database.db.execute("SELECT * FROM auto_reactions WHERE guild=?",
-                                       (ctx.guild.id,)) as cursor:
+        async with database.read() as con, con.execute("SELECT * FROM auto_reactions WHERE guild=?",
+                                                       (ctx.guild.id,)) as cursor:
             arrules = await cursor.fetchall()
         outstr = f"{len(arrules)} autoreaction rule{'' if len(arrules) == 1 else 's'}:\n"
         for rule in arrules:
@@ -100,9 +98,8 @@ class AutoReactionCog(commands.Cog, name="AutoReaction"):
             async for emid in cursor:
                 emoji = discord.utils.get(message.guild.emojis, id=emid[2])
                 if emoji is None:
-                    await database.db.execute("DELETE FROM auto_reactions WHERE channel=? AND emoji=?",
-                                              (emid[1], emid[2]))
-                    await database.db.commit()
+                    await database.write("DELETE FROM auto_reactions WHERE channel=? AND emoji=?",
+                                         (emid[1], emid[2]))
                     await modlog(f"Removed autoreaction rule from {message.channel.mention} because emoji with id "
                                  f"`{emid[2]}` no longer exists.", message.guild.id)
                 else:
@@ -117,9 +114,8 @@ class AutoReactionCog(commands.Cog, name="AutoReaction"):
                 async for emid in cursor:
                     emoji = discord.utils.get(message.guild.emojis, id=emid[2])
                     if emoji is None:
-                        await database.db.execute("DELETE FROM auto_reactions WHERE channel=? AND emoji=?",
-                                                  (emid[1], emid[2]))
-                        await database.db.commit()
+                        await database.write("DELETE FROM auto_reactions WHERE channel=? AND emoji=?",
+                                             (emid[1], emid[2]))
                         await modlog(f"Removed autoreaction rule from {message.channel.mention} because emoji with id "
                                      f"`{emid[2]}` no longer exists.", message.guild.id)
                     else:
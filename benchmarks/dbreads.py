@@ -0,0 +1,121 @@
+"""
+compares read latency while writes are committing, for the old single rollback journal connection and the WAL writer
+with a pool of read connections.
+aiosqlite runs each connection's statements on one thread in order, which is modelled here with a single worker
+thread per connection.
+run from the repo root: python -m benchmarks.dbreads
+"""
+import concurrent.futures
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+rows = 200_000
+guilds = 50
+reads = 2000
+readers = 4
+# a commit every few milliseconds, like XP flushes and logging on a busy bot
+write_batch = 50
+write_interval = 0.002
+
+pragmas = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+read_query = "SELECT user, experience, RANK() OVER (ORDER BY experience DESC) FROM experience WHERE guild=? LIMIT 10"
+
+
+def populate(path: str):
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE experience (user INTEGER, guild INTEGER, experience INTEGER, PRIMARY KEY (user, guild))")
+    con.execute("CREATE INDEX experience_guild ON experience (guild, experience)")
+    random.seed(0)
+    con.executemany("INSERT INTO experience VALUES (?,?,?)",
+                    ((i, i % guilds, random.randrange(100_000)) for i in range(rows)))
+    con.commit()
+    con.close()
+
+
+def connect(path: str, wal: bool, readonly: bool = False) -> sqlite3.Connection:
+    con = sqlite3.connect(f"file:{path}?mode=ro" if readonly else path, uri=True, check_same_thread=False,
+                          timeout=30)
+    if wal:
+        for pragma, value in pragmas.items():
+            if not (readonly and pragma == "journal_mode"):
+                con.execute(f"PRAGMA {pragma}={value}")
+    return con
+
+
+def run(path: str, wal: bool) -> list[float]:
+    writer = connect(path, wal)
+    writer_thread = concurrent.futures.ThreadPoolExecutor(1)
+    if wal:
+        pool = [(connect(path, wal, readonly=True), concurrent.futures.ThreadPoolExecutor(1)) for _ in range(readers)]
+    else:
+        # reads go through the same connection as writes
+        pool = [(writer, writer_thread)]
+    stop = threading.Event()
+
+    def read(con: sqlite3.Connection, guild: int) -> float:
+        con.execute(read_query, (guild,)).fetchall()
+        return time.perf_counter()
+
+    def write_loop():
+        # hand the writer thread one batch at a time so reads can queue between them like they would on aiosqlite
+        user = 0
+        while not stop.is_set():
+            writer_thread.submit(write_once, user).result()
+            user = (user + write_batch) % rows
+            time.sleep(write_interval)
+
+    def write_once(user: int):
+        writer.executemany("UPDATE experience SET experience=experience+1 WHERE user=? AND guild=?",
+                           ((u, u % guilds) for u in range(user, user + write_batch)))
+        writer.commit()
+
+    background = threading.Thread(target=write_loop)
+    background.start()
+    latencies = []
+    with concurrent.futures.ThreadPoolExecutor(readers) as clients:
+        def client(i: int):
+            con, thread = pool[i % len(pool)]
+            start = time.perf_counter()
+            end = thread.submit(read, con, i % guilds).result()
+            latencies.append(end - start)
+
+        list(clients.map(client, range(reads)))
+    stop.set()
+    background.join()
+    for con, thread in pool:
+        thread.shutdown()
+        if con is not writer:
+            con.close()
+    writer_thread.shutdown()
+    writer.close()
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    print(f"{name}: mean {statistics.mean(latencies) * 1000:.2f}ms, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, wal in (("single connection, rollback journal", False), ("WAL writer + read pool", True)):
+            path = os.path.join(tmp, f"{'wal' if wal else 'journal'}.sqlite")
+            populate(path)
+            report(name, run(path, wal))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+compares embedutils.add_long_field and split_embed with the regex/deepcopy versions they replaced,
+on the kind of embed a message edit with long content produces.
+run from the repo root: python -m benchmarks.embedsplit
+"""
+import copy
+import math
+import random
+import re
+import string
+import timeit
+
+import discord
+
+import embedutils
+
+
+def old_add_long_field(embed: discord.Embed, name: str, value: str, inline: bool = False) -> discord.Embed:
+    if len(value) <= 1024:
+        if len(value) == 0:
+            value = "`No Content`"
+        return embed.add_field(name=name, value=value, inline=inline)
+    else:
+        for i, section in enumerate(re.finditer('.{1,1024}', value, flags=re.S)):  # split every 1024 chars
+            embed.add_field(name=f"{name} `({i + 1}/{math.ceil(len(value) / 1024)})`", value=section[0], inline=inline)
+    return embed
+
+
+def old_split_embed(embed: discord.Embed) -> list[discord.Embed]:
+    out = []
+    baseembed = copy.deepcopy(embed)
+    baseembed.clear_fields()
+    currentembed = copy.deepcopy(baseembed)
+    for field in embed.fields:
+        currentembed.add_field(name=field.name, value=field.value, inline=field.inline)
+        if len(currentembed) > 6000 or len(currentembed.fields) > 25:
+            currentembed.remove_field(-1)
+            out.append(currentembed)
+            currentembed = copy.deepcopy(baseembed)
+            currentembed.add_field(name=field.name, value=field.value, inline=field.inline)
+    out.append(currentembed)
+    return out
+
+
+def edit_fields(size: int) -> dict:
+    # what BulkLog.on_message_edit logs, with before and after contents of the given size
+    content = "".join(random.choices(string.ascii_letters + " \n", k=size))
+    return {
+        "Action": "Message Edit",
+        "Channel": "<#908859472288551015> (#general)",
+        "Author": "<@187970133623308288> (@someone)",
+        "Content Before": content,
+        "Content After": content[::-1],
+        "Message ID": "1100000000000000000",
+        "Message Jump URL": "https://discord.com/channels/1/2/3"
+    }
+
+
+def build(add_long_field, fields: dict) -> discord.Embed:
+    embed = discord.Embed(title="Server Log", color=discord.Colour.yellow())
+    for k, v in fields.items():
+        add_long_field(embed, k, v)
+    return embed
+
+
+def main():
+    random.seed(0)
+    for size in (2_000, 6_000, 25_000, 100_000):
+        fields = edit_fields(size)
+        old = old_split_embed(build(old_add_long_field, fields))
+        new = embedutils.split_embed(build(embedutils.add_long_field, fields))
+        assert [e.to_dict() for e in old] == [e.to_dict() for e in new], "implementations disagree"
+        n = 200 if size < 25_000 else 20
+        old_time = timeit.timeit(lambda: old_split_embed(build(old_add_long_field, fields)), number=n) / n
+        new_time = timeit.timeit(lambda: embedutils.split_embed(build(embedutils.add_long_field, fields)),
+                                 number=n) / n
+        print(f"{size:>7} chars/field, {len(new)} page(s): old {old_time * 1000:.2f}ms, new {new_time * 1000:.2f}ms "
+              f"({old_time / new_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
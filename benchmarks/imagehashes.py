@@ -0,0 +1,58 @@
+"""
+compares looking up a new image's hash in an image set channel by comparing it to every stored hex hash one at a time
+(the old way) with hashindex's vectorized XOR and popcount over the channel's hashes.
+run from the repo root: python -m benchmarks.imagehashes
+"""
+import random
+import time
+
+import imagehash
+import numpy as np
+
+from hashindex import HashIndex, Image, pack
+
+sizes = (10_000, 100_000, 1_000_000)
+hashsize = 8
+hashdiff = 4
+# the old loop takes seconds per lookup on big channels, so it gets fewer
+loop_lookups = 3
+index_lookups = 100
+
+
+def loop_search(hexhashes: list[str], imhash: imagehash.ImageHash, maxdistance: int) -> list[int]:
+    # the loop hashmessage used before hashindex, minus the db
+    return [i for i, prevhash in enumerate(hexhashes) if imagehash.hex_to_hash(prevhash) - imhash <= maxdistance]
+
+
+def timed(search, lookups: list) -> float:
+    start = time.perf_counter()
+    for lookup in lookups:
+        search(lookup)
+    return (time.perf_counter() - start) / len(lookups)
+
+
+def main():
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        hashes = [imagehash.ImageHash(bits) for bits in rng.integers(0, 2, (size, hashsize, hashsize), dtype=bool)]
+        hexhashes = [str(imhash) for imhash in hashes]
+        packed = [pack(imhash) for imhash in hashes]
+        lookups = random.sample(hashes, index_lookups)
+
+        start = time.perf_counter()
+        index = HashIndex(len(packed[0]), size)
+        index.extend(packed, [Image(i, str(i), 0, 0) for i in range(size)])
+        load = time.perf_counter() - start
+
+        for imhash in lookups[:loop_lookups]:
+            assert [match[2].message for match in index.search(pack(imhash), hashdiff)] == \
+                   loop_search(hexhashes, imhash, hashdiff)
+        loop = timed(lambda imhash: loop_search(hexhashes, imhash, hashdiff), lookups[:loop_lookups])
+        vectorized = timed(lambda imhash: index.search(pack(imhash), hashdiff), lookups)
+        print(f"{size:>9,} hashes: loop {loop * 1000:9.2f}ms, index {vectorized * 1000:7.3f}ms "
+              f"({loop / vectorized:.0f}x), loading index {load * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
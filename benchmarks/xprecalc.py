@@ -0,0 +1,58 @@
+"""
+compares XP recalculation over boxed datetimes (the old way) with timestamps_to_xp over a compact array.
+run from the repo root: python -m benchmarks.xprecalc
+"""
+import array
+import datetime
+import random
+import time
+
+from xp import timestamps_to_xp
+
+messages = 10_000_000
+users = 1000
+cooldown = 60
+# about 2 years of history
+span = 2 * 365 * 24 * 60 * 60 * 1000
+
+
+def list_of_datetimes_to_xp(inp: list[datetime.datetime], time_between_xp: float) -> int:
+    # the implementation recalculateguildxp used before timestamps_to_xp
+    xp = 0
+    inp = sorted(inp)
+    # just some random old date
+    last_xp_gain = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+    for msg in inp:
+        if (msg - last_xp_gain).total_seconds() >= time_between_xp:
+            xp += 1
+            last_xp_gain = msg
+    return xp
+
+
+def main():
+    random.seed(0)
+    # skewed like a real guild, a few users send most of the messages
+    weights = [1 / (i + 1) for i in range(users)]
+    per_user = [[] for _ in range(users)]
+    for user, ts in zip(random.choices(range(users), weights, k=messages), random.sample(range(span), messages)):
+        per_user[user].append(ts)
+    arrays = [array.array("q", sorted(ts)) for ts in per_user]
+
+    start = time.perf_counter()
+    new = [timestamps_to_xp(ts, cooldown) for ts in arrays]
+    new_time = time.perf_counter() - start
+    print(f"timestamps_to_xp: {new_time:.2f}s, array memory {sum(ts.itemsize * len(ts) for ts in arrays) / 2 ** 20:.0f}MiB")
+
+    epoch = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    per_user = [[epoch + datetime.timedelta(milliseconds=t) for t in ts] for ts in per_user]
+    start = time.perf_counter()
+    old = [list_of_datetimes_to_xp(ts, cooldown) for ts in per_user]
+    old_time = time.perf_counter() - start
+    print(f"list_of_datetimes_to_xp: {old_time:.2f}s")
+
+    assert new == old, "implementations disagree"
+    print(f"{old_time / new_time:.1f}x faster, {sum(new)} XP total")
+
+
+if __name__ == "__main__":
+    main()
@@ -35,17 +35,13 @@ class BirthdayCog(commands.Cog, name="Birthday Commands"):
             await ctx.reply(str(e))
             return
         # cancel all existing birthday events
-        async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.user\")=? "
-                                       "AND eventtype=?",
-                                       (ctx.author.id, "birthday")) as cur:
-            async for event in cur:
-                await scheduler.canceltask(event[0])
+        for event in await scheduler.find_events("birthday", user=ctx.author.id):
+            await scheduler.canceltask(event)
         # insert birthday into db
-        await database.db.execute(
+        await database.write(
             "REPLACE INTO birthdays(user,birthday) "
             "VALUES (?,?)",
             (ctx.author.id, birthday.timestamp()))
-        await database.db.commit()
         # calculate next birthday
         now = datetime.datetime.now(tz=datetime.timezone(datetime.timedelta(hours=tz)))
         thisyear = now.year
@@ -103,17 +99,13 @@ class BirthdayCog(commands.Cog, name="Birthday Commands"):
             await ctx.reply(str(e))
             return
         # cancel all existing birthday events
-        async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.user\")=? "
-                                       "AND eventtype=?",
-                                       (user.id, "birthday")) as cur:
-            async for event in cur:
-                await scheduler.canceltask(event[0])
+        for event in await scheduler.find_events("birthday", user=user.id):
+            await scheduler.canceltask(event)
         # insert birthday into db
-        await database.db.execute(
+        await database.write(
             "REPLACE INTO birthdays(user,birthday) "
             "VALUES (?,?)",
             (user.id, birthday.timestamp()))
-        await database.db.commit()
         # calculate next birthday
         now = datetime.datetime.now(tz=datetime.timezone(datetime.timedelta(hours=tz)))
         thisyear = now.year
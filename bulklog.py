@@ -3,26 +3,197 @@ import datetime
 import io
 import re
 import typing
+from collections import OrderedDict, defaultdict, deque
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-import database
 import embedutils
+import logsink
+import moderation
+import resolver
+from clogs import logger
+
+# log entries are queued per guild and sent every flush interval, packed into as few messages as possible
+bulk_log_flush_interval = 2  # seconds
+bulk_log_queue_size = 500  # entries per guild, the oldest are dropped past this
+# discord's limits per message
+max_embeds = 10
+max_embed_chars = 6000
+max_files = 10
+# IDs of messages being deleted by a command that logs them itself, so the deletes arent logged again one by one
+suppressed_max = 10_000
+
+
+def render_transcript(messages: typing.Iterable[discord.Message]) -> discord.File:
+    """
+    write deleted messages into a text file, oldest first
+    :param messages: the messages
+    :return: transcript.txt
+    """
+    buf = io.BytesIO()
+    for msg in sorted(messages, key=lambda m: m.id):
+        buf.write(f"[{msg.created_at:%Y-%m-%d %H:%M:%S} UTC] @{msg.author} ({msg.author.id}), "
+                  f"message {msg.id}\n".encode("utf8"))
+        if msg.system_content:
+            buf.write(msg.system_content.encode("utf8") + b"\n")
+        for link in [att.url for att in msg.attachments] + [emb.url for emb in msg.embeds if emb.url is not None]:
+            buf.write(f"    {link}\n".encode("utf8"))
+        buf.write(b"\n")
+    buf.seek(0)
+    return discord.File(buf, "transcript.txt")
+
+
+class LogEntry(typing.NamedTuple):
+    embeds: typing.List[discord.Embed]
+    files: typing.List[discord.File]
 
 
 class BulkLog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.queues: typing.DefaultDict[int, typing.Deque[LogEntry]] = defaultdict(deque)
+        self.suppressed: typing.OrderedDict[int, None] = OrderedDict()
+        self.stats = {
+            "queued": 0,  # entries logged
+            "sent": 0,  # messages sent
+            "merged": 0,  # entries that shared a message with an earlier entry
+            "dropped": 0,  # entries thrown away because their guild's queue was full
+            "failed": 0  # entries lost because sending failed
+        }
+
+    async def cog_load(self):
+        self.flush_loop.start()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+        await self.flush()
+
+    @tasks.loop(seconds=bulk_log_flush_interval)
+    async def flush_loop(self):
+        await self.flush()
+
+    async def flush(self):
+        """
+        send everything queued for every guild
+        """
+        guilds = [guild for guild, queue in self.queues.items() if queue]
+        await asyncio.gather(*(self.flush_guild(guild) for guild in guilds))
+
+    async def flush_guild(self, guildid: int):
+        queue = self.queues[guildid]
+        try:
+            modlogchannel = await moderation.get_server_config(guildid, "bulk_log_channel")
+            channel = await resolver.channel(self.bot, modlogchannel) if modlogchannel is not None else None
+            if channel is None:
+                queue.clear()
+                return
+            while queue:
+                embeds, files, count = self.pack(queue)
+                if not embeds and not files:
+                    self.stats["failed"] += count
+                    continue
+                try:
+                    await logsink.send(channel, embeds=embeds, files=files)
+                    self.stats["sent"] += 1
+                    self.stats["merged"] += count - 1
+                except discord.HTTPException as e:
+                    self.stats["failed"] += count
+                    logger.error(e, exc_info=(type(e), e, e.__traceback__))
+        except Exception as e:
+            logger.error(e, exc_info=(type(e), e, e.__traceback__))
+
+    @staticmethod
+    def pack(queue: typing.Deque[LogEntry]) -> typing.Tuple[typing.List[discord.Embed], typing.List[discord.File], int]:
+        """
+        take as many entries off the front of a queue as fit in one message
+        :return: embeds and files for the message, and how many entries went into it
+        """
+        embeds = []
+        files = []
+        chars = 0
+        count = 0
+        while queue:
+            entry = queue[0]
+            entrychars = sum(len(embed) for embed in entry.embeds)
+            fits = (len(embeds) + len(entry.embeds) <= max_embeds and chars + entrychars <= max_embed_chars
+                    and len(files) + len(entry.files) <= max_files)
+            if not fits:
+                if count:
+                    break
+                # entry doesnt fit in a message by itself, send as much of it as fits and leave the rest queued
+                while entry.embeds and len(embeds) < max_embeds and chars + len(entry.embeds[0]) <= max_embed_chars:
+                    chars += len(entry.embeds[0])
+                    embeds.append(entry.embeds.pop(0))
+                files += entry.files[:max_files]
+                del entry.files[:max_files]
+                if not entry.embeds and not entry.files or not embeds and not files:
+                    # fully taken, or can't be sent at all
+                    queue.popleft()
+                return embeds, files, 1
+            queue.popleft()
+            embeds += entry.embeds
+            files += entry.files
+            chars += entrychars
+            count += 1
+        return embeds, files, count
+
+    def suppress(self, message_ids: typing.Iterable[int]):
+        """
+        dont log the deletion of these messages, for commands that log what they delete with log_bulk_delete()
+        """
+        for message_id in message_ids:
+            self.suppressed[message_id] = None
+        while len(self.suppressed) > suppressed_max:
+            self.suppressed.popitem(last=False)
+
+    def is_suppressed(self, message_id: int) -> bool:
+        return self.suppressed.pop(message_id, False) is None
+
+    def suppress_check(self, check: typing.Optional[typing.Callable[[discord.Message], bool]] = None) \
+            -> typing.Callable[[discord.Message], bool]:
+        """
+        wrap a check for channel.purge() so every message it lets through is suppressed before it's deleted
+        """
+
+        def wrapped(message: discord.Message) -> bool:
+            if check is None or check(message):
+                self.suppress([message.id])
+                return True
+            return False
+
+        return wrapped
+
+    async def log_bulk_delete(self, msgs: typing.List[discord.Message],
+                              channel: typing.Union[discord.abc.GuildChannel, discord.Thread],
+                              moderator: typing.Optional[discord.abc.User] = None):
+        """
+        log many deleted messages as one entry with a transcript attached
+        :param msgs: the deleted messages
+        :param channel: channel they were deleted from
+        :param moderator: who deleted them, if known
+        """
+        if not msgs:
+            return
+        fields = {
+            "Action": "Bulk Message Delete",
+            "Channel": f"{channel.mention} (#{channel})",
+            "Number of Messages Deleted": str(len(msgs)),
+        }
+        if moderator is not None:
+            fields["Deleted By"] = f"{moderator.mention} (@{moderator})"
+        fields["Messages"] = "see attached file `transcript.txt`"
+        await self.logdict(fields, channel.guild.id, color=discord.Colour.red(), files=[render_transcript(msgs)])
 
     async def logdict(self, fields: dict, guildid: int, embed: typing.Optional[discord.Embed] = None,
-                      color: discord.Colour = discord.Color.blurple()):
+                      color: discord.Colour = discord.Color.blurple(),
+                      files: typing.Optional[typing.List[discord.File]] = None):
         # most actions will work fine with the simple dict format but some might want to modify
         # the embed, easiest way is to allow them to pass their own embed
         if embed is None:
             embed = discord.Embed(title="Server Log", color=color,
                                   timestamp=datetime.datetime.now(tz=datetime.timezone.utc))
-        files = []
+        files = files or []
         for k, v in fields.items():
             v = str(v)
             if len(v) < 6000:
@@ -36,21 +207,25 @@ class BulkLog(commands.Cog):
 
     async def log(self, embed: discord.Embed, guildid: int, files: typing.Optional[typing.List[discord.File]] = None):
         """
-        log generated embed to server bulk log channel
+        queue generated embed to be sent to server bulk log channel
         :param guildid: ID of guild
         :param embed: embed object, passed through embedutils.split_embed() to .send()
         :param files: list of files, passed straight to .send()
         """
-        async with database.db.execute("SELECT bulk_log_channel FROM server_config WHERE guild=?", (guildid,)) as cur:
-            modlogchannel = await cur.fetchone()
-        if modlogchannel is None or modlogchannel[0] is None:
+        if await moderation.get_server_config(guildid, "bulk_log_channel") is None:
             return
-        modlogchannel = modlogchannel[0]
-        channel = await self.bot.fetch_channel(modlogchannel)
-        await channel.send(embeds=embedutils.split_embed(embed), files=files)
+        queue = self.queues[guildid]
+        if len(queue) >= bulk_log_queue_size:
+            # drop the oldest, a log storm is better summarized by what's happening now
+            queue.popleft()
+            self.stats["dropped"] += 1
+        queue.append(LogEntry(embedutils.split_embed(embed), files or []))
+        self.stats["queued"] += 1
 
     @commands.Cog.listener()
     async def on_message_delete(self, msg: discord.Message):
+        if self.is_suppressed(msg.id):
+            return
         await self.logdict({
             "Action": "Message Delete",
             "Channel": f"{msg.channel.mention} (#{msg.channel})",
@@ -65,12 +240,9 @@ class BulkLog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_bulk_message_delete(self, msgs: typing.List[discord.Message]):
-        await self.logdict({
-            "Action": "Bulk Message Delete",
-            "Channel": f"{msgs[0].channel.mention} (#{msgs[0].channel})",
-            "Number of Messages Deleted": str(len(msgs))
-        }, msgs[0].guild.id, color=discord.Colour.red())
-        await asyncio.gather(*[self.on_message_delete(msg) for msg in msgs])
+        msgs = [msg for msg in msgs if not self.is_suppressed(msg.id)]
+        if msgs:
+            await self.log_bulk_delete(msgs, msgs[0].channel)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
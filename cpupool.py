@@ -0,0 +1,79 @@
+import asyncio
+import concurrent.futures.process
+import multiprocessing
+import os
+import typing
+
+from clogs import logger
+
+# decoding and hashing images can take seconds, which would stall the gateway heartbeat and every other cog if it ran
+# on the event loop. work like that is sent to a pool of worker processes instead, as bytes in and results out.
+
+# leave a core for the event loop
+workers = max(1, (os.cpu_count() or 2) - 1)
+# tasks allowed in the pool at once, running or waiting for a worker. anything more waits here, so a rescan of a huge
+# channel can't pile up every image it downloads in the pool's queue
+max_pending = workers * 2
+# seconds a task is waited for by default
+default_timeout = 30
+
+pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+slots = asyncio.Semaphore(max_pending)
+
+
+def get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global pool
+    if pool is None:
+        # forking the bot itself isn't safe, it has threads (aiosqlite, executors) that may hold locks mid-fork. workers
+        # are forked from a separate server process instead, which imports main.py once without starting the bot.
+        # multiprocessing makes every worker import the main module, so preloading only imageworker would just have
+        # each worker import main.py itself instead of inheriting it
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+    return pool
+
+
+def discard_broken(executor: concurrent.futures.ProcessPoolExecutor):
+    # a worker died (usually out of memory) and the pool can't be used again. others that were waiting on it may have
+    # replaced it already
+    global pool
+    if pool is executor:
+        pool = None
+    executor.shutdown(wait=False)
+
+
+async def run(func: typing.Callable, *args, timeout: float = default_timeout):
+    """
+    run a function in a worker process
+    :param func: a module level function, its arguments and result must be picklable
+    :param timeout: seconds to wait for the result before raising TimeoutError
+    :return: what func returns
+    """
+    loop = asyncio.get_running_loop()
+    await slots.acquire()
+    executor = get_pool()
+    try:
+        future = executor.submit(func, *args)
+    except BaseException as e:
+        slots.release()
+        if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+            discard_broken(executor)
+        raise
+    # a worker can't be stopped partway through a task, so one that timed out keeps its slot until it actually finishes
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+    try:
+        # cancels the task if it hasn't started yet
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"{func.__name__} took longer than {timeout}s in the CPU pool")
+        raise
+    except concurrent.futures.process.BrokenProcessPool:
+        discard_broken(executor)
+        raise
+
+
+async def close():
+    global pool
+    if pool is not None:
+        # don't wait for running tasks, they'd hold up the event loop
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = None
@@ -1,11 +1,359 @@
+import asyncio
+import contextlib
+import dataclasses
+import re
+import time
 import typing
+from collections import defaultdict
 
 import aiosqlite
 
-db: typing.Optional[aiosqlite.Connection] = None
+import metrics
+from clogs import logger
+
+path = "database.sqlite"
+
+# WAL lets readers run while the writer commits, and commits only fsync at checkpoints with synchronous=normal
+pragmas = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    # negative is in KiB, so 64MB
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+read_pool_size = 4
+read_pool: typing.Optional[asyncio.Queue] = None
+
+# writes that arrive within this long of each other share one transaction and one commit
+group_commit_window = 0.005  # seconds
+
+# statements that take longer than this to run are logged
+slow_query_threshold = 0.1  # seconds
+# most statements take well under a millisecond, so the buckets start lower than metrics' default
+query_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+@dataclasses.dataclass
+class QueryStats:
+    # seconds spent running the statement. sqlite finds the first row while running it, so this is most of a query
+    duration: metrics.Histogram = dataclasses.field(default_factory=lambda: metrics.Histogram(query_buckets))
+    # seconds spent fetching rows after the first
+    fetch_seconds: float = 0.0
+    calls: int = 0
+    # rows fetched for queries, rows changed for writes
+    rows: int = 0
+
+    @property
+    def total_seconds(self) -> float:
+        return self.duration.sum + self.fetch_seconds
+
+
+# normalized SQL -> stats
+query_stats: typing.DefaultDict[str, QueryStats] = defaultdict(QueryStats)
+
+
+def normalize(sql: str) -> str:
+    # numbers formatted into f-strings (LIMITs, OFFSETs) would give every page of a command its own entry
+    return re.sub(r"\b\d+\b", "?", " ".join(sql.split()))
+
+
+def record(sql: str, seconds: float, rows: int) -> QueryStats:
+    stats = query_stats[normalize(sql)]
+    stats.calls += 1
+    stats.rows += rows
+    stats.duration.observe(seconds)
+    if seconds >= slow_query_threshold:
+        logger.warning(f"slow query took {seconds * 1000:.1f}ms: {' '.join(sql.split())}")
+    return stats
+
+
+class TimedCursor:
+    """
+    aiosqlite cursor that counts the rows fetched from it
+    """
+
+    def __init__(self, cursor: aiosqlite.Cursor, stats: QueryStats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    async def fetched(self, fetch: typing.Awaitable, single: bool = False):
+        start = time.perf_counter()
+        result = await fetch
+        self.stats.fetch_seconds += time.perf_counter() - start
+        self.stats.rows += (result is not None) if single else len(result)
+        return result
+
+    async def fetchone(self):
+        return await self.fetched(self.cursor.fetchone(), single=True)
+
+    async def fetchmany(self, size: typing.Optional[int] = None):
+        return await self.fetched(self.cursor.fetchmany(size))
+
+    async def fetchall(self):
+        return await self.fetched(self.cursor.fetchall())
+
+    async def __aiter__(self):
+        while rows := await self.fetchmany(self.cursor.arraysize):
+            for row in rows:
+                yield row
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.cursor.close()
+
+
+class Statement:
+    """
+    what InstrumentedConnection.execute returns. like aiosqlite's, it can be awaited or used with async with.
+    """
+
+    def __init__(self, method: typing.Callable[..., typing.Awaitable[aiosqlite.Cursor]], sql: str, parameters):
+        self.method = method
+        self.sql = sql
+        self.parameters = parameters
+        self.cursor: typing.Optional[TimedCursor] = None
+
+    async def run(self) -> TimedCursor:
+        start = time.perf_counter()
+        cursor = await self.method(self.sql, self.parameters)
+        # rowcount is -1 for queries, their rows are counted as they're fetched
+        stats = record(self.sql, time.perf_counter() - start, max(cursor.rowcount, 0))
+        return TimedCursor(cursor, stats)
+
+    def __await__(self):
+        return self.run().__await__()
+
+    async def __aenter__(self) -> TimedCursor:
+        self.cursor = await self.run()
+        return self.cursor
+
+    async def __aexit__(self, *exc):
+        await self.cursor.close()
+
+
+class InstrumentedConnection:
+    """
+    wraps an aiosqlite connection to record how long every statement takes and how many rows it touches
+    """
+
+    def __init__(self, con: aiosqlite.Connection):
+        self.con = con
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def execute(self, sql: str, parameters: typing.Optional[typing.Iterable] = None) -> Statement:
+        return Statement(self.con.execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters: typing.Iterable[typing.Iterable]) -> Statement:
+        return Statement(self.con.executemany, sql, parameters)
+
+    async def executescript(self, sql: str):
+        start = time.perf_counter()
+        cursor = await self.con.executescript(sql)
+        record(sql, time.perf_counter() - start, 0)
+        return cursor
+
+    async def commit(self):
+        start = time.perf_counter()
+        await self.con.commit()
+        record("COMMIT", time.perf_counter() - start, 0)
+
+
+class Write(typing.NamedTuple):
+    sql: str
+    parameters: typing.Any = ()
+    # run with executemany, parameters is a list of parameter sets
+    many: bool = False
+
+
+class WriteResult(typing.NamedTuple):
+    # rows changed, summed over every parameter set for executemany
+    rowcount: int
+    lastrowid: typing.Optional[int]
+
+
+class PendingWrites(typing.NamedTuple):
+    # applied all or nothing
+    writes: typing.List[Write]
+    done: asyncio.Future
+
+
+pending_writes: typing.List[PendingWrites] = []
+writes_waiting: typing.Optional[asyncio.Event] = None
+committer_task: typing.Optional[asyncio.Task] = None
+closing = False
+group_commit_stats = {"writes": 0, "commits": 0, "failed": 0}
+
+
+# the one connection that writes. every statement on a connection runs on that connection's thread, so reads are
+# given their own connections below instead of queueing behind writes and commits.
+db: typing.Optional[InstrumentedConnection] = None
+
+
+async def apply_pragmas(con: aiosqlite.Connection, **extra):
+    for pragma, value in {**pragmas, **extra}.items():
+        if value is not None:
+            await con.execute(f"PRAGMA {pragma}={value}")
 
 
 async def create_db():
-    global db
-    db = await aiosqlite.connect("database.sqlite")
+    global db, read_pool, writes_waiting, committer_task
+    con = await aiosqlite.connect(path)
+    await apply_pragmas(con)
+    db = InstrumentedConnection(con)
+    read_pool = asyncio.Queue()
+    for _ in range(read_pool_size):
+        con = await aiosqlite.connect(f"file:{path}?mode=ro", uri=True)
+        # journal_mode is a property of the database file, the writer already set it
+        await apply_pragmas(con, journal_mode=None, query_only="true")
+        read_pool.put_nowait(InstrumentedConnection(con))
+    writes_waiting = asyncio.Event()
+    committer_task = asyncio.create_task(committer())
     return db
+
+
+async def write_all(*writes: Write) -> typing.List[WriteResult]:
+    """
+    run writes in one transaction and wait until they've been committed.
+    writes from everywhere else that arrive at about the same time are committed along with them, so a burst of writes
+    costs one fsync instead of one each. if any of the writes fail, none of them are applied and the error is raised.
+    :return: the result of each write
+    """
+    if closing or committer_task is None or committer_task.done():
+        # nothing would ever commit it
+        raise RuntimeError("can't write to the database, it's closed or its committer stopped")
+    # generators would be read later by the committer, by which point what they read from may have changed
+    writes = [write._replace(parameters=list(write.parameters)) if write.many else write for write in writes]
+    done = asyncio.get_running_loop().create_future()
+    pending_writes.append(PendingWrites(writes, done))
+    writes_waiting.set()
+    return await done
+
+
+async def write(sql: str, parameters: typing.Iterable = ()) -> WriteResult:
+    """
+    run one statement that changes the db and wait until it's committed. see write_all
+    """
+    return (await write_all(Write(sql, parameters)))[0]
+
+
+async def write_many(sql: str, parameters: typing.Iterable[typing.Iterable]) -> WriteResult:
+    """
+    run one statement for every parameter set and wait until they're committed. see write_all
+    """
+    return (await write_all(Write(sql, parameters, many=True)))[0]
+
+
+async def committer():
+    # runs until close(), never cancelled so a batch can't be cut off halfway through
+    while not closing:
+        await writes_waiting.wait()
+        # give writes from the same burst a moment to join in
+        await asyncio.sleep(group_commit_window)
+        try:
+            await commit_pending()
+        except Exception as e:
+            # the batch's callers already got the error, keep committing everyone else's writes
+            logger.error(f"group commit failed: {e}", exc_info=(type(e), e, e.__traceback__))
+
+
+async def commit_pending():
+    """
+    run and commit every pending write
+    """
+    global pending_writes
+    writes_waiting.clear()
+    if not pending_writes:
+        return
+    batch, pending_writes = pending_writes, []
+    results: typing.List[typing.Union[typing.List[WriteResult], BaseException]] = []
+    committed = False
+    error: BaseException = RuntimeError("group commit was interrupted")
+    try:
+        if not db.in_transaction:
+            await db.execute("BEGIN")
+        for pending in batch:
+            # a savepoint for each caller's writes so one failing doesn't take down everyone else's
+            await db.execute("SAVEPOINT pending_writes")
+            try:
+                cursors = [await (db.executemany if write.many else db.execute)(write.sql, write.parameters)
+                           for write in pending.writes]
+                results.append([WriteResult(cursor.rowcount, cursor.lastrowid) for cursor in cursors])
+            except Exception as e:
+                await db.execute("ROLLBACK TO pending_writes")
+                results.append(e)
+            await db.execute("RELEASE pending_writes")
+        await db.commit()
+        committed = True
+    except Exception as e:
+        error = e
+        logger.error(f"group commit of {len(batch)} write(s) failed: {e}")
+        if db.in_transaction:
+            await db.rollback()
+    finally:
+        # every caller gets a result or an error, even if this was cut off partway, or they'd wait forever
+        if committed:
+            group_commit_stats["commits"] += 1
+        else:
+            # nothing was committed
+            results = [error] * len(batch)
+        for pending, result in zip(batch, results):
+            group_commit_stats["writes"] += len(pending.writes)
+            # the caller may have been cancelled while waiting
+            if pending.done.done():
+                continue
+            if isinstance(result, BaseException):
+                group_commit_stats["failed"] += len(pending.writes)
+                pending.done.set_exception(result)
+            else:
+                pending.done.set_result(result)
+
+
+@contextlib.asynccontextmanager
+async def read() -> typing.AsyncIterator[InstrumentedConnection]:
+    """
+    borrow a read only connection for SELECTs that don't need to wait on writes.
+    it only sees committed data, so commit anything the read depends on first.
+    """
+    con = await read_pool.get()
+    try:
+        yield con
+    finally:
+        read_pool.put_nowait(con)
+
+
+async def close():
+    global closing
+    if committer_task is not None:
+        closing = True
+        writes_waiting.set()
+        await committer_task
+        # anything written while the committer was finishing up
+        await commit_pending()
+    while read_pool is not None and not read_pool.empty():
+        await read_pool.get_nowait().close()
+    if db is not None:
+        await db.close()
+
+
+def stats() -> dict:
+    """
+    :return: JSON serializable stats for every statement run so far, the ones that took the most time in total first
+    """
+    return {
+        sql: {
+            "calls": stats.calls,
+            "rows": stats.rows,
+            "total_seconds": stats.total_seconds,
+            "fetch_seconds": stats.fetch_seconds,
+            "duration": stats.duration.to_dict()
+        }
+        for sql, stats in sorted(query_stats.items(), key=lambda item: item[1].total_seconds, reverse=True)
+    }
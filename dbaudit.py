@@ -0,0 +1,192 @@
+"""
+finds every SQL statement in the bot's source and runs EXPLAIN QUERY PLAN on it against an empty database built from
+makedatabase.sql and any tables the source creates itself, flagging statements that scan a whole table.
+values formatted into statements are followed back to the strings they're assigned where possible, so every way a
+statement can be built is checked.
+doesn't need the bot's dependencies or a real database. run from the repo root: python dbaudit.py [-v] [files...]
+-v prints the plan of every statement, not just the flagged ones. exits with 1 if any full table scans were found.
+"""
+import ast
+import glob
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import typing
+
+# the bot's SQL keywords are always uppercase, which tells statements apart from docstrings that start with "Delete"
+sql_start = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\s+\S")
+# "SCAN table" on its own reads every row. "SCAN table USING INDEX" walks an index, which is fine
+full_scan = re.compile(r"^SCAN (\w+)$")
+named_param = re.compile(r"(?<![:\w]):(\w+)")
+numbered_param = re.compile(r"\?(\d+)")
+# fields of str.format templates, which are checked where they're formatted
+format_field = re.compile(r"{\w*}")
+# stands in for a formatted value that can't be worked out statically
+unknown = "\0"
+# what unknown values are tried as until the statement parses: a value, an optional clause left out, or a column
+unknown_guesses = ("?", "", "rowid")
+# tables meant to be read whole. they're small, or every row is needed
+whole_tables = {"sqlite_master", "archive_guilds", "verses"}
+# migrations rewrite whole tables once, their scans aren't counted
+one_off_files = {"migrations.py"}
+
+
+class Statement(typing.NamedTuple):
+    file: str
+    line: int
+    # every way the statement can be assembled, as far as can be told from the source. values that can't be told are
+    # marked with unknown
+    variants: typing.List[str]
+
+
+def string_values(node: ast.AST, names: typing.Dict[str, typing.List[str]]) -> typing.Optional[typing.List[str]]:
+    """
+    :param names: strings each variable name is assigned in the file
+    :return: every string an expression can evaluate to, or None if it isn't a string
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    if isinstance(node, ast.IfExp):
+        body, orelse = string_values(node.body, names), string_values(node.orelse, names)
+        if body is not None and orelse is not None:
+            return body + orelse
+    if isinstance(node, ast.JoinedStr):
+        parts = [string_values(part.value, names) or [unknown] if isinstance(part, ast.FormattedValue)
+                 else [part.value] for part in node.values]
+        return ["".join(combination) for combination in itertools.product(*parts)]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = string_values(node.left, names), string_values(node.right, names)
+        if left is not None and right is not None:
+            return [a + b for a in left for b in right]
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "format" \
+            and not node.keywords:
+        templates = string_values(node.func.value, names)
+        args = [string_values(arg, names) or [unknown] for arg in node.args]
+        if templates is not None:
+            return [template.format(*combination) for template in templates for combination in itertools.product(*args)]
+    return None
+
+
+def assigned_strings(tree: ast.AST) -> typing.Dict[str, typing.List[str]]:
+    """
+    :return: the strings each name is assigned anywhere in the file, ignoring scope
+    """
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            values = string_values(node.value, names)
+            if values is not None:
+                names.setdefault(node.targets[0].id, []).extend(values)
+    return names
+
+
+def find_statements(file: str) -> typing.List[Statement]:
+    with open(file, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), file)
+    names = assigned_strings(tree)
+    statements = []
+    for node in ast.walk(tree):
+        # names are checked where they're assigned, and templates where they're formatted
+        if isinstance(node, ast.Name) or isinstance(node, ast.Constant) and format_field.search(str(node.value)):
+            continue
+        variants = string_values(node, names)
+        if variants is None or not sql_start.match(variants[0]):
+            continue
+        statements.append(Statement(file, node.lineno, list(dict.fromkeys(variants))))
+    # parts of a concatenated or formatted string are visited too, only keep the whole thing
+    return [s for s in statements if not any(o is not s and o.line == s.line and s.variants[0] in o.variants[0]
+                                             and o.variants[0] != s.variants[0] for o in statements)]
+
+
+def find_schema(file: str) -> typing.List[str]:
+    """
+    :return: tables the source creates itself, like migrations and other databases
+    """
+    with open(file, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), file)
+    return [node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)
+            and re.match(r"^\s*create table", node.value, re.IGNORECASE)]
+
+
+def explain(con: sqlite3.Connection, sql: str) -> typing.List[str]:
+    if unknown in sql:
+        error = None
+        for guess in unknown_guesses:
+            try:
+                return explain(con, sql.replace(unknown, guess))
+            except sqlite3.Error as e:
+                error = error or e
+        raise error
+    names = named_param.findall(sql)
+    numbered = [int(number) for number in numbered_param.findall(sql)]
+    if names:
+        params = {name: None for name in names}
+    else:
+        # ?1 can be used more than once
+        params = (None,) * (max(numbered) if numbered else sql.count("?"))
+    while True:
+        try:
+            return [row[3] for row in con.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except sqlite3.OperationalError as e:
+            # functions the code registers on its own connection, any function does for a plan
+            if not (match := re.match(r"no such function: (\w+)$", str(e))):
+                raise
+            con.create_function(match.group(1), -1, lambda *args: None)
+
+
+def shown(sql: str) -> str:
+    return " ".join(sql.replace(unknown, "{}").split())
+
+
+def main(files: typing.List[str], verbose: bool = False) -> int:
+    con = sqlite3.connect(":memory:")
+    with open("makedatabase.sql") as f:
+        con.executescript(f.read())
+    for file in sorted(glob.glob("*.py")):
+        for schema in find_schema(file):
+            try:
+                con.executescript(schema)
+            except sqlite3.Error:
+                # already in makedatabase.sql
+                pass
+    scans = 0
+    failed = 0
+    for file in files:
+        for statement in find_statements(file):
+            where = f"{statement.file}:{statement.line}"
+            plans = {}
+            error = None
+            for sql in statement.variants:
+                try:
+                    plans[sql] = explain(con, sql)
+                except sqlite3.Error as e:
+                    error = error or e
+            if error is not None:
+                # usually SQL assembled at runtime in a way this can't follow
+                print(f"{where}: couldn't explain ({error}): {shown(statement.variants[0])}")
+                failed += 1
+                continue
+            for sql, plan in plans.items():
+                tables = [match.group(1) for step in plan
+                          if (match := full_scan.match(step)) and match.group(1) not in whole_tables]
+                counted = tables and os.path.basename(statement.file) not in one_off_files
+                if counted:
+                    scans += 1
+                    print(f"{where}: full scan of {', '.join(tables)}: {shown(sql)}")
+                elif verbose:
+                    print(f"{where}: {shown(sql)}")
+                if counted or verbose:
+                    for step in plan:
+                        print(f"    {step}")
+    print(f"{scans} statement(s) with full table scans, {failed} couldn't be explained")
+    return 1 if scans else 0
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    verbose = "-v" in args
+    args = [arg for arg in args if arg != "-v"]
+    sys.exit(main(args or sorted(glob.glob("*.py")), verbose))
@@ -1,6 +1,4 @@
-import copy
 import math
-import re
 import typing
 
 import discord
@@ -22,8 +20,10 @@ def add_long_field(embed: discord.Embed, name: str, value: str, inline: bool = F
             value = "`No Content`"
         return embed.add_field(name=name, value=value, inline=inline)
     else:
-        for i, section in enumerate(re.finditer('.{1,1024}', value, flags=re.S)):  # split every 1024 chars
-            embed.add_field(name=f"{name} `({i + 1}/{math.ceil(len(value) / 1024)})`", value=section[0], inline=inline)
+        sections = math.ceil(len(value) / 1024)
+        for i in range(sections):  # split every 1024 chars
+            embed.add_field(name=f"{name} `({i + 1}/{sections})`", value=value[i * 1024:(i + 1) * 1024],
+                            inline=inline)
     if len(embed) > 6000 and erroriftoolong:
         raise Exception(f"Generated embed exceeds maximum size. ({len(embed)} > 6000)")
     return embed
@@ -35,20 +35,27 @@ def split_embed(embed: discord.Embed) -> typing.List[discord.Embed]:
     :param embed: the initial embed
     :return: a list of embeds, none of which should have more than 25 fields or more than 6000 chars
     """
-    out = []
-    baseembed = copy.deepcopy(embed)
-    baseembed.clear_fields()
-    if len(baseembed) > 6000:
+    base = embed.to_dict()
+    fields = base.pop("fields", [])
+    # everything but the fields is the same on every page, so only measure it once
+    baselength = len(discord.Embed.from_dict(base))
+    if baselength > 6000:
         raise Exception(f"Embed without fields exceeds 6000 chars.")
-    currentembed = copy.deepcopy(baseembed)
-    for field in embed.fields:  # for every field in the embed
-        currentembed.add_field(name=field.name, value=field.value,
-                               inline=field.inline)  # add it to the "currentembed" object we are working on
-        if len(currentembed) > 6000 or len(currentembed.fields) > 25:  # if the currentembed object is too big
-            currentembed.remove_field(-1)  # remove the field
-            out.append(currentembed)  # add the embed to our output
-            currentembed = copy.deepcopy(baseembed)  # make a new embed
-            currentembed.add_field(name=field.name, value=field.value,
-                                   inline=field.inline)  # add the field to our new embed instead
-    out.append(currentembed)  # add the final embed which didnt exceed 6000 to the output
+
+    def page(pagefields: typing.List[dict]) -> discord.Embed:
+        return discord.Embed.from_dict({**base, "fields": pagefields})
+
+    out = []
+    currentfields = []
+    currentlength = baselength
+    for field in fields:  # for every field in the embed
+        fieldlength = len(field["name"]) + len(field["value"])
+        # if adding it would make the page too big, finish this page and start a new one
+        if currentfields and (currentlength + fieldlength > 6000 or len(currentfields) == 25):
+            out.append(page(currentfields))
+            currentfields = []
+            currentlength = baselength
+        currentfields.append(field)
+        currentlength += fieldlength
+    out.append(page(currentfields))  # add the final page which didnt exceed 6000 to the output
     return out
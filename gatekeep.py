@@ -6,8 +6,9 @@ from discord.ext import commands
 
 import database
 import modlog
+import serverconfig
 from clogs import logger
-from moderation import update_server_config, mod_only
+from moderation import get_server_config, update_server_config, mod_only
 
 
 class GateKeep(commands.Cog):
@@ -48,9 +49,8 @@ class GateKeep(commands.Cog):
                     except discord.HTTPException:
                         await th.send(f"User left, locking thread.")
                         await th.edit(archived=True, locked=True)
-        await database.db.execute("DELETE FROM members_to_verify WHERE guild=? AND member=?",
-                                  (memberguild.id, memberid))
-        await database.db.commit()
+        await database.write("DELETE FROM members_to_verify WHERE guild=? AND member=?",
+                             (memberguild.id, memberid))
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
@@ -62,38 +62,34 @@ class GateKeep(commands.Cog):
         if member.guild.id == 829973626442088468:  # hos
             await member.remove_roles(*[role for role in member.roles if role.is_assignable()],
                                       atomic=False)  # remove roles
-        async with database.db.execute(
-                "SELECT verification_channel,mod_role,verified_role,verification_text FROM server_config WHERE guild=?",
-                (member.guild.id,)) as cur:
-            res = await cur.fetchone()
-        if res and res[0]:
+        conf = await serverconfig.get(member.guild.id)
+        if conf.verification_channel:
             if "PRIVATE_THREADS" in member.guild.features:
                 # create thread
-                thread = await member.guild.get_channel(res[0]) \
+                thread = await member.guild.get_channel(conf.verification_channel) \
                     .create_thread(name=f"Verification for {member}", reason=f"Automatic verification for {member}")
             else:
-                thread = await member.guild.get_channel(res[0]) \
+                thread = await member.guild.get_channel(conf.verification_channel) \
                     .create_thread(name=f"Verification for {member}", reason=f"Automatic verification for {member}",
                                    type=discord.ChannelType.public_thread)
 
                 # delete the thread announcement message cause hehehahgrrrrr
                 async def delthread():
-                    async for msg in member.guild.get_channel(res[0]).history():
+                    async for msg in member.guild.get_channel(conf.verification_channel).history():
                         if msg.flags.has_thread and msg.thread == thread:
                             await msg.delete()
                             break
 
                 asyncio.create_task(delthread())
                 # add to db
-            await database.db.execute("REPLACE INTO members_to_verify (guild, member, thread) VALUES (?,?,?)",
-                                      (member.guild.id, member.id, thread.id))
-            await database.db.commit()
+            await database.write("REPLACE INTO members_to_verify (guild, member, thread) VALUES (?,?,?)",
+                                 (member.guild.id, member.id, thread.id))
             # add mods and user to thread
-            if res[1]:
-                modping = member.guild.get_role(res[1]).mention
+            if conf.mod_role:
+                modping = member.guild.get_role(conf.mod_role).mention
             else:
                 modping = member.guild.owner.mention
-            await thread.send(f"{modping} {member.mention}\n{res[3]}",
+            await thread.send(f"{modping} {member.mention}\n{conf.verification_text}",
                               allowed_mentions=discord.AllowedMentions.all())
 
     @commands.command()
@@ -130,18 +126,14 @@ class GateKeep(commands.Cog):
         async with ctx.typing():
 
             # get or create role
-            async with database.db.execute(
-                    "SELECT verified_role,verification_channel,mod_role from server_config WHERE guild=?",
-                    (ctx.guild.id,)) as cur:
-                res = await cur.fetchone()
+            conf = await serverconfig.get(ctx.guild.id)
             # action only needs to be taken if role does not exist
-            if not (res and res[0] and (verified_role := ctx.guild.get_role(res[0]))):
+            if not (conf.verified_role and (verified_role := ctx.guild.get_role(conf.verified_role))):
                 verified_role = await ctx.guild.create_role(name="[MelUtils] Verified",
                                                             permissions=discord.Permissions(view_channel=True))
-                await database.db.execute("UPDATE server_config SET verified_role=? WHERE guild=?",
-                                          (verified_role.id, ctx.guild.id))
-            if res and res[2]:
-                mod_role = ctx.guild.get_role(res[2])
+                await update_server_config(ctx.guild.id, "verified_role", verified_role.id)
+            if conf.mod_role:
+                mod_role = ctx.guild.get_role(conf.mod_role)
             else:
                 mod_role = None
             ovrs = {
@@ -151,17 +143,15 @@ class GateKeep(commands.Cog):
             }
             if mod_role:
                 ovrs[mod_role] = discord.PermissionOverwrite(view_channel=True)
-            if not (res and res[1] and (verify_channel := ctx.guild.get_channel(res[1]))):
+            if not (conf.verification_channel and
+                    (verify_channel := ctx.guild.get_channel(conf.verification_channel))):
                 verify_channel = await ctx.guild.create_text_channel("melutils-verification", overwrites=ovrs)
-                await database.db.execute("UPDATE server_config SET verification_channel=? WHERE guild=?",
-                                          (verify_channel.id, ctx.guild.id))
+                await update_server_config(ctx.guild.id, "verification_channel", verify_channel.id)
             else:  # channel exists
                 # update its overwrites properly
                 verify_channel.overwrites.update(ovrs)
                 await verify_channel.edit(overwrites=verify_channel.overwrites)
 
-            await database.db.commit()
-
             # give verified role to all members
             v_actions = [m.add_roles(verified_role) for m in ctx.guild.members if verified_role not in m.roles]
             await asyncio.gather(*v_actions, return_exceptions=True)
@@ -220,12 +210,10 @@ class GateKeep(commands.Cog):
         # if we can find the relevant member for the channel
         if res and res[0]:
             member = ctx.guild.get_member(res[0])
-            async with database.db.execute("SELECT verified_role FROM server_config WHERE guild=?",
-                                           (ctx.guild.id,)) as cur:
-                res2 = await cur.fetchone()
+            verified_role = await get_server_config(ctx.guild.id, "verified_role")
             # if we can get the guild's verifed role, add it and
-            if res2 and res2[0]:
-                role = ctx.guild.get_role(res2[0])
+            if verified_role:
+                role = ctx.guild.get_role(verified_role)
                 await ctx.send(f"{member.mention} has been verified.")
                 await member.add_roles(role)
                 # lock thread, hide from user cause lol?
@@ -233,9 +221,8 @@ class GateKeep(commands.Cog):
                 await ctx.channel.edit(archived=True, locked=True)
                 await modlog.modlog(f"{ctx.author.mention} (@{ctx.author}) verified {member.mention} (@{member})",
                                     ctx.guild.id, member.id, ctx.author.id)
-                await database.db.execute("DELETE FROM members_to_verify WHERE guild=? AND member=?",
-                                          (ctx.guild.id, member.id))
-                await database.db.commit()
+                await database.write("DELETE FROM members_to_verify WHERE guild=? AND member=?",
+                                     (ctx.guild.id, member.id))
             else:
                 await ctx.reply("❌ Server has no verified role. Run `m.initverification` to create one.")
         else:
@@ -262,10 +249,7 @@ class GateKeep(commands.Cog):
                     (ctx.guild.id,)) as cur:
                 cur: aiosqlite.Cursor
                 saved_members = await cur.fetchall()
-            async with database.db.execute("SELECT verified_role FROM server_config WHERE guild=?",
-                                           (ctx.guild.id,)) as cur:
-                res2 = await cur.fetchone()
-            verified_role = ctx.guild.get_role(res2[0])
+            verified_role = ctx.guild.get_role(await get_server_config(ctx.guild.id, "verified_role"))
             members = list(ctx.guild.members)
             for member in members:
                 for vmember, vthread in saved_members:
@@ -277,9 +261,8 @@ class GateKeep(commands.Cog):
                                 if thread.archived and unarchive_all:
                                     await thread.edit(archived=False)
                             else:
-                                await database.db.execute("DELETE FROM members_to_verify WHERE guild=? AND member=?",
-                                                          (ctx.guild.id, member.id))
-                                await database.db.commit()
+                                await database.write("DELETE FROM members_to_verify WHERE guild=? AND member=?",
+                                                     (ctx.guild.id, member.id))
                         except discord.DiscordException:
                             if verified_role not in member.roles and not member.bot:
                                 # member in db, but thread is gone. run first-time setup
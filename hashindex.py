@@ -0,0 +1,137 @@
+import asyncio
+import typing
+from collections import defaultdict
+
+import numpy as np
+
+import database
+
+# image set channels can have 100k+ images, comparing a new image against every one of them one at a time is too slow.
+# each channel's hashes are kept in one contiguous uint64 array, loaded from the db the first time the channel is
+# checked and updated along with the db after that, so a lookup is a single vectorized XOR and popcount.
+
+
+class Image(typing.NamedTuple):
+    message: int
+    att_url: str
+    width: int
+    height: int
+
+
+def pack(imhash) -> bytes:
+    """
+    :param imhash: an ImageHash
+    :return: the hash as it's stored in the db, big endian bytes of the same bits str(imhash) gives as hex
+    """
+    return int(str(imhash), 16).to_bytes(-(-imhash.hash.size // 8), "big")
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words)
+else:
+    # numpy < 2 has no popcount, count each byte with a table instead
+    popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        return popcount_table[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+class HashIndex:
+    """
+    every hash in an image set channel, one row of uint64 words per image.
+    the order of bytes within a row doesn't matter to hamming distance, so stored bytes are padded and viewed as is.
+    """
+
+    def __init__(self, hashbytes: int, capacity: int = 64):
+        self.hashbytes = hashbytes
+        self.words = -(-hashbytes // 8)
+        self.hashes = np.zeros((capacity, self.words), dtype=np.uint64)
+        # parallel to hashes, so finding a message's rows and sorting matches is vectorized too
+        self.messages = np.zeros(capacity, dtype=np.int64)
+        self.images: typing.List[Image] = []
+        self.urls: typing.Set[str] = set()
+
+    def __len__(self):
+        return len(self.images)
+
+    def row(self, imhash: bytes) -> np.ndarray:
+        return np.frombuffer(imhash.ljust(self.words * 8, b"\0"), dtype=np.uint64)
+
+    def extend(self, hashes: typing.List[bytes], images: typing.List[Image]):
+        """
+        add many images at once. images already in the index are skipped.
+        """
+        new = [(imhash, image) for imhash, image in zip(hashes, images) if image.att_url not in self.urls]
+        if not new:
+            return
+        start, end = len(self), len(self) + len(new)
+        if end > len(self.hashes):
+            # double so a channel being hashed one image at a time doesn't copy the array every time
+            capacity = max(end, len(self.hashes) * 2)
+            self.hashes = np.resize(self.hashes, (capacity, self.words))
+            self.messages = np.resize(self.messages, capacity)
+        padded = b"".join(imhash.ljust(self.words * 8, b"\0") for imhash, _ in new)
+        self.hashes[start:end] = np.frombuffer(padded, dtype=np.uint64).reshape(-1, self.words)
+        self.messages[start:end] = [image.message for _, image in new]
+        self.images += [image for _, image in new]
+        self.urls.update(image.att_url for _, image in new)
+
+    def add(self, imhash: bytes, image: Image):
+        self.extend([imhash], [image])
+
+    def remove_message(self, message: int):
+        keep = self.messages[:len(self)] != message
+        if keep.all():
+            return
+        self.urls.difference_update(image.att_url for image in self.images if image.message == message)
+        self.images = [image for image in self.images if image.message != message]
+        count = len(self)
+        self.hashes[:count] = self.hashes[:len(keep)][keep]
+        self.messages[:count] = self.messages[:len(keep)][keep]
+
+    def search(self, imhash: bytes, maxdistance: int) -> typing.List[typing.Tuple[int, bytes, Image]]:
+        """
+        :return: (distance, hash, image) for every image within maxdistance, oldest first
+        """
+        count = len(self)
+        distances = popcount(self.hashes[:count] ^ self.row(imhash)).sum(axis=1)
+        found = np.flatnonzero(distances <= maxdistance)
+        # the first image sent is the original
+        found = found[np.argsort(self.messages[found], kind="stable")]
+        return [(int(distances[i]), self.hashes[i].tobytes()[:self.hashbytes], self.images[i]) for i in found]
+
+
+indexes: typing.Dict[int, HashIndex] = {}
+# loads and invalidations for the same channel hold this so a load can't race a change to the channel's image set
+locks: typing.DefaultDict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+async def get(channel: int, hashsize: int) -> HashIndex:
+    """
+    get the index of a channel's hashes, loading it from the db if needed
+    :param channel: ID of the image set channel
+    :param hashsize: the channel's hash size. hashes of other sizes, from before it was changed, can't be compared.
+    """
+    if channel in indexes:
+        return indexes[channel]
+    async with locks[channel]:
+        if channel in indexes:
+            return indexes[channel]
+        # a hash is hashsize x hashsize bits
+        hashbytes = -(-hashsize ** 2 // 8)
+        async with database.db.execute("SELECT hash, message, att_url, image_width, image_height FROM imageset_hashes "
+                                       "WHERE channel=?", (channel,)) as cur:
+            rows = [row for row in await cur.fetchall() if len(row[0]) == hashbytes]
+        index = HashIndex(hashbytes, max(len(rows), 64))
+        index.extend([row[0] for row in rows], [Image(*row[1:]) for row in rows])
+        indexes[channel] = index
+        return index
+
+
+async def discard(channel: int):
+    """
+    forget a channel's index, so it's loaded again next time. for when the channel's image set is changed or removed.
+    """
+    async with locks[channel]:
+        indexes.pop(channel, None)
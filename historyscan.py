@@ -0,0 +1,226 @@
+import asyncio
+import inspect
+import re
+import time
+import typing
+
+import aiohttp
+import discord
+
+from clogs import logger
+
+# commands that read a channel's entire history all go through here, so the requests they make share one limiter
+# instead of each walking channels one at a time to stay clear of 429s.
+
+HistoryChannel = typing.Union[discord.TextChannel, discord.Thread, discord.VoiceChannel]
+
+# our share of discord's global limit of 50 requests per second, the rest of the bot needs some too
+requests_per_second = 20
+burst = 10
+# discord returns at most 100 messages per request
+page_size = 100
+
+channel_url = re.compile(r"/channels/(\d+)/messages$")
+
+
+class TokenBucket:
+    """
+    rate limiter for history requests.
+    discord's rate limit headers are fed into it, so a channel that runs out of requests is paused until its bucket
+    resets and a global 429 pauses every scan.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate: requests allowed per second
+        :param capacity: requests allowed at once after being idle
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # channel ID -> monotonic time its route's bucket resets
+        self.channel_paused_until: typing.Dict[int, float] = {}
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, channel: int):
+        """
+        wait until a history request for a channel is allowed
+        :param channel: ID of the channel the request is for
+        """
+        # channel pauses are waited out before queueing so one exhausted channel doesn't hold up the rest
+        while (wait := self.channel_paused_until.get(channel, 0) - time.monotonic()) > 0:
+            await asyncio.sleep(wait)
+        self.channel_paused_until.pop(channel, None)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float, channel: typing.Optional[int] = None):
+        """
+        stop handing out requests for a while
+        :param seconds: how long to pause for
+        :param channel: ID of the channel to pause, or None to pause everything
+        """
+        until = time.monotonic() + seconds
+        if channel is None:
+            self.paused_until = max(self.paused_until, until)
+        else:
+            self.channel_paused_until[channel] = max(self.channel_paused_until.get(channel, 0), until)
+
+
+limiter = TokenBucket(requests_per_second, burst)
+
+
+async def on_request_end(session: aiohttp.ClientSession, context, params: aiohttp.TraceRequestEndParams):
+    if params.method != "GET" or not (match := channel_url.search(params.url.path)):
+        return
+    channel = int(match.group(1))
+    headers = params.response.headers
+    if params.response.status == 429:
+        retry_after = float(headers.get("Retry-After", 1))
+        # a "shared" scope is a limit on the channel shared with other users, it still only applies to that channel
+        is_global = headers.get("X-RateLimit-Global") == "true"
+        logger.warning(f"history request for {channel} hit a {'global ' if is_global else ''}429, "
+                       f"pausing for {retry_after}s")
+        limiter.pause(retry_after, None if is_global else channel)
+    elif headers.get("X-RateLimit-Remaining") == "0":
+        limiter.pause(float(headers.get("X-RateLimit-Reset-After", 0)), channel)
+
+
+# passed to the bot as http_trace so the limiter sees every response discord.py gets
+trace_config = aiohttp.TraceConfig()
+trace_config.on_request_end.append(on_request_end)
+
+
+class Visitor:
+    """
+    receives every message of a scan. subclass and override what's needed.
+    messages from one channel arrive in order, messages from different channels are interleaved.
+    """
+
+    async def visit(self, message: discord.Message):
+        pass
+
+    async def channel_done(self, channel: HistoryChannel):
+        """called once a channel has been fully scanned, or skipped because it couldn't be read"""
+        pass
+
+
+VisitorFunction = typing.Callable[[discord.Message], typing.Any]
+
+
+class FunctionVisitor(Visitor):
+    def __init__(self, func: VisitorFunction):
+        """
+        :param func: function or async function that takes a message
+        """
+        self.func = func
+
+    async def visit(self, message: discord.Message):
+        result = self.func(message)
+        if inspect.isawaitable(result):
+            await result
+
+
+class HistoryScan:
+    """
+    one pass over the history of several channels, read concurrently, feeding every message to each visitor
+    """
+
+    def __init__(self, channels: typing.Iterable[HistoryChannel],
+                 *visitors: typing.Union[Visitor, VisitorFunction],
+                 oldest_first: bool = False, after: typing.Optional[typing.Mapping[int, int]] = None,
+                 concurrency: int = 4):
+        """
+        :param channels: channels and threads to scan
+        :param visitors: Visitors or functions that take a message
+        :param oldest_first: scan each channel from its first message instead of its latest
+        :param after: channel ID -> message ID, only messages after it are scanned in that channel
+        :param concurrency: how many channels to read at once
+        """
+        self.channels = list(channels)
+        self.visitors = [v if isinstance(v, Visitor) else FunctionVisitor(v) for v in visitors]
+        self.oldest_first = oldest_first
+        self.after = after or {}
+        self.concurrency = concurrency
+        # progress, can be read by visitors while the scan runs
+        self.messages = 0
+        self.channels_done = 0
+        self.active: typing.Set[HistoryChannel] = set()
+        self.skipped: typing.List[HistoryChannel] = []
+
+    def skipped_message(self) -> str:
+        """
+        :return: a line to add to command replies naming the channels that couldn't be read, or "" if there were none
+        """
+        if not self.skipped:
+            return ""
+        shown = ", ".join(channel.mention for channel in self.skipped[:10])
+        more = f" and {len(self.skipped) - 10} more" if len(self.skipped) > 10 else ""
+        return f"\n⚠️ Skipped {len(self.skipped)} channel(s) I can't read: {shown}{more}"
+
+    async def run(self) -> "HistoryScan":
+        queue = iter(self.channels)
+        # one exception stops every worker
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(min(self.concurrency, len(self.channels))):
+                tg.create_task(self.worker(queue))
+        return self
+
+    async def worker(self, queue: typing.Iterator[HistoryChannel]):
+        # iterators are shared safely between tasks since next() never awaits
+        for channel in queue:
+            self.active.add(channel)
+            try:
+                await self.scan_channel(channel)
+            except (discord.Forbidden, discord.NotFound) as e:
+                logger.debug(f"skipping {channel} in history scan: {e}")
+                self.skipped.append(channel)
+            finally:
+                self.active.discard(channel)
+            self.channels_done += 1
+            for visitor in self.visitors:
+                await visitor.channel_done(channel)
+
+    async def scan_channel(self, channel: HistoryChannel):
+        # paginate by hand so each request goes through the limiter
+        cursor = discord.Object(self.after[channel.id]) if channel.id in self.after else None
+        if not self.oldest_first:
+            end = cursor
+            cursor = None
+        while True:
+            await limiter.acquire(channel.id)
+            if self.oldest_first:
+                page = [m async for m in channel.history(limit=page_size, after=cursor, oldest_first=True)]
+            else:
+                page = [m async for m in channel.history(limit=page_size, before=cursor)]
+                if end is not None:
+                    page = [m for m in page if m.id > end.id]
+            for message in page:
+                self.messages += 1
+                for visitor in self.visitors:
+                    await visitor.visit(message)
+            if len(page) < page_size:
+                return
+            cursor = discord.Object(page[-1].id)
+
+
+async def scan(channels: typing.Iterable[HistoryChannel],
+               *visitors: typing.Union[Visitor, VisitorFunction],
+               **kwargs) -> HistoryScan:
+    """
+    scan the history of channels, see HistoryScan
+    :return: the finished scan, for its counts
+    """
+    return await HistoryScan(channels, *visitors, **kwargs).run()
@@ -1,14 +1,15 @@
-import asyncio
-import io
 import typing
 
 import aiohttp
 import discord
 import imagehash as imagehash
-from PIL import Image
 from discord.ext import commands
 
+import cpupool
 import database
+import hashindex
+import historyscan
+import imageworker
 import moderation
 from clogs import logger
 
@@ -29,8 +30,7 @@ async def saveurl(url) -> bytes:
 
 async def hashandresurl(url, size: int) -> typing.Tuple[imagehash.ImageHash, typing.Tuple[int, int]] | None:
     try:
-        im = Image.open(io.BytesIO(await saveurl(url)))
-        return imagehash.phash(im, size), im.size
+        return await cpupool.run(imageworker.hash_and_size, await saveurl(url), size)
     except Exception as e:
         logger.debug(f"hashing {url} failed due to {e}")
 
@@ -87,42 +87,39 @@ async def hashmessage(message: discord.Message, react=True):
                 if hashresult:
                     imhash, imres = hashresult
                     logger.debug(f"hash for {att.url} of {message.jump_url} is {imhash}")
-                    async with database.db.execute("SELECT hash, message, att_url, image_width, image_height FROM "
-                                                   "imageset_hashes WHERE channel=?",
-                                                   (message.channel.id,)) as cursor:
-                        async for (prevhash, prevmessage, att_url, old_w, old_h) in cursor:
-                            if (diff := imagehash.hex_to_hash(prevhash) - imhash) <= hashdiff:  # omg a match!!!!
-
-                                # only do anything if the message still exists
-                                try:
-                                    prevmessage = await message.channel.fetch_message(prevmessage)
-                                except discord.NotFound:
-                                    # message was deleted so byeeeeeeeeeee
-                                    await database.db.execute("DELETE FROM imageset_hashes WHERE message=?",
-                                                              (prevmessage,))
-                                    await database.db.commit()
-                                else:
-                                    logger.debug(f"hash for {message.jump_url} ({imhash}) matches hash for "
-                                                 f"{prevmessage.jump_url} ({prevhash}) by {diff}")
-                                    # do user defined behavior
-                                    await dup_funcs[duplicate_behavior](message, att.url, imres, prevmessage, att_url,
-                                                                        (old_w, old_h))
-                                    break  # doing it multiple times is silly
+                    index = await hashindex.get(message.channel.id, hashsize)
+                    packed = hashindex.pack(imhash)
+                    for diff, prevhash, prev in index.search(packed, hashdiff):  # omg a match!!!!
+                        # only do anything if the message still exists
+                        try:
+                            prevmessage = await message.channel.fetch_message(prev.message)
+                        except discord.NotFound:
+                            # message was deleted so byeeeeeeeeeee
+                            await database.write("DELETE FROM imageset_hashes WHERE message=?", (prev.message,))
+                            index.remove_message(prev.message)
+                        else:
+                            logger.debug(f"hash for {message.jump_url} ({imhash}) matches hash for "
+                                         f"{prevmessage.jump_url} ({prevhash.hex()}) by {diff}")
+                            # do user defined behavior
+                            await dup_funcs[duplicate_behavior](message, att.url, imres, prevmessage, prev.att_url,
+                                                                (prev.width, prev.height))
+                            break  # doing it multiple times is silly
 
                     if duplicate_behavior != "delete":
-                        await database.db.execute(
+                        att_url = att.url.split("?")[0]
+                        await database.write(
                             "INSERT INTO imageset_hashes(guild, channel, message, message_url, att_url, hash,"
                             " image_width, image_height) VALUES (?,?,?,?,?,?,?,?)",
-                            (message.guild.id, message.channel.id, message.id, message.jump_url, att.url.split("?")[0],
-                             str(imhash), imres[0], imres[1]))
-                        await database.db.commit()
+                            (message.guild.id, message.channel.id, message.id, message.jump_url, att_url,
+                             packed, imres[0], imres[1]))
+                        index.add(packed, hashindex.Image(message.id, att_url, imres[0], imres[1]))
         if react:
             await message.remove_reaction("⚙", message.guild.me)
 
 
-async def hashchannel(channel: typing.Union[discord.TextChannel, discord.Thread]):
-    async for message in channel.history(limit=None, oldest_first=True):
-        await hashmessage(message, False)
+async def hashchannels(channels: typing.Iterable[typing.Union[discord.TextChannel, discord.Thread]]) \
+        -> historyscan.HistoryScan:
+    return await historyscan.scan(channels, lambda message: hashmessage(message, False), oldest_first=True)
 
 
 async def callback(*args, **kwargs):
@@ -189,27 +186,29 @@ class ImageSetCog(commands.Cog):
                                        (channel.id, channel.guild.id)) as cur:
             exists = await cur.fetchone() is not None
 
-        await database.db.execute("REPLACE INTO imageset_channels(guild, channel, hashsize, hashdiff, "
-                                  "duplicate_behavior) VALUES (?,?,?,?,?)",
-                                  (channel.guild.id, channel.id, hashsize, hashdiff, duplicate_behavior))
-        await database.db.commit()
+        await database.write("REPLACE INTO imageset_channels(guild, channel, hashsize, hashdiff, "
+                             "duplicate_behavior) VALUES (?,?,?,?,?)",
+                             (channel.guild.id, channel.id, hashsize, hashdiff, duplicate_behavior))
+        # the hash size may have changed
+        await hashindex.discard(channel.id)
 
         if exists:
             await ctx.reply("✔ Updated Image Set.")
         else:
             msg = await ctx.reply("⚙ Hashing channel...")
-            await hashchannel(channel)
+            scan = await hashchannels([channel])
             await msg.delete()
-            await ctx.reply("✔ Created Image Set.")
+            await ctx.reply(f"✔ Created Image Set.{scan.skipped_message()}")
 
     @moderation.mod_only()
     @commands.command()
     async def removeimageset(self, ctx: commands.Context, channel: typing.Union[discord.TextChannel, discord.Thread]):
         assert channel.guild == ctx.guild, "channel must be in current guild."
-        cur = await database.db.execute("DELETE FROM imageset_channels WHERE channel=?", (channel.id,))
-        await database.db.execute("DELETE FROM imageset_hashes WHERE channel=?", (channel.id,))
-        await database.db.commit()
-        if cur.rowcount > 0:
+        result, _ = await database.write_all(
+            database.Write("DELETE FROM imageset_channels WHERE channel=?", (channel.id,)),
+            database.Write("DELETE FROM imageset_hashes WHERE channel=?", (channel.id,)))
+        await hashindex.discard(channel.id)
+        if result.rowcount > 0:
             await ctx.reply("✔️ Channel is no longer an Image Set.")
         else:
             await ctx.reply("⚠️ Channel is not an Image Set.")
@@ -226,8 +225,8 @@ class ImageSetCog(commands.Cog):
                         channels.append(await ctx.guild.fetch_channel(channel))
                     except discord.NotFound:
                         logger.debug(f"oopsie woopsie :3 (channel {channel} does not exist)")
-            await asyncio.gather(*[hashchannel(channel) for channel in channels])
-        await ctx.reply("Done!")
+            scan = await hashchannels(channels)
+        await ctx.reply(f"Done!{scan.skipped_message()}")
 
 
 # command here
@@ -0,0 +1,129 @@
+import io
+import typing
+
+import PIL.GifImagePlugin
+import imagehash
+from PIL import Image
+
+# image work that runs in cpupool's worker processes. everything here takes and returns plain bytes and tuples so it
+# pickles cheaply. workers do have main.py and the cogs imported, inherited from cpupool's forkserver, but the bot is
+# never started in them, so nothing here may rely on it or the db.
+
+
+def hash_and_size(data: bytes, size: int) -> typing.Tuple[imagehash.ImageHash, typing.Tuple[int, int]]:
+    """
+    perceptual hash of an image
+    :param data: bytes of the image file
+    :param size: hash size, the hash is size x size bits
+    :return: the hash and the image's resolution
+    """
+    im = Image.open(io.BytesIO(data))
+    return imagehash.phash(im, size), im.size
+
+
+def extract_and_resize_frames(im: PIL.GifImagePlugin.GifImageFile, resize_to):
+    """
+    Iterate the GIF, extracting each frame and resizing them
+
+    Returns:
+        An array of all frames
+    """
+
+    """
+    Pre-process pass over the image to determine the mode (full or additive).
+    Necessary as assessing single frames isn't reliable. Need to know the mode
+    before processing all frames.
+    """
+    mode = "full"
+    try:
+        while True:
+            if im.tile:
+                tile = im.tile[0]
+                update_region = tile[1]
+                update_region_dimensions = update_region[2:]
+                if update_region_dimensions != im.size:
+                    mode = 'partial'
+                    break
+            im.seek(im.tell() + 1)
+    except EOFError:
+        pass
+
+    im.seek(0)
+
+    i = 0
+    p = im.getpalette()
+    last_frame = im.convert('RGBA')
+
+    all_frames = []
+
+    try:
+        while True:
+            # print("saving %s (%s) frame %d, %s %s" % (path, mode, i, im.size, im.tile))
+
+            '''
+            If the GIF uses local colour tables, each frame will have its own palette.
+            If not, we need to apply the global palette to the new frame.
+            '''
+            try:
+                if not im.getpalette():
+                    im.putpalette(p)
+            except ValueError:
+                pass
+
+            new_frame = Image.new('RGBA', im.size)
+
+            '''
+            Is this file a "partial"-mode GIF where frames update a region of a different size to the entire image?
+            If so, we need to construct the new frame by pasting it on top of the preceding frames.
+            '''
+            if mode == 'partial':
+                new_frame.paste(last_frame)
+
+            new_frame.paste(im, (0, 0), im.convert('RGBA'))
+
+            all_frames.append(new_frame.resize(resize_to, Image.BICUBIC))
+
+            i += 1
+            last_frame = new_frame
+            im.seek(im.tell() + 1)
+    except EOFError:
+        pass
+
+    return all_frames
+
+
+def resize_gif(im: Image.Image, save_as, resize_to):
+    """
+    Resizes the GIF to a given length:
+
+    Args:
+        im: file
+        save_as (optional): Path of the resized gif. If not set, the original gif will be overwritten.
+        resize_to (optional): new size of the gif. Format: (int, int). If not set, the original GIF will be resized to
+                              half of its size.
+    """
+    all_frames = extract_and_resize_frames(im, resize_to)
+
+    if len(all_frames) == 1:
+        print("Warning: only 1 frame found")
+        all_frames[0].save(save_as, optimize=True, format="GIF")
+    else:
+        all_frames[0].save(save_as, optimize=True, save_all=True, append_images=all_frames[1:], loop=0, format="GIF",
+                           duration=im.info['duration'])
+
+
+def resize_banner(data: bytes) -> typing.Tuple[bytes, typing.Literal["png", "gif"]]:
+    """
+    resize an image to 16:9 for a server banner
+    :param data: bytes of the image file
+    :return: the resized image and its format
+    """
+    image: Image.Image = Image.open(io.BytesIO(data))
+    anim = getattr(image, "is_animated", False)
+    img_byte_arr = io.BytesIO()
+    if anim:
+        resize_gif(image, img_byte_arr, (192, 108))
+    else:
+        image = image.resize((1920, 1080), Image.BICUBIC)
+        image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue(), "gif" if anim else "png"
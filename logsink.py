@@ -0,0 +1,93 @@
+import typing
+
+import aiohttp
+import discord
+
+import database
+from clogs import logger
+
+# log channels can optionally be posted to through a webhook. webhooks have their own rate limits, so log storms
+# dont eat into the bot's send bucket that command replies use.
+
+session: typing.Optional[aiohttp.ClientSession] = None
+# channel ID -> webhook, or None if the channel has no webhook. filled in as channels are logged to.
+webhooks: typing.Dict[int, typing.Optional[discord.Webhook]] = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    # one session for every webhook so connections are reused
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession()
+    return session
+
+
+async def close():
+    # cached webhooks hold on to the session, they'd fail on it once it's closed
+    webhooks.clear()
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def get_webhook(channelid: int) -> typing.Optional[discord.Webhook]:
+    if channelid not in webhooks:
+        async with database.db.execute("SELECT webhook, token FROM log_webhooks WHERE channel=?",
+                                       (channelid,)) as cur:
+            row = await cur.fetchone()
+        webhooks[channelid] = discord.Webhook.partial(row[0], row[1], session=get_session()) if row else None
+    return webhooks[channelid]
+
+
+async def enable(channel: discord.TextChannel, name: str) -> discord.Webhook:
+    """
+    create a webhook to send logs to a channel through
+    :param channel: log channel
+    :param name: name of the webhook, shown as the author of logs
+    :return: the webhook
+    """
+    await disable(channel.id)
+    webhook = await channel.create_webhook(name=name, reason="Log webhook")
+    await database.write("REPLACE INTO log_webhooks (guild, channel, webhook, token) VALUES (?,?,?,?)",
+                         (channel.guild.id, channel.id, webhook.id, webhook.token))
+    webhooks[channel.id] = discord.Webhook.partial(webhook.id, webhook.token, session=get_session())
+    return webhook
+
+
+async def disable(channelid: int):
+    """
+    stop sending logs to a channel through its webhook and delete it
+    """
+    webhook = await get_webhook(channelid)
+    await database.write("DELETE FROM log_webhooks WHERE channel=?", (channelid,))
+    webhooks[channelid] = None
+    if webhook is not None:
+        try:
+            await webhook.delete(reason="Log webhook disabled")
+        except discord.HTTPException as e:
+            logger.debug(f"couldn't delete log webhook {webhook.id}: {e}")
+
+
+async def send(channel: discord.abc.Messageable, **kwargs):
+    """
+    send a log message, through the channel's webhook if it has one
+    :param channel: log channel
+    :param kwargs: passed to .send()
+    """
+    # webhooks don't use the bot's allowed_mentions, and logs mention the members they're about
+    kwargs.setdefault("allowed_mentions", discord.AllowedMentions.none())
+    webhook = await get_webhook(channel.id)
+    if webhook is not None:
+        try:
+            await webhook.send(**kwargs)
+            return
+        except discord.NotFound:
+            # webhook was deleted by someone, forget about it
+            logger.info(f"log webhook for {channel.id} is gone, sending normally")
+            await database.write("DELETE FROM log_webhooks WHERE channel=?", (channel.id,))
+            webhooks[channel.id] = None
+        except discord.HTTPException as e:
+            logger.info(f"log webhook for {channel.id} failed ({e}), sending normally")
+        # the webhook attempt already read the files
+        for file in kwargs.get("files") or []:
+            file.reset()
+    await channel.send(**kwargs)
@@ -32,10 +32,9 @@ class MacroCog(commands.Cog, name="Macros"):
             return
         # weird secondary server that doesn't work as well?
         content = content.replace("https://media.discordapp.net/", "https://cdn.discordapp.com/")
-        await database.db.execute(
+        await database.write(
             "INSERT INTO macros(server,name,content) VALUES (?,?,?)",
             (ctx.guild.id, name, content))
-        await database.db.commit()
         await ctx.reply(f"✔️ Added macro `{name}`.")
         await modlog(f"{ctx.author.mention} (`{ctx.author}`) added macro `{name}` with content:\n{quote(content)}",
                      ctx.guild.id, modid=ctx.author.id)
@@ -49,11 +48,10 @@ class MacroCog(commands.Cog, name="Macros"):
         :param ctx: discord context
         :param name: name of the macro
         """
-        cur = await database.db.execute(
+        result = await database.write(
             "DELETE FROM macros WHERE server=? AND name=?",
             (ctx.guild.id, name))
-        await database.db.commit()
-        if cur.rowcount > 0:
+        if result.rowcount > 0:
             await ctx.reply(f"✔️ Deleted macro {name}.")
             await modlog(f"{ctx.author.mention} (`{ctx.author}`) deleted macro `{name}`.", ctx.guild.id,
                          modid=ctx.author.id)
@@ -1,14 +1,17 @@
+import collections
 import glob
 import itertools
 import os
 import sqlite3
+import typing
 
 import discord
 from discord.ext import commands
 
 import config
 import database
-import errhandler
+import historyscan
+import migrations
 import scheduler
 from admincommands import AdminCommands
 from autoreaction import AutoReactionCog
@@ -22,6 +25,7 @@ from gatekeep import GateKeep
 from helpcommand import HelpCommand
 from imagesetcog import ImageSetCog
 from macro import MacroCog
+from messagearchive import MessageArchive
 from moderation import ModerationCog
 from modlog import ModLogInitCog
 from nitroroles import NitroRolesCog
@@ -30,24 +34,30 @@ from utilitycommands import UtilityCommands
 from wordsinthebible import BibleCog
 from xp import ExperienceCog
 
-if not os.path.exists(config.temp_dir.rstrip("/")):
-    os.mkdir(config.temp_dir.rstrip("/"))
-for f in glob.glob(f'{config.temp_dir}*'):
-    os.remove(f)
-# init db if not ready
-logger.debug("checking db")
-con = sqlite3.connect("database.sqlite")
-cur = con.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name != 'sqlite_master' AND name != "
-                  "'sqlite_sequence'")
-numoftables = cur.fetchone()[0]
-if numoftables == 0:
-    logger.debug("detected empty database, initializing")
-    with open("makedatabase.sql", "r") as f:
-        makesql = f.read()
-    with con:
-        con.executescript(makesql)
-    logger.debug("initialized db!")
-con.close()
+
+def setup():
+    if not os.path.exists(config.temp_dir.rstrip("/")):
+        os.mkdir(config.temp_dir.rstrip("/"))
+    for f in glob.glob(f'{config.temp_dir}*'):
+        os.remove(f)
+    # init db if not ready
+    logger.debug("checking db")
+    con = sqlite3.connect("database.sqlite")
+    cur = con.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name != 'sqlite_master' AND name != "
+                      "'sqlite_sequence'")
+    numoftables = cur.fetchone()[0]
+    if numoftables == 0:
+        logger.debug("detected empty database, initializing")
+        with open("makedatabase.sql", "r") as f:
+            makesql = f.read()
+        with con:
+            con.executescript(makesql)
+        migrations.mark_up_to_date(con)
+        logger.debug("initialized db!")
+    else:
+        migrations.migrate(con)
+    con.close()
+
 
 # loop = asyncio.new_event_loop()
 # loop.run_until_complete(create_db())
@@ -56,29 +66,39 @@ con.close()
 # make copy of .reply() function
 discord.Message.orig_reply = discord.Message.reply
 
+# IDs of recently deleted messages, so replies to them can fall back without asking discord if they still exist
+recently_deleted: typing.OrderedDict[int, None] = collections.OrderedDict()
+recently_deleted_max = 10_000
+
+
+def mark_deleted(message_id: int):
+    recently_deleted[message_id] = None
+    if len(recently_deleted) > recently_deleted_max:
+        recently_deleted.popitem(last=False)
+
 
 async def safe_reply(self: discord.Message, *args, **kwargs) -> discord.Message:
     # replies to original message if it exists, just sends in channel if it doesnt
-    try:
-        # retrieve this message, will throw NotFound if its not found and go to the fallback option.
-        # turns out trying to send a message will close any file objects which causes problems
-        await self.channel.fetch_message(self.id)
-        # reference copy of .reply() since this func will override .reply()
-        return await self.orig_reply(*args, **kwargs)
-    # for some reason doesnt throw specific error
-    # if its unrelated httpexception itll just throw again and fall to the
-    # error handler hopefully
-    except (discord.errors.NotFound, discord.errors.HTTPException) as e:
-        logger.debug(f"abandoning reply to {self.id} due to {errhandler.get_full_class_name(e)}, "
-                     f"sending message in {self.channel.id}.")
-        # mention author
-        author = self.author.mention
-        if len(args):
-            content = author + (args[0] or "")[:2000 - len(author)]
-        else:
-            content = author
-        return await self.channel.send(content, **kwargs, allowed_mentions=discord.AllowedMentions(
-            everyone=False, users=True, roles=False, replied_user=True))
+    if self.id not in recently_deleted:
+        try:
+            return await self.channel.send(*args, reference=self.to_reference(), **kwargs)
+        except discord.HTTPException as e:
+            # deleted before we started tracking deletes, or while disconnected. anything else goes to the error handler
+            if not (e.code == 50035 and "message_reference" in e.text):
+                raise
+        mark_deleted(self.id)
+        # the failed send already read the files
+        for file in kwargs.get("files") or ([kwargs["file"]] if kwargs.get("file") else []):
+            file.reset()
+    logger.debug(f"abandoning reply to deleted message {self.id}, sending message in {self.channel.id}.")
+    # mention author
+    author = self.author.mention
+    if len(args):
+        content = author + (args[0] or "")[:2000 - len(author)]
+    else:
+        content = author
+    return await self.channel.send(content, **kwargs, allowed_mentions=discord.AllowedMentions(
+        everyone=False, users=True, roles=False, replied_user=True))
 
 
 # override .reply()
@@ -117,6 +137,7 @@ class MyBot(commands.Bot):
         await bot.add_cog(GateKeep(bot))
         await bot.add_cog(BibleCog(bot))
         await bot.add_cog(ImageSetCog(bot))
+        await bot.add_cog(MessageArchive(bot))
         await scheduler.start()
 
 
@@ -124,7 +145,8 @@ bot = MyBot(command_prefix=commands.when_mentioned_or(*allcasecombinations(confi
             case_insensitive=True,
             activity=activity,
             intents=intents, allowed_mentions=discord.AllowedMentions(everyone=False, users=False, roles=False,
-                                                                      replied_user=True))
+                                                                      replied_user=True),
+            http_trace=historyscan.trace_config)
 
 
 def logcommand(cmd):
@@ -134,6 +156,17 @@ def logcommand(cmd):
     return cmd
 
 
+@bot.listen()
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    mark_deleted(payload.message_id)
+
+
+@bot.listen()
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    for message_id in payload.message_ids:
+        mark_deleted(message_id)
+
+
 @bot.listen()
 async def on_command(ctx):
     if isinstance(ctx.channel, discord.DMChannel):
@@ -169,4 +202,7 @@ async def leave(ctx: commands.Context, guild: discord.Guild):
     await ctx.reply(f"Left {guild} ({guild.id})")
 
 
-bot.run(config.bot_token)
+# cpupool's worker processes import this module too, they mustn't touch the db or log in
+if __name__ == "__main__":
+    setup()
+    bot.run(config.bot_token)
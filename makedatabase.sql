@@ -17,6 +17,12 @@ create table auto_reactions
     react_to_threads bool default false not null
 );
 
+create index auto_reactions_channel
+    on auto_reactions (channel);
+
+create index auto_reactions_guild
+    on auto_reactions (guild);
+
 create table birthdays
 (
     user     int not null
@@ -43,6 +49,9 @@ create table experience
         primary key (user, guild)
 );
 
+create index experience_guild
+    on experience (guild, experience);
+
 create table guild_xp_exclusions
 (
     guild         integer            not null,
@@ -63,6 +72,9 @@ create table imageset_channels
         primary key (guild, channel)
 );
 
+create index imageset_channels_channel
+    on imageset_channels (channel);
+
 create table imageset_hashes
 (
     guild        integer not null,
@@ -72,12 +84,18 @@ create table imageset_hashes
         constraint key_name
             primary key
                 on conflict ignore,
-    hash         text    not null,
+    hash         blob    not null,
     message_url  text    not null,
     image_width  integer not null,
     image_height integer not null
 );
 
+create index imageset_hashes_channel
+    on imageset_hashes (channel);
+
+create index imageset_hashes_message
+    on imageset_hashes (message);
+
 create table lockedchannelperms
 (
     guild   integer not null,
@@ -85,6 +103,9 @@ create table lockedchannelperms
     data    text
 );
 
+create index lockedchannelperms_guild_channel
+    on lockedchannelperms (guild, channel);
+
 create table macros
 (
     server  int                 not null,
@@ -105,6 +126,12 @@ create table members_to_verify
     thread integer
 );
 
+create index members_to_verify_guild_member
+    on members_to_verify (guild, member);
+
+create index members_to_verify_guild_thread
+    on members_to_verify (guild, thread);
+
 create table modlog
 (
     guild     int not null,
@@ -114,6 +141,9 @@ create table modlog
     datetime  int
 );
 
+create index modlog_guild_user
+    on modlog (guild, user, datetime);
+
 create table schedule
 (
     id        integer  not null
@@ -121,9 +151,21 @@ create table schedule
             primary key autoincrement,
     eventtype text     not null,
     eventtime DATETIME not null,
-    eventdata json     not null
+    eventdata json     not null,
+    guild     integer,
+    member    integer,
+    user      integer
 );
 
+create index schedule_eventtime
+    on schedule (eventtime);
+
+create index schedule_guild_member
+    on schedule (guild, member, eventtype);
+
+create index schedule_user
+    on schedule (user, eventtype);
+
 create table server_config
 (
     guild                int,
@@ -143,6 +185,9 @@ create table server_config
     verification_text    text
 );
 
+create index server_config_guild
+    on server_config (guild);
+
 create table thin_ice
 (
     user                int not null,
@@ -167,3 +212,90 @@ create table warnings
     points      float   default 1                     not null
 );
 
+create index warnings_server_user
+    on warnings (server, user, issuedat);
+
+create table xp_message_index
+(
+    guild   integer not null,
+    channel integer not null,
+    author  integer not null,
+    message integer not null
+        constraint xp_message_index_pk
+            primary key
+);
+
+create index xp_message_index_guild_author
+    on xp_message_index (guild, author, message);
+
+create table xp_scan_checkpoints
+(
+    guild        integer not null,
+    channel      integer not null
+        constraint xp_scan_checkpoints_pk
+            primary key,
+    last_message integer not null
+);
+
+create index xp_scan_checkpoints_guild
+    on xp_scan_checkpoints (guild);
+
+create table archive_checkpoints
+(
+    guild        integer not null,
+    channel      integer not null
+        constraint archive_checkpoints_pk
+            primary key,
+    last_message integer not null
+);
+
+create index archive_checkpoints_guild
+    on archive_checkpoints (guild);
+
+create table archive_guilds
+(
+    guild      integer            not null
+        constraint archive_guilds_pk
+            primary key,
+    backfilled bool default false not null
+);
+
+create table archived_messages
+(
+    id          integer not null
+        constraint archived_messages_pk
+            primary key,
+    guild       integer not null,
+    channel     integer not null,
+    author      integer not null,
+    bot         bool    not null,
+    content     text    not null,
+    attachments json    not null,
+    embeds      json    not null,
+    media       integer not null
+);
+
+create index archived_messages_channel
+    on archived_messages (channel, id);
+
+create index archived_messages_guild_author
+    on archived_messages (guild, author, id);
+
+create table archived_reactions
+(
+    message integer not null,
+    emoji   text    not null,
+    count   integer not null,
+    constraint archived_reactions_pk
+        primary key (message, emoji)
+);
+
+create table log_webhooks
+(
+    guild   integer not null,
+    channel integer not null
+        constraint log_webhooks_pk
+            primary key,
+    webhook integer not null,
+    token   text    not null
+);
@@ -0,0 +1,400 @@
+import asyncio
+import itertools
+import json
+import operator
+import time
+import typing
+from collections import defaultdict
+
+import discord
+from discord.ext import commands, tasks
+from discord.ext.commands import BucketType
+
+import database
+import historyscan
+from clogs import logger
+
+# opt-in local copy of a guild's messages, kept up to date from the gateway, so statistics commands can query the db
+# instead of downloading entire channel histories. message timestamps aren't stored, they're in the snowflake IDs.
+# messages sent while the bot is disconnected never arrive through the gateway, so every time it connects each archived
+# guild is caught up by scanning history after its channels' checkpoints, and isn't trusted until that's done.
+
+media_embed_types = ("image", "video", "audio", "gifv")
+archive_flush_interval = 10  # seconds
+archive_flush_size = 500  # pending statements
+archive_backfill_batch_size = 1000  # messages
+# the progress message of a backfill is edited at most this often
+archive_progress_interval = 5  # seconds
+
+# guilds with archiving on, loaded when the cog loads
+enabled: typing.Set[int] = set()
+# backfilled guilds that have been caught up since the bot connected, so their archive has every message
+current: typing.Set[int] = set()
+# writes waiting for the next flush, in order, as (sql, params)
+pending: typing.List[typing.Tuple[str, tuple]] = []
+# channel ID -> (guild ID, ID of the newest message in pending) for current guilds, so checkpoints follow live messages
+# and the next catch-up doesn't scan what's already archived
+live_checkpoints: typing.Dict[int, typing.Tuple[int, int]] = {}
+# backfills and catch-ups of the same guild hold this so they don't scan the same history twice at once
+locks: typing.DefaultDict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+upsert_checkpoint = ("INSERT INTO archive_checkpoints (guild, channel, last_message) VALUES (?,?,?) "
+                     "ON CONFLICT(channel) DO UPDATE SET last_message = max(last_message, excluded.last_message)")
+insert_message = ("INSERT OR {} INTO archived_messages (id, guild, channel, author, bot, content, attachments, embeds,"
+                  " media) VALUES (?,?,?,?,?,?,?,?,?)")
+# media is derived from attachments and embeds, recomputed after edits since those may only carry one of them
+recount_media = (f"UPDATE archived_messages SET media = json_array_length(attachments) + "
+                 f"(SELECT count(*) FROM json_each(archived_messages.embeds) WHERE json_extract(value, '$.type') IN "
+                 f"({','.join(repr(t) for t in media_embed_types)})) WHERE id=?")
+
+
+def message_row(message: discord.Message) -> tuple:
+    attachments = [{"id": att.id, "filename": att.filename, "url": att.url, "content_type": att.content_type,
+                    "size": att.size} for att in message.attachments]
+    embeds = [{"type": embed.type, "url": embed.url} for embed in message.embeds]
+    media = len(attachments) + sum(embed.type in media_embed_types for embed in message.embeds)
+    return (message.id, message.guild.id, message.channel.id, message.author.id, message.author.bot, message.content,
+            json.dumps(attachments), json.dumps(embeds), media)
+
+
+def emoji_key(emoji: typing.Union[discord.Emoji, discord.PartialEmoji, str]) -> str:
+    # custom emojis by ID since they can be renamed
+    if isinstance(emoji, str):
+        return emoji
+    return str(emoji.id or emoji.name)
+
+
+def queue(sql: str, params: tuple):
+    pending.append((sql, params))
+
+
+async def flush():
+    """
+    write all pending archive changes to the db in order, with one commit
+    """
+    global pending, live_checkpoints
+    if not pending:
+        return
+    batch, pending = pending, []
+    checkpoints, live_checkpoints = live_checkpoints, {}
+    # consecutive writes of the same kind (usually new messages) go in one executemany
+    writes = [database.Write(sql, [params for _, params in group], many=True)
+              for sql, group in itertools.groupby(batch, key=operator.itemgetter(0))]
+    if checkpoints:
+        # committed along with the messages they cover
+        writes.append(database.Write(upsert_checkpoint, [(guild, channel, message)
+                                                         for channel, (guild, message) in checkpoints.items()],
+                                     many=True))
+    try:
+        await database.write_all(*writes)
+    except Exception:
+        # put it back so it gets tried again next flush
+        pending = batch + pending
+        for channel, checkpoint in checkpoints.items():
+            live_checkpoints.setdefault(channel, checkpoint)
+        raise
+    logger.debug(f"flushed {len(batch)} message archive write(s)")
+
+
+async def backfilled(guild: int) -> bool:
+    """
+    :param guild: ID of guild
+    :return: if the guild's archive has all of its history, meaning queries can be answered from it. false while it's
+    being caught up with what was sent while the bot was offline.
+    """
+    if guild not in current:
+        return False
+    # make sure anything said since the last flush is counted
+    await flush()
+    return True
+
+
+async def all_channels(guild: discord.Guild) -> typing.List[historyscan.HistoryChannel]:
+    # text channels, active threads, and archived public and private threads
+    channels = set(guild.text_channels + list(guild.threads))
+    for channel in guild.text_channels + guild.forums:
+        try:
+            channels.update([th async for th in channel.archived_threads(limit=None)])
+        except discord.HTTPException as e:
+            logger.debug(f"can't list archived threads of {channel}: {e}")
+        if isinstance(channel, discord.ForumChannel):
+            continue
+        try:
+            # every private thread needs manage threads, otherwise only the ones the bot has joined can be listed
+            try:
+                channels.update([th async for th in channel.archived_threads(private=True, limit=None)])
+            except discord.Forbidden:
+                channels.update([th async for th in channel.archived_threads(private=True, joined=True, limit=None)])
+        except discord.HTTPException as e:
+            logger.debug(f"can't list private archived threads of {channel}: {e}")
+    return list(channels)
+
+
+class Progress(historyscan.Visitor):
+    def __init__(self, callback: typing.Optional[typing.Callable[[historyscan.HistoryScan], typing.Awaitable]]):
+        self.callback = callback
+        self.scan: typing.Optional[historyscan.HistoryScan] = None
+        self.last_call = 0.0
+
+    async def channel_done(self, channel: historyscan.HistoryChannel):
+        if self.callback is not None and time.monotonic() - self.last_call >= archive_progress_interval:
+            self.last_call = time.monotonic()
+            await self.callback(self.scan)
+
+
+async def catch_up(guild: discord.Guild,
+                   progress: typing.Optional[typing.Callable[[historyscan.HistoryScan], typing.Awaitable]] = None) \
+        -> historyscan.HistoryScan:
+    """
+    archive everything in a guild's history after its channels' checkpoints, which is all of it for channels that
+    haven't been archived yet
+    :param guild: the guild
+    :param progress: async function called with the scan every so often as channels finish
+    :return: the finished scan
+    """
+    async with locks[guild.id]:
+        channels = await all_channels(guild)
+        async with database.db.execute("SELECT channel, last_message FROM archive_checkpoints WHERE guild=?",
+                                       (guild.id,)) as cur:
+            checkpoints = dict(await cur.fetchall())
+        reporter = Progress(progress)
+        scan = historyscan.HistoryScan(channels, Backfiller(), reporter, oldest_first=True, after=checkpoints)
+        reporter.scan = scan
+        return await scan.run()
+
+
+class Backfiller(historyscan.Visitor):
+    """
+    archives every message a scan sees.
+    each channel's checkpoint is saved with every batch, so an interrupted backfill picks up where it left off.
+    """
+
+    def __init__(self):
+        self.messages: typing.DefaultDict[int, list] = defaultdict(list)
+        self.reactions: typing.DefaultDict[int, list] = defaultdict(list)
+        self.last: typing.Dict[int, int] = {}
+        self.scanned: typing.Dict[int, int] = {}
+
+    async def visit(self, message: discord.Message):
+        channel = message.channel.id
+        self.last[channel] = message.id
+        self.scanned[channel] = self.scanned.get(channel, 0) + 1
+        self.messages[channel].append(message_row(message))
+        self.reactions[channel] += [(message.id, emoji_key(reaction.emoji), reaction.count)
+                                    for reaction in message.reactions]
+        if self.scanned[channel] % archive_backfill_batch_size == 0:
+            await self.save(message.channel)
+
+    async def channel_done(self, channel: historyscan.HistoryChannel):
+        if channel.id in self.last:
+            await self.save(channel)
+
+    async def save(self, channel: historyscan.HistoryChannel):
+        # live events are newer than what history returned, so never overwrite them
+        # the checkpoint is only saved along with the messages it covers
+        await database.write_all(
+            database.Write(insert_message.format("IGNORE"), self.messages.pop(channel.id, []), many=True),
+            database.Write("INSERT OR IGNORE INTO archived_reactions (message, emoji, count) VALUES (?,?,?)",
+                           self.reactions.pop(channel.id, []), many=True),
+            # live messages flushed meanwhile may have moved it further already
+            database.Write(upsert_checkpoint, (channel.guild.id, channel.id, self.last[channel.id])))
+
+
+class MessageArchive(commands.Cog, name="Message Archive"):
+    """Keep a local copy of a server's messages so statistics commands don't have to scan history"""
+
+    def __init__(self, bot):
+        self.bot: commands.Bot = bot
+        self.catch_up_task: typing.Optional[asyncio.Task] = None
+        # current guilds as of the last disconnect, they're still current if the session resumes without a gap
+        self.current_before_disconnect: typing.Set[int] = set()
+
+    async def cog_load(self):
+        async with database.db.execute("SELECT guild FROM archive_guilds") as cur:
+            enabled.update(row[0] for row in await cur.fetchall())
+        self.flush_loop.start()
+        # on_ready won't come if the cog is reloaded while connected
+        if self.bot.is_ready():
+            self.start_catch_up()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+        if self.catch_up_task is not None:
+            self.catch_up_task.cancel()
+        current.clear()
+        await flush()
+
+    def start_catch_up(self):
+        if self.catch_up_task is not None:
+            self.catch_up_task.cancel()
+        current.clear()
+        self.current_before_disconnect.clear()
+        self.catch_up_task = asyncio.create_task(self.catch_up_all())
+
+    async def catch_up_all(self):
+        async with database.db.execute("SELECT guild FROM archive_guilds WHERE backfilled") as cur:
+            guilds = [row[0] for row in await cur.fetchall()]
+        for guildid in guilds:
+            if (guild := self.bot.get_guild(guildid)) is None:
+                continue
+            try:
+                scan = await catch_up(guild)
+            except Exception as e:
+                logger.error(f"catching up the message archive of {guild} failed: {e}",
+                             exc_info=(type(e), e, e.__traceback__))
+                continue
+            current.add(guild.id)
+            logger.info(f"caught up the message archive of {guild} with {scan.messages} message(s)")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # a new session, anything sent since the last one was missed
+        self.start_catch_up()
+
+    @commands.Cog.listener()
+    async def on_disconnect(self):
+        # stop trusting archives and moving checkpoints until it's known whether events were missed
+        self.current_before_disconnect |= current
+        current.clear()
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        # discord replayed everything missed while disconnected
+        current.update(self.current_before_disconnect)
+        self.current_before_disconnect.clear()
+
+    @tasks.loop(seconds=archive_flush_interval)
+    async def flush_loop(self):
+        try:
+            await flush()
+        except Exception as e:
+            logger.error(e, exc_info=(type(e), e, e.__traceback__))
+
+    async def queue(self, sql: str, params: tuple):
+        queue(sql, params)
+        if len(pending) >= archive_flush_size:
+            await flush()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.guild and message.guild.id in enabled:
+            if message.guild.id in current:
+                live_checkpoints[message.channel.id] = (message.guild.id, message.id)
+            await self.queue(insert_message.format("REPLACE"), message_row(message))
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if payload.guild_id not in enabled:
+            return
+        data = payload.data
+        # edit events can be partial, only update what was sent
+        if "content" in data:
+            await self.queue("UPDATE archived_messages SET content=? WHERE id=?", (data["content"], payload.message_id))
+        if "attachments" in data:
+            attachments = [{"id": int(att["id"]), "filename": att["filename"], "url": att["url"],
+                            "content_type": att.get("content_type"), "size": att["size"]}
+                           for att in data["attachments"]]
+            await self.queue("UPDATE archived_messages SET attachments=? WHERE id=?",
+                             (json.dumps(attachments), payload.message_id))
+        if "embeds" in data:
+            embeds = [{"type": embed.get("type", "rich"), "url": embed.get("url")} for embed in data["embeds"]]
+            await self.queue("UPDATE archived_messages SET embeds=? WHERE id=?",
+                             (json.dumps(embeds), payload.message_id))
+        if "attachments" in data or "embeds" in data:
+            await self.queue(recount_media, (payload.message_id,))
+
+    async def delete(self, message: int):
+        await self.queue("DELETE FROM archived_reactions WHERE message=?", (message,))
+        await self.queue("DELETE FROM archived_messages WHERE id=?", (message,))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id in enabled:
+            await self.delete(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.guild_id in enabled:
+            for message in payload.message_ids:
+                await self.delete(message)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.guild_id in enabled:
+            await self.queue("INSERT INTO archived_reactions (message, emoji, count) VALUES (?,?,1) "
+                             "ON CONFLICT(message, emoji) DO UPDATE SET count = count + 1",
+                             (payload.message_id, emoji_key(payload.emoji)))
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if payload.guild_id in enabled:
+            await self.queue("UPDATE archived_reactions SET count = count - 1 WHERE message=? AND emoji=?",
+                             (payload.message_id, emoji_key(payload.emoji)))
+            await self.queue("DELETE FROM archived_reactions WHERE message=? AND emoji=? AND count <= 0",
+                             (payload.message_id, emoji_key(payload.emoji)))
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        if payload.guild_id in enabled:
+            await self.queue("DELETE FROM archived_reactions WHERE message=?", (payload.message_id,))
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        if payload.guild_id in enabled:
+            await self.queue("DELETE FROM archived_reactions WHERE message=? AND emoji=?",
+                             (payload.message_id, emoji_key(payload.emoji)))
+
+    @commands.command()
+    @commands.has_permissions(manage_guild=True)
+    @commands.cooldown(1, 60 * 60, BucketType.guild)
+    async def archiveguild(self, ctx: commands.Context):
+        """
+        start keeping a local copy of this server's messages, so commands like messagecount, mediacount, emojicount
+        and recalculateguildxp answer instantly instead of scanning history.
+        the first run downloads all history and takes a while. if it gets interrupted, run it again to continue.
+        """
+        await database.write("INSERT OR IGNORE INTO archive_guilds (guild) VALUES (?)", (ctx.guild.id,))
+        # archive new messages from now on so nothing sent during the backfill is missed
+        enabled.add(ctx.guild.id)
+        if await backfilled(ctx.guild.id):
+            await ctx.reply("✔️ This server is already archived.")
+            return
+        async with ctx.typing():
+            msg = await ctx.reply("Archiving channels... this will take a while...")
+
+            async def progress(scan: historyscan.HistoryScan):
+                await msg.edit(content=f"Archiving {len(scan.channels)} channels... "
+                                       f"{scan.channels_done}/{len(scan.channels)} channels, {scan.messages} messages")
+
+            scan = await catch_up(ctx.guild, progress)
+            if not scan.skipped:
+                await database.write("UPDATE archive_guilds SET backfilled=true WHERE guild=?", (ctx.guild.id,))
+                current.add(ctx.guild.id)
+        await msg.delete()
+        if scan.skipped:
+            # counts from an archive missing whole channels would be wrong, so it isn't used until they're archived too
+            await ctx.reply(f"⚠️ Archived {scan.messages} messages, but the archive won't be used until every channel "
+                            f"is archived. Give me access and run this again to continue.{scan.skipped_message()}")
+        else:
+            await ctx.reply(f"✔️ Archived {scan.messages} messages. New messages will be archived as they're sent.")
+
+    @commands.command()
+    @commands.has_permissions(manage_guild=True)
+    async def unarchiveguild(self, ctx: commands.Context):
+        """
+        stop keeping a local copy of this server's messages and delete it
+        """
+        enabled.discard(ctx.guild.id)
+        current.discard(ctx.guild.id)
+        # anything pending for this guild would just be written back
+        await flush()
+        *_, result = await database.write_all(
+            database.Write("DELETE FROM archived_reactions WHERE message IN "
+                           "(SELECT id FROM archived_messages WHERE guild=?)", (ctx.guild.id,)),
+            database.Write("DELETE FROM archived_messages WHERE guild=?", (ctx.guild.id,)),
+            database.Write("DELETE FROM archive_checkpoints WHERE guild=?", (ctx.guild.id,)),
+            database.Write("DELETE FROM archive_guilds WHERE guild=?", (ctx.guild.id,)))
+        if result.rowcount > 0:
+            await ctx.reply("✔️ Deleted this server's message archive.")
+        else:
+            await ctx.reply("⚠️ This server isn't archived.")
@@ -0,0 +1,61 @@
+import bisect
+import typing
+
+# seconds, roughly doubling from 10ms to 10 minutes
+default_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Histogram:
+    """
+    fixed bucket histogram, cheap enough to record on every event.
+    quantiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = default_buckets):
+        """
+        :param buckets: sorted upper bounds of each bucket. anything above the last goes in an overflow bucket.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: quantile between 0 and 1, i.e. 0.99 for p99
+        :return: upper bound of the bucket the quantile is in, or the max if it's in the overflow bucket
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.mean,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            # upper bound -> count, "inf" for the overflow bucket
+            "buckets": {**{str(bound): count for bound, count in zip(self.buckets, self.counts)},
+                        "inf": self.counts[-1]}
+        }
@@ -0,0 +1,201 @@
+import sqlite3
+import typing
+
+from clogs import logger
+
+# makedatabase.sql only runs on an empty database, so changes to the schema of existing databases go here.
+# the database's PRAGMA user_version is how many of these have been applied. to change the schema, append a
+# migration and make the same change to makedatabase.sql, new databases are created from it and marked up to date.
+# never edit or reorder a migration that has shipped.
+
+Migration = typing.Union[str, typing.Callable[[sqlite3.Connection], None]]
+
+
+def add_schedule_columns(con: sqlite3.Connection):
+    columns = {row[0] for row in con.execute("SELECT name FROM pragma_table_info('schedule')")}
+    if "guild" in columns:
+        return
+    for column in ("guild", "member", "user"):
+        con.execute(f"ALTER TABLE schedule ADD COLUMN {column} integer")
+    con.execute("UPDATE schedule SET guild = json_extract(eventdata, '$.guild'), "
+                "member = json_extract(eventdata, '$.member'), "
+                "user = json_extract(eventdata, '$.user')")
+
+
+def hash_hex_to_blob(con: sqlite3.Connection):
+    # sqlite can't change a column's type, so the table is rebuilt
+    con.create_function("hash_blob", 1, lambda hexhash: bytes.fromhex(hexhash.zfill(len(hexhash) + len(hexhash) % 2)),
+                        deterministic=True)
+    con.execute("""
+    CREATE TABLE imageset_hashes_new
+    (
+        guild        integer not null,
+        channel      integer not null,
+        message      integer not null,
+        att_url      text    not null
+            constraint key_name
+                primary key
+                    on conflict ignore,
+        hash         blob    not null,
+        message_url  text    not null,
+        image_width  integer not null,
+        image_height integer not null
+    )
+    """)
+    con.execute("INSERT INTO imageset_hashes_new SELECT guild, channel, message, att_url, hash_blob(hash), message_url, "
+                "image_width, image_height FROM imageset_hashes")
+    con.execute("DROP TABLE imageset_hashes")
+    con.execute("ALTER TABLE imageset_hashes_new RENAME TO imageset_hashes")
+    con.execute("CREATE INDEX imageset_hashes_channel ON imageset_hashes (channel)")
+    con.execute("CREATE INDEX imageset_hashes_message ON imageset_hashes (message)")
+
+
+migrations: typing.List[Migration] = [
+    # 1: tables cogs used to create themselves on load, before there were migrations. IF NOT EXISTS since a database
+    # may have some of them already
+    """
+    CREATE TABLE IF NOT EXISTS xp_scan_checkpoints
+    (
+        guild        integer not null,
+        channel      integer not null
+            constraint xp_scan_checkpoints_pk
+                primary key,
+        last_message integer not null
+    );
+    CREATE TABLE IF NOT EXISTS xp_message_index
+    (
+        guild   integer not null,
+        channel integer not null,
+        author  integer not null,
+        message integer not null
+            constraint xp_message_index_pk
+                primary key
+    );
+    CREATE INDEX IF NOT EXISTS xp_message_index_guild_author ON xp_message_index (guild, author, message);
+    CREATE TABLE IF NOT EXISTS archive_guilds
+    (
+        guild      integer not null
+            constraint archive_guilds_pk
+                primary key,
+        backfilled bool default false not null
+    );
+    CREATE TABLE IF NOT EXISTS archive_checkpoints
+    (
+        guild        integer not null,
+        channel      integer not null
+            constraint archive_checkpoints_pk
+                primary key,
+        last_message integer not null
+    );
+    CREATE TABLE IF NOT EXISTS archived_messages
+    (
+        id          integer not null
+            constraint archived_messages_pk
+                primary key,
+        guild       integer not null,
+        channel     integer not null,
+        author      integer not null,
+        bot         bool    not null,
+        content     text    not null,
+        attachments json    not null,
+        embeds      json    not null,
+        media       integer not null
+    );
+    CREATE INDEX IF NOT EXISTS archived_messages_channel ON archived_messages (channel, id);
+    CREATE INDEX IF NOT EXISTS archived_messages_guild_author ON archived_messages (guild, author, id);
+    CREATE TABLE IF NOT EXISTS archived_reactions
+    (
+        message integer not null,
+        emoji   text    not null,
+        count   integer not null,
+        constraint archived_reactions_pk
+            primary key (message, emoji)
+    );
+    CREATE TABLE IF NOT EXISTS log_webhooks
+    (
+        guild   integer not null,
+        channel integer not null
+            constraint log_webhooks_pk
+                primary key,
+        webhook integer not null,
+        token   text    not null
+    );
+    """,
+    # 2: columns the scheduler looks events up by
+    add_schedule_columns,
+    # 3
+    """
+    CREATE INDEX IF NOT EXISTS schedule_eventtime ON schedule (eventtime);
+    CREATE INDEX IF NOT EXISTS schedule_guild_member ON schedule (guild, member, eventtype);
+    CREATE INDEX IF NOT EXISTS schedule_user ON schedule (user, eventtype);
+    """,
+    # 4: indexes for the columns hot tables are filtered by
+    """
+    CREATE INDEX warnings_server_user ON warnings (server, user, issuedat);
+    CREATE INDEX modlog_guild_user ON modlog (guild, user, datetime);
+    CREATE INDEX imageset_hashes_channel ON imageset_hashes (channel);
+    CREATE INDEX imageset_hashes_message ON imageset_hashes (message);
+    CREATE INDEX auto_reactions_channel ON auto_reactions (channel);
+    CREATE INDEX members_to_verify_guild_member ON members_to_verify (guild, member);
+    CREATE INDEX members_to_verify_guild_thread ON members_to_verify (guild, thread);
+    """,
+    # 5: leaderboards rank a guild by experience, which scanned and sorted the whole table
+    """
+    CREATE INDEX experience_guild ON experience (guild, experience);
+    """,
+    # 6: image hashes as bytes instead of hex, so they can be loaded straight into arrays
+    hash_hex_to_blob,
+    # 7: the rest of the lookups dbaudit found scanning whole tables
+    """
+    CREATE INDEX server_config_guild ON server_config (guild);
+    CREATE INDEX auto_reactions_guild ON auto_reactions (guild);
+    CREATE INDEX imageset_channels_channel ON imageset_channels (channel);
+    CREATE INDEX lockedchannelperms_guild_channel ON lockedchannelperms (guild, channel);
+    CREATE INDEX xp_scan_checkpoints_guild ON xp_scan_checkpoints (guild);
+    CREATE INDEX archive_checkpoints_guild ON archive_checkpoints (guild);
+    """,
+]
+
+
+def get_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def mark_up_to_date(con: sqlite3.Connection):
+    """
+    for databases just created from makedatabase.sql, which already has every migration
+    """
+    con.execute(f"PRAGMA user_version={len(migrations)}")
+    con.commit()
+
+
+def migrate(con: sqlite3.Connection):
+    """
+    apply every migration the database doesn't have yet, each in its own transaction
+    """
+    version = get_version(con)
+    if version > len(migrations):
+        raise RuntimeError(f"database is at schema version {version} but this code only knows up to "
+                           f"{len(migrations)}, refusing to run on a newer database")
+    # explicit transactions so DDL is rolled back along with everything else if a migration fails
+    con.isolation_level = None
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        logger.info(f"applying database migration {number}")
+        con.execute("BEGIN")
+        try:
+            if callable(migration):
+                migration(con)
+            else:
+                # executescript would commit the open transaction, so run statements one at a time.
+                # migrations are split on ; so they can't contain one anywhere else
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        con.execute(statement)
+            # user_version can't be parameterized, it's always an int here
+            con.execute(f"PRAGMA user_version={number}")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    if version < len(migrations):
+        logger.info(f"database migrated from schema version {version} to {len(migrations)}")
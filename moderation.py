@@ -4,7 +4,6 @@ import textwrap
 import typing
 from datetime import datetime, timedelta, timezone
 
-import aiosqlite
 import discord
 import humanize
 from discord.ext import commands
@@ -12,8 +11,10 @@ from discord.ext.commands import Greedy
 
 import config
 import database
+import logsink
 import modlog
 import scheduler
+import serverconfig
 from clogs import logger
 from embedutils import add_long_field, split_embed
 from timeconverter import time_converter
@@ -56,23 +57,12 @@ def mod_only():
 
 async def update_server_config(server: int, config: str, value):
     """DO NOT ALLOW CONFIG TO BE PASSED AS A VARIABLE, PRE-DEFINED STRINGS ONLY."""
-    async with database.db.execute("SELECT COUNT(guild) FROM server_config WHERE guild=?", (server,)) as cur:
-        guilds = await cur.fetchone()
-    if guilds[0]:  # if there already is a row for this guild
-        await database.db.execute(f"UPDATE server_config SET {config} = ? WHERE guild=?", (value, server))
-    else:  # if not, make one
-        await database.db.execute(f"INSERT INTO server_config(guild, {config}) VALUES (?, ?)", (server, value))
-    await database.db.commit()
+    await serverconfig.update(server, config, value)
 
 
 async def get_server_config(guild: int, config: str):
     """DO NOT ALLOW CONFIG TO BE PASSED AS A VARIABLE, PRE-DEFINED STRINGS ONLY."""
-    async with database.db.execute(f"SELECT {config} FROM server_config WHERE guild=?", (guild,)) as cur:
-        conf = await cur.fetchone()
-    if conf is None:
-        return None
-    else:
-        return conf[0]
+    return getattr(await serverconfig.get(guild), config)
 
 
 async def ban_action(user: typing.Union[discord.User, discord.Member], guild: discord.Guild,
@@ -147,16 +137,12 @@ async def mute_action(member: discord.Member, mute_length: typing.Optional[timed
 
 
 async def on_warn(member: discord.Member, issued_points: float):
-    async with database.db.execute("SELECT thin_ice_role, thin_ice_threshold FROM server_config WHERE guild=?",
-                                   (member.guild.id,)) as cur:
-        thin_ice_role = await cur.fetchone()
-    if thin_ice_role is not None and thin_ice_role[0] is not None and thin_ice_role[0] in [role.id for role in
-                                                                                           member.roles]:
-        await database.db.execute(
+    conf = await serverconfig.get(member.guild.id)
+    if conf.thin_ice_role is not None and conf.thin_ice_role in [role.id for role in member.roles]:
+        await database.write(
             "UPDATE thin_ice SET warns_on_thin_ice = warns_on_thin_ice+? WHERE guild=? AND user=?",
             (issued_points, member.guild.id, member.id))
-        await database.db.commit()
-        threshold = thin_ice_role[1]
+        threshold = conf.thin_ice_threshold
         async with database.db.execute("SELECT warns_on_thin_ice FROM thin_ice WHERE guild=? AND user=?",
                                        (member.guild.id, member.id)) as cur:
             warns_on_thin_ice = (await cur.fetchone())[0]
@@ -166,9 +152,8 @@ async def on_warn(member: discord.Member, issued_points: float):
             await modlog.modlog(f"{member.mention} (`{member}`) was automatically "
                                 f"banned for receiving more than {threshold} "
                                 f"points on thin ice.", member.guild.id, member.id)
-            await database.db.execute("UPDATE thin_ice SET warns_on_thin_ice = 0 WHERE guild=? AND user=?",
-                                      (member.guild.id, member.id))
-            await database.db.commit()
+            await database.write("UPDATE thin_ice SET warns_on_thin_ice = 0 WHERE guild=? AND user=?",
+                                 (member.guild.id, member.id))
 
     else:
         # select all from punishments where the sum of warnings in the punishment range fits the warn_count thing
@@ -241,17 +226,13 @@ class ModerationCog(commands.Cog, name="Moderation"):
     @commands.Cog.listener()
     async def on_member_unban(self, guild: discord.Guild, user: discord.User):
         actuallycancelledanytasks = False
-        async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                       "AND json_extract(eventdata, \"$.member\")=? AND eventtype=?",
-                                       (guild.id, user.id, "unban")) as cur:
-            async for row in cur:
-                await scheduler.canceltask(row[0])
-                actuallycancelledanytasks = True
+        for event in await scheduler.find_events("unban", guild=guild.id, member=user.id):
+            await scheduler.canceltask(event)
+            actuallycancelledanytasks = True
         thin_ice_role = await get_server_config(guild.id, "thin_ice_role")
         if thin_ice_role is not None:
-            await database.db.execute("REPLACE INTO thin_ice(user,guild,marked_for_thin_ice,warns_on_thin_ice) VALUES "
-                                      "(?,?,?,?)", (user.id, guild.id, True, 0))
-            await database.db.commit()
+            await database.write("REPLACE INTO thin_ice(user,guild,marked_for_thin_ice,warns_on_thin_ice) VALUES "
+                                 "(?,?,?,?)", (user.id, guild.id, True, 0))
         if actuallycancelledanytasks:
             try:
                 await user.send(f"You were manually unbanned in **{guild.name}**.")
@@ -266,11 +247,8 @@ class ModerationCog(commands.Cog, name="Moderation"):
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild: discord.Guild, user: discord.User):
-        async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                       "AND json_extract(eventdata, \"$.member\")=? AND eventtype=?",
-                                       (guild.id, user.id, "un_thin_ice")) as cur:
-            async for row in cur:
-                await scheduler.canceltask(row[0])
+        for event in await scheduler.find_events("un_thin_ice", guild=guild.id, member=user.id):
+            await scheduler.canceltask(event)
         ban_appeal_link = await get_server_config(guild.id, "ban_appeal_link")
         if ban_appeal_link is not None:
             try:
@@ -283,13 +261,9 @@ class ModerationCog(commands.Cog, name="Moderation"):
         # delete unmute events if someone manually untimed out
         if is_timedout(before) is not None and is_timedout(after) is None:  # if muted role manually removed
             actuallycancelledanytasks = False
-            async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                           "AND json_extract(eventdata, \"$.member\")=? AND (eventtype=? OR "
-                                           "eventtype=?)",
-                                           (after.guild.id, after.id, "unmute", "refresh_mute")) as cur:
-                async for row in cur:
-                    await scheduler.canceltask(row[0])
-                    actuallycancelledanytasks = True
+            for event in await scheduler.find_events("unmute", "refresh_mute", guild=after.guild.id, member=after.id):
+                await scheduler.canceltask(event)
+                actuallycancelledanytasks = True
             if actuallycancelledanytasks:
                 await after.send(f"You were manually unmuted in **{after.guild.name}**.")
         # remove thin ice from records if manually removed
@@ -298,15 +272,10 @@ class ModerationCog(commands.Cog, name="Moderation"):
             if thin_ice_role in [role.id for role in before.roles] \
                     and thin_ice_role not in [role.id for role in after.roles]:  # if muted role manually removed
                 actuallycancelledanytasks = False
-                async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                               "AND json_extract(eventdata, \"$.member\")=? AND eventtype=?",
-                                               (after.guild.id, after.id, "un_thin_ice")) as cur:
-                    async for row in cur:
-                        await scheduler.canceltask(row[0])
-                        await database.db.execute("DELETE FROM thin_ice WHERE guild=? and user=?",
-                                                  (after.guild.id, after.id))
-                        actuallycancelledanytasks = True
-                    await database.db.commit()
+                for event in await scheduler.find_events("un_thin_ice", guild=after.guild.id, member=after.id):
+                    await scheduler.canceltask(event)
+                    await database.write("DELETE FROM thin_ice WHERE guild=? and user=?", (after.guild.id, after.id))
+                    actuallycancelledanytasks = True
                 if actuallycancelledanytasks:
                     await after.send(f"Your thin ice was manually removed in **{after.guild.name}**.")
                     await modlog.modlog(f"{after.mention} (`{after}`)'s thin ice was manually removed.",
@@ -314,21 +283,19 @@ class ModerationCog(commands.Cog, name="Moderation"):
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        async with database.db.execute("SELECT thin_ice_role, thin_ice_threshold FROM server_config WHERE guild=?",
-                                       (member.guild.id,)) as cur:
-            thin_ice_role = await cur.fetchone()
-        if thin_ice_role is not None and thin_ice_role[0] is not None:
+        conf = await serverconfig.get(member.guild.id)
+        if conf.thin_ice_role is not None:
             async with database.db.execute("SELECT * from thin_ice WHERE user=? AND guild=? AND marked_for_thin_ice=1",
                                            (member.id, member.guild.id)) as cur:
                 user = await cur.fetchone()
             if user is not None:
-                await member.add_roles(discord.Object(thin_ice_role[0]))
+                await member.add_roles(discord.Object(conf.thin_ice_role))
                 scheduletime = datetime.now(tz=timezone.utc) + timedelta(weeks=1)
                 await scheduler.schedule(scheduletime, "un_thin_ice",
                                          {"guild": member.guild.id, "member": member.id,
-                                          "thin_ice_role": thin_ice_role[0]})
+                                          "thin_ice_role": conf.thin_ice_role})
                 await member.send(f"Welcome back to **{member.guild.name}**. since you were just unbanned, you will"
-                                  f" have the **thin ice** role for **1 week.** If you receive {thin_ice_role[1]} "
+                                  f" have the **thin ice** role for **1 week.** If you receive {conf.thin_ice_threshold} "
                                   f"point(s) in this timespan, you will be permanently banned.")
 
     @commands.command(aliases=["setmodrole", "addmodrole", "moderatorrole"])
@@ -434,6 +401,35 @@ class ModerationCog(commands.Cog, name="Moderation"):
                                 f"{channel.mention} ({channel}).", ctx.guild.id, ctx.author.id)
             await ctx.reply(f"✔️ Set server bulklog channel to **{channel.mention}**")
 
+    @commands.command(aliases=["logwebhook"])
+    @commands.has_guild_permissions(manage_guild=True)
+    @commands.bot_has_guild_permissions(manage_webhooks=True)
+    @commands.guild_only()
+    async def logwebhooks(self, ctx, enabled: bool = True):
+        """
+        Send the modlog and bulk log through webhooks.
+        Webhooks are rate limited separately from the bot, so busy logs don't slow down commands.
+        Run this again after changing a log channel.
+
+        :param ctx: discord context
+        :param enabled: - false to go back to the bot sending logs itself
+        """
+        conf = await serverconfig.get(ctx.guild.id)
+        channels = {ch for ch in (conf.log_channel, conf.bulk_log_channel) if ch is not None}
+        if not channels:
+            await ctx.reply("❌ This server has no log channels. Set one with m.logchannel or m.bulklogchannel.")
+            return
+        for channelid in channels:
+            channel = ctx.guild.get_channel(channelid)
+            if enabled and channel is not None:
+                await logsink.enable(channel, f"{self.bot.user.name} Logs")
+            else:
+                await logsink.disable(channelid)
+        if enabled:
+            await ctx.reply(f"✔️ Logs will be sent through webhooks in {', '.join(f'<#{ch}>' for ch in channels)}")
+        else:
+            await ctx.reply("✔️ Logs will be sent by the bot.")
+
     @commands.command(aliases=["banappeal"])
     @commands.has_guild_permissions(manage_guild=True)
     @commands.guild_only()
@@ -590,11 +586,8 @@ class ModerationCog(commands.Cog, name="Moderation"):
             return
         for member in members:
             # cancel all unmute events
-            async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                           "AND json_extract(eventdata, \"$.member\")=? AND (eventtype=? OR eventtype=?)",
-                                           (ctx.guild.id, member.id, "unmute", "refresh_mute")) as cur:
-                async for row in cur:
-                    await scheduler.canceltask(row[0])
+            for event in await scheduler.find_events("unmute", "refresh_mute", guild=ctx.guild.id, member=member.id):
+                await scheduler.canceltask(event)
 
             await member.timeout(None)
             await ctx.reply(f"✔️ Unmuted {member.mention}")
@@ -632,11 +625,8 @@ class ModerationCog(commands.Cog, name="Moderation"):
                 await member.send(f"You were manually unbanned in **{ctx.guild.name}**.")
             except (discord.Forbidden, discord.HTTPException, AttributeError):
                 logger.debug("pass")
-            async with database.db.execute("SELECT id FROM schedule WHERE json_extract(eventdata, \"$.guild\")=? "
-                                           "AND json_extract(eventdata, \"$.member\")=? AND eventtype=?",
-                                           (ctx.guild.id, member.id, "unban")) as cur:
-                async for row in cur:
-                    await scheduler.canceltask(row[0])
+            for event in await scheduler.find_events("unban", guild=ctx.guild.id, member=member.id):
+                await scheduler.canceltask(event)
 
     @commands.command(aliases=["deletewarn", "removewarn", "dwarn", "cancelwarn", "dw"])
     @mod_only()
@@ -658,20 +648,16 @@ class ModerationCog(commands.Cog, name="Moderation"):
                 await ctx.reply(
                     f"❌ Failed to remove warning. Does warn #{warn_id} exist and is it from this server?")
             else:
-                await database.db.execute("UPDATE warnings SET deactivated=1 WHERE id=?", (warn_id,))
+                writes = [database.Write("UPDATE warnings SET deactivated=1 WHERE id=?", (warn_id,))]
                 # update warns on thin ice
                 member = await ctx.guild.fetch_member(warn[0])
                 points = warn[1]
-                async with database.db.execute(
-                        "SELECT thin_ice_role, thin_ice_threshold FROM server_config WHERE guild=?",
-                        (member.guild.id,)) as cur:
-                    thin_ice_role = await cur.fetchone()
-                if thin_ice_role is not None and thin_ice_role[0] is not None \
-                        and thin_ice_role[0] in [role.id for role in member.roles]:
-                    await database.db.execute(
+                thin_ice_role = await get_server_config(member.guild.id, "thin_ice_role")
+                if thin_ice_role is not None and thin_ice_role in [role.id for role in member.roles]:
+                    writes.append(database.Write(
                         "UPDATE thin_ice SET warns_on_thin_ice = warns_on_thin_ice-? WHERE guild=? AND user=?",
-                        (points, member.guild.id, member.id))
-                await database.db.commit()
+                        (points, member.guild.id, member.id)))
+                await database.write_all(*writes)
                 user = await self.bot.fetch_user(warn[0])
                 if user:
                     await ctx.reply(f"✔️ Removed warning #{warn_id} from {user.mention} (`{warn[2]}`)")
@@ -707,8 +693,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
             await ctx.reply(
                 f"❌ Failed to unremove warning. Does warn #{warn_id} exist and is it from this server?")
         else:
-            await database.db.execute("UPDATE warnings SET deactivated=1 WHERE id=?", (warn_id,))
-            await database.db.commit()
+            await database.write("UPDATE warnings SET deactivated=1 WHERE id=?", (warn_id,))
             user = await self.bot.fetch_user(warn[0])
             if user:
                 await ctx.reply(f"✔️ Restored warning #{warn_id} from {user.mention} (`{warn[2]}`)")
@@ -743,14 +728,11 @@ class ModerationCog(commands.Cog, name="Moderation"):
             points = round(points, 1)
         now = datetime.now(tz=timezone.utc)
         for member in members:
-            async with database.db.cursor() as cur:
-                cur: aiosqlite.Cursor
-                await cur.execute("INSERT INTO warnings(server, user, issuedby, issuedat, reason, points)"
-                                  "VALUES (?, ?, ?, ?, ?, ?)",
-                                  (ctx.guild.id, member.id, ctx.author.id,
-                                   int(now.timestamp()), reason, points))
-                insertedrow = cur.lastrowid
-            await database.db.commit()
+            result = await database.write("INSERT INTO warnings(server, user, issuedby, issuedat, reason, points)"
+                                          "VALUES (?, ?, ?, ?, ?, ?)",
+                                          (ctx.guild.id, member.id, ctx.author.id,
+                                           int(now.timestamp()), reason, points))
+            insertedrow = result.lastrowid
 
             await ctx.reply(
                 f"Warned {member.mention} (warn ID `#{insertedrow}`) with {points} infraction point{'' if points == 1 else 's'} for:\n"
@@ -803,11 +785,10 @@ class ModerationCog(commands.Cog, name="Moderation"):
         if points > 1:
             points = round(points, 1)
         now = datetime(day=day, month=month, year=year, tzinfo=timezone.utc)
-        await database.db.execute("INSERT INTO warnings(server, user, issuedby, issuedat, reason, points)"
-                                  "VALUES (?, ?, ?, ?, ?, ?)",
-                                  (ctx.guild.id, member.id, ctx.author.id,
-                                   int(now.timestamp()), reason, points))
-        await database.db.commit()
+        await database.write("INSERT INTO warnings(server, user, issuedby, issuedat, reason, points)"
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (ctx.guild.id, member.id, ctx.author.id,
+                              int(now.timestamp()), reason, points))
         await ctx.reply(
             f"Created warn on <t:{int(now.timestamp())}:D> for {member.mention} with {points} infraction "
             f"point{'' if points == 1 else 's'} for:\n{quote(reason)}")
@@ -840,36 +821,37 @@ class ModerationCog(commands.Cog, name="Moderation"):
             embed = discord.Embed(title=f"Warns for {member.display_name}: Page {page}", color=discord.Color(0xB565D9),
                                   description=member.mention)
             deactivated_text = "" if show_deleted else "AND deactivated=0"
-            async with database.db.execute(f"SELECT id, issuedby, issuedat, reason, deactivated, points FROM warnings "
-                                           f"WHERE user=? AND server=? {deactivated_text} ORDER BY issuedat DESC "
-                                           f"LIMIT 25 OFFSET ?",
-                                           (member.id, ctx.guild.id, (page - 1) * 25)) as cursor:
-                # now = datetime.now(tz=timezone.utc)
-                async for warn in cursor:
-                    issuedby = await self.bot.fetch_user(warn[1])
-                    issuedat = warn[2]
-                    reason = warn[3]
-                    points = warn[5]
-                    add_long_field(embed,
-                                   name=f"Warn ID `#{warn[0]}`: {'%g' % points} point{'' if points == 1 else 's'}"
-                                        f"{' (Deleted)' if warn[4] else ''}",
-                                   value=
-                                   f"Reason: {reason}\n"
-                                   f"Issued by: {issuedby.mention}\n"
-                                   f"Issued <t:{int(issuedat)}:f> "
-                                   f"(<t:{int(issuedat)}:R>)", inline=False)
-            async with database.db.execute("SELECT count(*) FROM warnings WHERE user=? AND server=? AND deactivated=0",
-                                           (member.id, ctx.guild.id)) as cur:
-                warncount = (await cur.fetchone())[0]
-            async with database.db.execute("SELECT count(*) FROM warnings WHERE user=? AND server=? AND deactivated=1",
-                                           (member.id, ctx.guild.id)) as cur:
-                delwarncount = (await cur.fetchone())[0]
-            async with database.db.execute(
-                    "SELECT sum(points) FROM warnings WHERE user=? AND server=? AND deactivated=0",
-                    (member.id, ctx.guild.id)) as cur:
-                points = (await cur.fetchone())[0]
-                if points is None:
-                    points = 0
+            async with database.read() as con:
+                async with con.execute(f"SELECT id, issuedby, issuedat, reason, deactivated, points FROM warnings "
+                                       f"WHERE user=? AND server=? {deactivated_text} ORDER BY issuedat DESC "
+                                       f"LIMIT 25 OFFSET ?",
+                                       (member.id, ctx.guild.id, (page - 1) * 25)) as cursor:
+                    warns = await cursor.fetchall()
+                async with con.execute("SELECT count(*) FROM warnings WHERE user=? AND server=? AND deactivated=0",
+                                       (member.id, ctx.guild.id)) as cur:
+                    warncount = (await cur.fetchone())[0]
+                async with con.execute("SELECT count(*) FROM warnings WHERE user=? AND server=? AND deactivated=1",
+                                       (member.id, ctx.guild.id)) as cur:
+                    delwarncount = (await cur.fetchone())[0]
+                async with con.execute("SELECT sum(points) FROM warnings WHERE user=? AND server=? AND deactivated=0",
+                                       (member.id, ctx.guild.id)) as cur:
+                    points = (await cur.fetchone())[0]
+                    if points is None:
+                        points = 0
+            # fetch users after giving the connection back to the pool
+            for warn in warns:
+                issuedby = await self.bot.fetch_user(warn[1])
+                issuedat = warn[2]
+                reason = warn[3]
+                warnpoints = warn[5]
+                add_long_field(embed,
+                               name=f"Warn ID `#{warn[0]}`: {'%g' % warnpoints} point{'' if warnpoints == 1 else 's'}"
+                                    f"{' (Deleted)' if warn[4] else ''}",
+                               value=
+                               f"Reason: {reason}\n"
+                               f"Issued by: {issuedby.mention}\n"
+                               f"Issued <t:{int(issuedat)}:f> "
+                               f"(<t:{int(issuedat)}:R>)", inline=False)
             embed.description += f" has {'%g' % points} point{'' if points == 1 else 's'}, " \
                                  f"{warncount} warn{'' if warncount == 1 else 's'} and " \
                                  f"{delwarncount} deleted warn{'' if delwarncount == 1 else 's'}"
@@ -896,32 +878,33 @@ class ModerationCog(commands.Cog, name="Moderation"):
         async with ctx.channel.typing():
             embed = discord.Embed(title=f"Modlogs for {member.display_name}: Page {page}",
                                   color=discord.Color(0xB565D9), description=member.mention)
-            async with database.db.execute(f"SELECT text,datetime,user,moderator FROM modlog "
-                                           f"WHERE {'moderator' if viewmodactions else 'user'}=? AND guild=? "
-                                           f"ORDER BY datetime DESC LIMIT 10 OFFSET ?",
-                                           (member.id, ctx.guild.id, (page - 1) * 10)) as cursor:
-                now = datetime.now(tz=timezone.utc)
-                async for log in cursor:
-                    if log[2]:
-                        user: typing.Optional[discord.User] = await self.bot.fetch_user(log[2])
-                    else:
-                        user = None
-                    if log[3]:
-                        moderator: typing.Optional[discord.User] = await self.bot.fetch_user(log[3])
-                    else:
-                        moderator = None
-                    issuedat = log[1]
-                    text = log[0]
-                    add_long_field(embed,
-                                   name=f"<t:{int(issuedat)}:f> (<t:{int(issuedat)}:R>)",
-                                   value=
-                                   text + ("\n\n" if user or moderator else "") +
-                                   (f"**User**: {user.mention}\n" if user else "") +
-                                   (f"**Moderator**: {moderator.mention}\n" if moderator else ""), inline=False)
-                if not embed.fields:
-                    embed.add_field(name="No Results", value="Try a different page #.", inline=False)
-                for e in split_embed(embed):
-                    await ctx.reply(embed=e)
+            async with database.read() as con, \
+                    con.execute(f"SELECT text,datetime,user,moderator FROM modlog "
+                                f"WHERE {'moderator' if viewmodactions else 'user'}=? AND guild=? "
+                                f"ORDER BY datetime DESC LIMIT 10 OFFSET ?",
+                                (member.id, ctx.guild.id, (page - 1) * 10)) as cursor:
+                logs = await cursor.fetchall()
+            for log in logs:
+                if log[2]:
+                    user: typing.Optional[discord.User] = await self.bot.fetch_user(log[2])
+                else:
+                    user = None
+                if log[3]:
+                    moderator: typing.Optional[discord.User] = await self.bot.fetch_user(log[3])
+                else:
+                    moderator = None
+                issuedat = log[1]
+                text = log[0]
+                add_long_field(embed,
+                               name=f"<t:{int(issuedat)}:f> (<t:{int(issuedat)}:R>)",
+                               value=
+                               text + ("\n\n" if user or moderator else "") +
+                               (f"**User**: {user.mention}\n" if user else "") +
+                               (f"**Moderator**: {moderator.mention}\n" if moderator else ""), inline=False)
+            if not embed.fields:
+                embed.add_field(name="No Results", value="Try a different page #.", inline=False)
+            for e in split_embed(embed):
+                await ctx.reply(embed=e)
 
     def autopunishment_to_text(self, point_count, point_timespan, punishment_type, punishment_duration):
         punishment_type_future_tense = {
@@ -958,12 +941,11 @@ class ModerationCog(commands.Cog, name="Moderation"):
         await modlog.modlog(f"{ctx.author.mention} (`{ctx.author}`) added "
                             f"auto-punishment: {ptext}", ctx.guild.id, modid=ctx.author.id)
         await ctx.reply(ptext)
-        await database.db.execute(
+        await database.write(
             "REPLACE INTO auto_punishment(guild,warn_count,punishment_type,punishment_duration,warn_timespan) "
             "VALUES (?,?,?,?,?)",
             (ctx.guild.id, point_count, punishment_type, punishment_duration.total_seconds(),
              point_timespan.total_seconds()))
-        await database.db.commit()
 
     @commands.command(aliases=["removeap", "delap", "deleteautopunishment", "rap", "dap"])
     @commands.guild_only()
@@ -976,10 +958,9 @@ class ModerationCog(commands.Cog, name="Moderation"):
         :param point_count: the point count of the auto-punishment to remove
         """
         assert point_count > 0
-        cur = await database.db.execute("DELETE FROM auto_punishment WHERE warn_count=? AND guild=?",
-                                        (point_count, ctx.guild.id))
-        await database.db.commit()
-        if cur.rowcount > 0:
+        result = await database.write("DELETE FROM auto_punishment WHERE warn_count=? AND guild=?",
+                                      (point_count, ctx.guild.id))
+        if result.rowcount > 0:
             await ctx.reply(f"✔️ Removed rule for {point_count} point{'' if point_count == 1 else 's'}.")
             await modlog.modlog(f"{ctx.author.mention} (`{ctx.author}`) removed "
                                 f"auto-punishment rule for {point_count} "
@@ -1015,7 +996,12 @@ class ModerationCog(commands.Cog, name="Moderation"):
         :param num_messages: number of messages before command invocation to delete
         """
         assert num_messages >= 1
-        deleted = await ctx.channel.purge(before=ctx.message, limit=num_messages)
+        # deletes just aren't logged if the bulk log cog isn't loaded
+        bulklog = self.bot.get_cog("BulkLog")
+        deleted = await ctx.channel.purge(before=ctx.message, limit=num_messages,
+                                          check=bulklog.suppress_check() if bulklog else None)
+        if bulklog:
+            await bulklog.log_bulk_delete(deleted, ctx.channel, ctx.author)
         msg = f"{config.emojis['check']} Deleted `{len(deleted)}` message{'' if len(deleted) == 1 else 's'}!"
         if clean:
             await ctx.send(msg, delete_after=10)
@@ -1054,9 +1040,8 @@ class ModerationCog(commands.Cog, name="Moderation"):
                     perms[role.id] = {'allow': allow.value, 'deny': deny.value}
                 perms = json.dumps(perms)
                 logger.debug(perms)
-                await database.db.execute("INSERT INTO lockedchannelperms VALUES (?,?,?)",
-                                          (channel.guild.id, channel.id, perms))
-                await database.db.commit()
+                await database.write("INSERT INTO lockedchannelperms VALUES (?,?,?)",
+                                     (channel.guild.id, channel.id, perms))
                 # update perms
                 modrole = ctx.guild.get_role(int(await get_server_config(ctx.guild.id, "mod_role")))
                 for target, ovr in channel.overwrites.items():
@@ -1097,9 +1082,8 @@ class ModerationCog(commands.Cog, name="Moderation"):
                     except (discord.Forbidden, discord.HTTPException, discord.NotFound) as e:
                         logger.debug(e)
                 # update db
-                await database.db.execute("DELETE FROM lockedchannelperms WHERE guild=? AND channel=?",
-                                          (channel.guild.id, channel.id))
-                await database.db.commit()
+                await database.write("DELETE FROM lockedchannelperms WHERE guild=? AND channel=?",
+                                     (channel.guild.id, channel.id))
                 # reply!
                 await modlog.modlog(f"{ctx.author.mention} (`@{ctx.author}`) unlocked {channel.mention} (`#{channel}`)",
                                     ctx.guild.id, modid=ctx.author.id)
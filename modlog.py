@@ -4,6 +4,9 @@ from datetime import datetime, timezone
 from discord.ext import commands
 
 import database
+import logsink
+import resolver
+import serverconfig
 
 botcopy = commands.Bot
 
@@ -14,16 +17,20 @@ class ModLogInitCog(commands.Cog):
         botcopy = bot
         self.bot = bot
 
+    async def cog_unload(self):
+        await logsink.close()
+
 
 async def modlog(msg: str, guildid: int, userid: typing.Optional[int] = None, modid: typing.Optional[int] = None):
-    await database.db.execute("INSERT INTO modlog(guild,user,moderator,text,datetime) VALUES (?,?,?,?,?)",
-                              (guildid, userid, modid, msg, datetime.now(tz=timezone.utc).timestamp()))
-    await database.db.commit()
-    async with database.db.execute("SELECT log_channel,bulk_log_channel FROM server_config WHERE guild=?",
-                                   (guildid,)) as cur:
-        modlogchannel = await cur.fetchone()
-    if modlogchannel is None or modlogchannel[0] is None:
+    await database.write("INSERT INTO modlog(guild,user,moderator,text,datetime) VALUES (?,?,?,?,?)",
+                         (guildid, userid, modid, msg, datetime.now(tz=timezone.utc).timestamp()))
+    conf = await serverconfig.get(guildid)
+    if conf.log_channel is None:
         return
-    for ch in modlogchannel:  # send to normal and bulk
-        channel = await botcopy.fetch_channel(ch)
-        await channel.send("**[ModLog]** " + msg, )
+    for ch in (conf.log_channel, conf.bulk_log_channel):  # send to normal and bulk
+        if ch is None:
+            continue
+        channel = await resolver.channel(botcopy, ch)
+        if channel is None:
+            continue
+        await logsink.send(channel, content="**[ModLog]** " + msg)
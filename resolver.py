@@ -0,0 +1,67 @@
+import time
+import typing
+
+import discord
+
+# background tasks (scheduled events, logging) only have IDs to go off of. fetch_* is always an API call, even when the
+# object is sitting in the gateway cache, so try the cache first and only fetch what isn't there.
+# objects that couldn't be fetched are remembered for a bit so a deleted log channel doesn't cost a request per log.
+
+negative_ttl = 60  # seconds
+negative_max = 10_000
+# (kind, ID) -> monotonic time to forget it's missing
+missing: typing.Dict[typing.Tuple[str, int], float] = {}
+
+Channel = typing.Union[discord.abc.GuildChannel, discord.Thread, discord.abc.PrivateChannel]
+
+
+async def fetch(kind: str, objid: int, fetcher: typing.Callable[[int], typing.Awaitable[typing.Any]]):
+    now = time.monotonic()
+    key = (kind, objid)
+    if missing.get(key, 0) > now:
+        return None
+    try:
+        return await fetcher(objid)
+    except (discord.NotFound, discord.Forbidden):
+        if len(missing) >= negative_max:
+            for k in [k for k, expiry in missing.items() if expiry <= now]:
+                del missing[k]
+        missing[key] = now + negative_ttl
+        return None
+
+
+async def channel(client: discord.Client, channelid: int) -> typing.Optional[Channel]:
+    """
+    :return: the channel or thread, or None if it doesn't exist or can't be seen
+    """
+    return client.get_channel(channelid) or await fetch("channel", channelid, client.fetch_channel)
+
+
+async def guild(client: discord.Client, guildid: int) -> typing.Optional[discord.Guild]:
+    """
+    :return: the guild, or None if it doesn't exist or the bot isn't in it
+    """
+    return client.get_guild(guildid) or await fetch("guild", guildid, client.fetch_guild)
+
+
+async def user(client: discord.Client, userid: int) -> typing.Optional[discord.User]:
+    """
+    :return: the user, or None if they don't exist
+    """
+    return client.get_user(userid) or await fetch("user", userid, client.fetch_user)
+
+
+async def member(guild: discord.Guild, memberid: int) -> typing.Optional[discord.Member]:
+    """
+    :return: the member, or None if they aren't in the guild
+    """
+    # members are per guild, so the guild is part of the key
+    return guild.get_member(memberid) or await fetch(f"member {guild.id}", memberid, guild.fetch_member)
+
+
+async def messageable(client: discord.Client, objid: int) -> typing.Optional[discord.abc.Messageable]:
+    """
+    :param objid: ID of a channel or a user to DM
+    :return: the channel or user, or None if it's neither
+    """
+    return await channel(client, objid) or await user(client, objid)
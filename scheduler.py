@@ -1,19 +1,58 @@
 import asyncio
+import dataclasses
 import json
+import time
+import typing
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 
 import discord
 import humanize
 from aioscheduler import TimedScheduler
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 import database
+import metrics
 import modlog
+import resolver
+import serverconfig
 from clogs import logger
 
 scheduler = TimedScheduler(timezone_aware=True)
 botcopy: commands.Bot
 loadedtasks = dict()  # keep track of task objects to cancel if needed.
+# only events due before loaded_until are given to aioscheduler, the rest wait in the db until the window reaches them
+load_window = timedelta(hours=6)
+# must be shorter than load_window or events could be due before they're loaded
+load_interval = timedelta(hours=1)
+loaded_until = datetime.fromtimestamp(0, tz=timezone.utc)
+# missed events are run this many at a time, in order of priority (lowest first) and then of when they were due
+catchup_concurrency = 8
+event_priority = {
+    "unban": 0,
+    "unmute": 0,
+    "refresh_mute": 1,
+    "un_thin_ice": 1,
+    "birthday": 3,
+    "delbirthdaychannel": 3,
+}
+default_event_priority = 2
+catchup_tasks = set()  # keep references so running catch-ups arent garbage collected
+last_catchup: typing.Optional[dict] = None  # how long the last catch-up of missed events took
+
+
+@dataclasses.dataclass
+class EventStats:
+    # seconds between when an event was due and when it started running
+    lag: metrics.Histogram = dataclasses.field(default_factory=metrics.Histogram)
+    # seconds the handler took, including failed runs
+    duration: metrics.Histogram = dataclasses.field(default_factory=metrics.Histogram)
+    runs: int = 0
+    failures: int = 0
+    running: int = 0
+
+
+event_stats: typing.DefaultDict[str, EventStats] = defaultdict(EventStats)
 
 
 class ScheduleInitCog(commands.Cog):
@@ -26,146 +65,290 @@ class ScheduleInitCog(commands.Cog):
 async def start():
     logger.debug("starting scheduler")
     scheduler.start()
-    async with database.db.execute("SELECT id, eventtime, eventtype, eventdata FROM schedule") as cursor:
+    await load_next_window()
+    load_window_loop.start()
+
+
+async def find_events(*eventtypes: str, guild: typing.Optional[int] = None, member: typing.Optional[int] = None,
+                      user: typing.Optional[int] = None) -> typing.List[int]:
+    """
+    find stored events by type and who they're for
+    :param eventtypes: one or more event types to look for
+    :param guild: ID of guild in the event data
+    :param member: ID of member in the event data
+    :param user: ID of user in the event data
+    :return: IDs of matching events, to pass to canceltask()
+    """
+    query = f"SELECT id FROM schedule WHERE eventtype IN ({','.join('?' * len(eventtypes))})"
+    params = list(eventtypes)
+    # column names are fixed here, never from input
+    for column, value in (("guild", guild), ("member", member), ("user", user)):
+        if value is not None:
+            query += f" AND {column}=?"
+            params.append(value)
+    async with database.db.execute(query, params) as cur:
+        return [row[0] for row in await cur.fetchall()]
+
+
+def load_event(dbrowid: int, dt: datetime, eventtype: str, eventdata: dict):
+    """
+    hand a stored event to aioscheduler, if it isnt already
+    """
+    if dbrowid in loadedtasks:
+        return
+    logger.debug(f"scheduling stored event #{dbrowid}")
+    loadedtasks[dbrowid] = scheduler.schedule(run_event(dbrowid, eventtype, eventdata, dt), dt)
+
+
+async def load_next_window():
+    """
+    load every stored event due before the end of the next window, running any that were missed
+    """
+    global loaded_until
+    previous = loaded_until
+    # move the horizon first so events scheduled while we read are loaded by schedule() and not lost in between
+    loaded_until = datetime.now(tz=timezone.utc) + load_window
+    missed = []
+    async with database.db.execute("SELECT id, eventtime, eventtype, eventdata FROM schedule "
+                                   "WHERE eventtime > ? AND eventtime <= ?",
+                                   (previous.timestamp(), loaded_until.timestamp())) as cursor:
         async for event in cursor:
             data = json.loads(event[3])
             dt = datetime.fromtimestamp(event[1], tz=timezone.utc)
             if dt <= datetime.now(tz=timezone.utc):
-                logger.debug(f"running missed event #{event[0]}")
-                # loadedtasks[event[0]] = task  # not needed but easier to put this here than to ignore the exception
-                await run_event(event[0], event[2], data)
+                missed.append((event[0], dt, event[2], data))
             else:
-                logger.debug(f"scheduling stored event #{event[0]}")
-                task = scheduler.schedule(run_event(event[0], event[2], data), dt)
-                loadedtasks[event[0]] = task
+                load_event(event[0], dt, event[2], data)
+    # each missed event makes several API calls, so run them in the background instead of holding up startup
+    if missed:
+        task = asyncio.create_task(catch_up(missed))
+        catchup_tasks.add(task)
+        task.add_done_callback(catchup_tasks.discard)
+    logger.debug(f"loaded events until {loaded_until}, {len(loadedtasks)} event(s) in memory")
+
+
+async def catch_up(missed: typing.List[typing.Tuple[int, datetime, str, dict]]):
+    """
+    run events that were due while the bot was down
+    :param missed: (id, eventtime, eventtype, eventdata) of each event
+    """
+    global last_catchup
+    start = time.perf_counter()
+    missed.sort(key=lambda event: (event_priority.get(event[2], default_event_priority), event[1]))
+    queue = iter(missed)
+
+    async def worker():
+        # the iterator is shared, each event is taken by exactly one worker
+        for dbrowid, dt, eventtype, eventdata in queue:
+            logger.debug(f"running missed event #{dbrowid}")
+            await run_event(dbrowid, eventtype, eventdata, dt)
+
+    await asyncio.gather(*(worker() for _ in range(min(catchup_concurrency, len(missed)))))
+    last_catchup = {
+        "events": len(missed),
+        "seconds": time.perf_counter() - start,
+        "finished": datetime.now(tz=timezone.utc).isoformat()
+    }
+    logger.info(f"ran {len(missed)} missed event(s) in {last_catchup['seconds']:.2f}s")
 
 
-async def run_event(dbrowid, eventtype: str, eventdata: dict):
+@tasks.loop(seconds=load_interval.total_seconds())
+async def load_window_loop():
     try:
-        logger.debug(f"Running Event #{dbrowid} type {eventtype} data {eventdata}")
-        if dbrowid is not None:
-            await database.db.execute("DELETE FROM schedule WHERE id=?", (dbrowid,))
-            await database.db.commit()
-        del loadedtasks[dbrowid]
-        if eventtype == "debug":
-            logger.debug("Hello world! (debug event)")
-        elif eventtype == "message":
-            ch = eventdata["channel"]
-            try:
-                ch = await botcopy.fetch_channel(ch)
-            except discord.errors.NotFound:
-                ch = await botcopy.fetch_user(ch)
-            await ch.send(eventdata["message"])
-        elif eventtype == "unban":
-            guild, member = await asyncio.gather(botcopy.fetch_guild(eventdata["guild"]),
-                                                 botcopy.fetch_user(eventdata["member"]))
-            await asyncio.gather(guild.unban(member, reason="End of temp-ban."),
-                                 member.send(f"You were unbanned in **{guild.name}**."),
-                                 modlog.modlog(f"{member.mention} (`{member}`) "
-                                               f"was automatically unbanned.", guild.id, member.id))
-        elif eventtype == "unmute":
-            # purely cosmetic
-            guild = await botcopy.fetch_guild(eventdata["guild"])
-            member = await guild.fetch_member(eventdata["member"])
-            await asyncio.gather(member.send(f"You were unmuted in **{guild.name}**."),
-                                 modlog.modlog(f"{member.mention} (`{member}`) "
-                                               f"was automatically unmuted.", guild.id, member.id))
-        elif eventtype == "refresh_mute":
-            guild = await botcopy.fetch_guild(eventdata["guild"])
-            member = await guild.fetch_member(eventdata["member"])
-            if eventdata["muteend"] is None:
-                await member.edit(timed_out_until=datetime.now(tz=timezone.utc) + timedelta(days=28))
-                await schedule(datetime.now(tz=timezone.utc) + timedelta(days=28), "refresh_mute",
-                               {"guild": member.guild.id, "member": member.id, "muteend": None})
-                logger.debug(f"Refreshed {member}'s permanent mute in {guild}")
-            else:
-                muteend = datetime.fromtimestamp(eventdata["muteend"], tz=timezone.utc)
-                if muteend - datetime.now(tz=timezone.utc) > timedelta(days=28):
-                    await member.edit(timed_out_until=datetime.now(tz=timezone.utc) + timedelta(days=28))
-                    await schedule(datetime.now(tz=timezone.utc) + timedelta(days=28),
-                                   "refresh_mute",
-                                   {"guild": member.guild.id, "member": member.id, "muteend": eventdata["muteend"]})
-                    logger.debug(f"Refreshed {member}'s mute in {guild}. ends {muteend}")
-                else:
-                    await member.edit(timed_out_until=muteend)
-                    await schedule(muteend, "unmute", {"guild": member.guild.id, "member": member.id})
-                    logger.debug(f"Refreshed {member}'s mute for the last time in {guild}. ends {muteend}")
-
-        elif eventtype == "un_thin_ice":
-            guild = await botcopy.fetch_guild(eventdata["guild"])
-            member = await guild.fetch_member(eventdata["member"])
-            await asyncio.gather(member.remove_roles(discord.Object(eventdata["thin_ice_role"])),
-                                 member.send(f"Your thin ice has expired in **{guild.name}**."),
-                                 modlog.modlog(f"{member.mention}'s (`{member}`) "
-                                               f"thin ice has expired.", guild.id, member.id))
-            await database.db.execute("DELETE FROM thin_ice WHERE guild=? and user=?", (guild.id, member.id))
-            await database.db.commit()
-        elif eventtype == "birthday":
-            now = datetime.now(tz=timezone.utc)
-            birthday = datetime.fromtimestamp(eventdata["birthday"], tz=timezone.utc)
-            age = round((now - birthday).days / 365.25)
-            createdchannels = []
-            for guild in botcopy.guilds:
-                async with database.db.execute("SELECT birthday_category FROM server_config WHERE guild=?",
-                                               (guild.id,)) as cur:
-                    bcategory = await cur.fetchone()
-                if bcategory is not None:
-                    member = guild.get_member(eventdata["user"])
-                    bcategoryreal: discord.CategoryChannel = guild.get_channel(bcategory[0])
-                    if bcategoryreal is not None and member is not None:
-                        dname = ''.join(c for c in member.display_name.lower() if c.isalnum() or c == "-")
-                        bchannel = await bcategoryreal.create_text_channel(f"🎂{dname}-birthday"[:32],
-                                                                           reason=f"{member.display_name}"
-                                                                                  f"'s birthday.")
-                        createdchannels.append(bchannel.id)
-                        await bchannel.send(f"Happy {humanize.ordinal(age)} Birthday {member.mention}!!",
-                                            allowed_mentions=discord.AllowedMentions(everyone=False, roles=False,
-                                                                                     users=True, replied_user=True))
-            # schedule next birthday event
-            thisyear = now.year
-            nextbirthday = birthday
-            while nextbirthday < now:
-                try:
-                    nextbirthday = nextbirthday.replace(year=thisyear)
-                except ValueError as e:  # leap years are weird
-                    logger.debug(str(e))
-                thisyear += 1
-            await schedule(nextbirthday, "birthday", {"user": eventdata["user"], "birthday": birthday.timestamp()})
-            # delete birthday channels in 24 hours
-            await schedule(now + timedelta(days=1), "delbirthdaychannel", {"channels": createdchannels})
-        elif eventtype == "delbirthdaychannel":
-            for ch in eventdata["channels"]:
-                channel = botcopy.get_channel(ch)
-                await channel.delete(reason="Birthday is over")
-        else:
-            logger.error(f"Unknown event type {eventtype} for event {dbrowid}")
+        await load_next_window()
+    except Exception as e:
+        logger.error(e, exc_info=(type(e), e, e.__traceback__))
 
+
+async def run_event(dbrowid, eventtype: str, eventdata: dict, eventtime: typing.Optional[datetime] = None):
+    """
+    run an event, recording how late it was, how long it took and if it failed
+    :param dbrowid: ID of the event in the db, or None if it was never stored
+    :param eventtype: type of event
+    :param eventdata: data for the event
+    :param eventtime: when the event was due
+    """
+    typestats = event_stats[eventtype]
+    if eventtime is not None:
+        typestats.lag.observe(max((datetime.now(tz=timezone.utc) - eventtime).total_seconds(), 0))
+    typestats.running += 1
+    start = time.perf_counter()
+    try:
+        await handle_event(dbrowid, eventtype, eventdata)
     except Exception as e:
+        typestats.failures += 1
         logger.error(e, exc_info=(type(e), e, e.__traceback__))
+    finally:
+        typestats.running -= 1
+        typestats.runs += 1
+        typestats.duration.observe(time.perf_counter() - start)
+
+
+async def resolve_member(eventdata: dict) -> typing.Tuple[typing.Optional[discord.Guild],
+                                                          typing.Optional[discord.Member]]:
+    """
+    find the guild and member an event is for
+    :return: (guild, member), either can be None if the bot left the guild or the member did
+    """
+    guild = await resolver.guild(botcopy, eventdata["guild"])
+    member = await resolver.member(guild, eventdata["member"]) if guild is not None else None
+    if member is None:
+        logger.info(f"can't find member {eventdata['member']} in guild {eventdata['guild']}, skipping event")
+    return guild, member
+
+
+async def handle_event(dbrowid, eventtype: str, eventdata: dict):
+    logger.debug(f"Running Event #{dbrowid} type {eventtype} data {eventdata}")
+    if dbrowid is not None:
+        await database.write("DELETE FROM schedule WHERE id=?", (dbrowid,))
+    # missed events and ones run straight from schedule() were never loaded
+    loadedtasks.pop(dbrowid, None)
+    if eventtype == "debug":
+        logger.debug("Hello world! (debug event)")
+    elif eventtype == "message":
+        ch = await resolver.messageable(botcopy, eventdata["channel"])
+        if ch is None:
+            logger.info(f"can't find channel or user {eventdata['channel']} for event {dbrowid}")
+            return
+        await ch.send(eventdata["message"])
+    elif eventtype == "unban":
+        guild, member = await asyncio.gather(resolver.guild(botcopy, eventdata["guild"]),
+                                             resolver.user(botcopy, eventdata["member"]))
+        if guild is None or member is None:
+            logger.info(f"can't find guild {eventdata['guild']} or user {eventdata['member']} for event {dbrowid}")
+            return
+        await asyncio.gather(guild.unban(member, reason="End of temp-ban."),
+                             member.send(f"You were unbanned in **{guild.name}**."),
+                             modlog.modlog(f"{member.mention} (`{member}`) "
+                                           f"was automatically unbanned.", guild.id, member.id))
+    elif eventtype == "unmute":
+        # purely cosmetic
+        guild, member = await resolve_member(eventdata)
+        if member is None:
+            return
+        await asyncio.gather(member.send(f"You were unmuted in **{guild.name}**."),
+                             modlog.modlog(f"{member.mention} (`{member}`) "
+                                           f"was automatically unmuted.", guild.id, member.id))
+    elif eventtype == "refresh_mute":
+        guild, member = await resolve_member(eventdata)
+        if member is None:
+            return
+        if eventdata["muteend"] is None:
+            await member.edit(timed_out_until=datetime.now(tz=timezone.utc) + timedelta(days=28))
+            await schedule(datetime.now(tz=timezone.utc) + timedelta(days=28), "refresh_mute",
+                           {"guild": member.guild.id, "member": member.id, "muteend": None})
+            logger.debug(f"Refreshed {member}'s permanent mute in {guild}")
+        else:
+            muteend = datetime.fromtimestamp(eventdata["muteend"], tz=timezone.utc)
+            if muteend - datetime.now(tz=timezone.utc) > timedelta(days=28):
+                await member.edit(timed_out_until=datetime.now(tz=timezone.utc) + timedelta(days=28))
+                await schedule(datetime.now(tz=timezone.utc) + timedelta(days=28),
+                               "refresh_mute",
+                               {"guild": member.guild.id, "member": member.id, "muteend": eventdata["muteend"]})
+                logger.debug(f"Refreshed {member}'s mute in {guild}. ends {muteend}")
+            else:
+                await member.edit(timed_out_until=muteend)
+                await schedule(muteend, "unmute", {"guild": member.guild.id, "member": member.id})
+                logger.debug(f"Refreshed {member}'s mute for the last time in {guild}. ends {muteend}")
+
+    elif eventtype == "un_thin_ice":
+        guild, member = await resolve_member(eventdata)
+        if member is None:
+            return
+        await asyncio.gather(member.remove_roles(discord.Object(eventdata["thin_ice_role"])),
+                             member.send(f"Your thin ice has expired in **{guild.name}**."),
+                             modlog.modlog(f"{member.mention}'s (`{member}`) "
+                                           f"thin ice has expired.", guild.id, member.id))
+        await database.write("DELETE FROM thin_ice WHERE guild=? and user=?", (guild.id, member.id))
+    elif eventtype == "birthday":
+        now = datetime.now(tz=timezone.utc)
+        birthday = datetime.fromtimestamp(eventdata["birthday"], tz=timezone.utc)
+        age = round((now - birthday).days / 365.25)
+        createdchannels = []
+        for guild in botcopy.guilds:
+            bcategory = (await serverconfig.get(guild.id)).birthday_category
+            if bcategory is not None:
+                member = guild.get_member(eventdata["user"])
+                bcategoryreal: discord.CategoryChannel = guild.get_channel(bcategory)
+                if bcategoryreal is not None and member is not None:
+                    dname = ''.join(c for c in member.display_name.lower() if c.isalnum() or c == "-")
+                    bchannel = await bcategoryreal.create_text_channel(f"🎂{dname}-birthday"[:32],
+                                                                       reason=f"{member.display_name}"
+                                                                              f"'s birthday.")
+                    createdchannels.append(bchannel.id)
+                    await bchannel.send(f"Happy {humanize.ordinal(age)} Birthday {member.mention}!!",
+                                        allowed_mentions=discord.AllowedMentions(everyone=False, roles=False,
+                                                                                 users=True, replied_user=True))
+        # schedule next birthday event
+        thisyear = now.year
+        nextbirthday = birthday
+        while nextbirthday < now:
+            try:
+                nextbirthday = nextbirthday.replace(year=thisyear)
+            except ValueError as e:  # leap years are weird
+                logger.debug(str(e))
+            thisyear += 1
+        await schedule(nextbirthday, "birthday", {"user": eventdata["user"], "birthday": birthday.timestamp()})
+        # delete birthday channels in 24 hours
+        await schedule(now + timedelta(days=1), "delbirthdaychannel", {"channels": createdchannels})
+    elif eventtype == "delbirthdaychannel":
+        for ch in eventdata["channels"]:
+            channel = await resolver.channel(botcopy, ch)
+            if channel is not None:
+                await channel.delete(reason="Birthday is over")
+    else:
+        logger.error(f"Unknown event type {eventtype} for event {dbrowid}")
 
 
 async def schedule(time: datetime, eventtype: str, eventdata: dict):
     assert time.tzinfo is not None  # offset aware datetimes my beloved
     if time <= datetime.now(tz=timezone.utc):
         logger.debug(f"running event now")
-        await run_event(None, eventtype, eventdata)
-
-    async with database.db.execute("INSERT INTO schedule (eventtime, eventtype, eventdata) VALUES (?,?,?)",
-                                   (time.timestamp(), eventtype, json.dumps(eventdata))) as cursor:
-        lri = cursor.lastrowid
-        task = scheduler.schedule(run_event(lri, eventtype, eventdata), time)
-        loadedtasks[lri] = task
-        logger.debug(f"scheduled event #{lri} for {time}")
-        # logger.debug(loadedtasks)
-    await database.db.commit()
+        await run_event(None, eventtype, eventdata, time)
+        return None
+
+    # guild, member and user are copied out of the data so lookups can use indexes
+    result = await database.write("INSERT INTO schedule (eventtime, eventtype, eventdata, guild, member, user) "
+                                  "VALUES (?,?,?,?,?,?)",
+                                  (time.timestamp(), eventtype, json.dumps(eventdata), eventdata.get("guild"),
+                                   eventdata.get("member"), eventdata.get("user")))
+    lri = result.lastrowid
+    # events past the window stay in the db until the loader gets to them
+    if time <= loaded_until:
+        load_event(lri, time, eventtype, eventdata)
+    logger.debug(f"scheduled event #{lri} for {time}")
     return lri
 
 
 async def canceltask(dbrowid: int):
-    scheduler.cancel(loadedtasks[dbrowid])
-    await database.db.execute("DELETE FROM schedule WHERE id=?", (dbrowid,))
-    await database.db.commit()
-    # it throws a runtime warning "coroutine was never ran" like no shit that is the entire idea
-    loadedtasks[dbrowid].callback.close()
-    del loadedtasks[dbrowid]
+    await database.write("DELETE FROM schedule WHERE id=?", (dbrowid,))
+    # events outside the window were never loaded, deleting the row is enough
+    if (task := loadedtasks.pop(dbrowid, None)) is not None:
+        scheduler.cancel(task)
+        # it throws a runtime warning "coroutine was never ran" like no shit that is the entire idea
+        task.callback.close()
     logger.debug(f"Cancelled task {dbrowid}")
+
+
+async def stats() -> dict:
+    """
+    :return: JSON-serializable snapshot of the scheduler's state and per event type metrics
+    """
+    async with database.db.execute("SELECT eventtype, count(*) FROM schedule GROUP BY eventtype") as cur:
+        stored = dict(await cur.fetchall())
+    return {
+        "loaded": len(loadedtasks),
+        "loaded_until": loaded_until.isoformat(),
+        "last_catchup": last_catchup,
+        "events": {
+            eventtype: {
+                # waiting in the db, loaded or not
+                "stored": stored.get(eventtype, 0),
+                "running": event_stats[eventtype].running,
+                "runs": event_stats[eventtype].runs,
+                "failures": event_stats[eventtype].failures,
+                "lag": event_stats[eventtype].lag.to_dict(),
+                "duration": event_stats[eventtype].duration.to_dict(),
+            } for eventtype in sorted(set(stored) | set(event_stats))
+        }
+    }
@@ -0,0 +1,93 @@
+import asyncio
+import dataclasses
+import typing
+from collections import defaultdict
+
+import database
+
+# configs are read on basically every event, so keep one copy of each guild's row in memory
+# and only go to the db when a guild is seen for the first time or its config is written to
+
+
+@dataclasses.dataclass
+class ServerConfig:
+    guild: int
+    mod_role: typing.Optional[int] = None
+    log_channel: typing.Optional[int] = None
+    ban_appeal_link: typing.Optional[str] = None
+    thin_ice_role: typing.Optional[int] = None
+    thin_ice_threshold: typing.Optional[int] = None
+    birthday_category: typing.Optional[int] = None
+    booster_roles: typing.Optional[bool] = None
+    booster_role_hoist: typing.Optional[int] = None
+    bulk_log_channel: typing.Optional[int] = None
+    time_between_xp: typing.Optional[float] = None
+    xp_change_per_level: typing.Optional[float] = None
+    verification_channel: typing.Optional[int] = None
+    verified_role: typing.Optional[int] = None
+    verification_text: typing.Optional[str] = None
+
+
+columns = [field.name for field in dataclasses.fields(ServerConfig)]
+cache: typing.Dict[int, ServerConfig] = {}
+# loads and writes for the same guild hold this so a load can never put a stale row back after a write
+locks: typing.DefaultDict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+hits = 0
+misses = 0
+
+
+async def get(guild: int) -> ServerConfig:
+    """
+    get the config of a guild, from the cache if possible
+    :param guild: ID of guild
+    :return: the guild's config. guilds with no row get a config with every option unset.
+    """
+    global hits, misses
+    if guild in cache:
+        hits += 1
+        return cache[guild]
+    async with locks[guild]:
+        # might have been loaded while we waited for the lock
+        if guild in cache:
+            hits += 1
+            return cache[guild]
+        misses += 1
+        async with database.db.execute(f"SELECT {','.join(columns)} FROM server_config WHERE guild=?",
+                                       (guild,)) as cur:
+            row = await cur.fetchone()
+        if row is None:
+            conf = ServerConfig(guild=guild)
+        else:
+            conf = ServerConfig(*row)
+        cache[guild] = conf
+        return conf
+
+
+async def update(guild: int, config: str, value):
+    """
+    write one config option to the db and the cache
+    :param guild: ID of guild
+    :param config: name of the column. DO NOT ALLOW CONFIG TO BE PASSED AS A VARIABLE, PRE-DEFINED STRINGS ONLY.
+    :param value: new value of the option
+    """
+    if config not in columns or config == "guild":
+        raise ValueError(f"{config} is not a server config option.")
+    async with locks[guild]:
+        async with database.db.execute("SELECT COUNT(guild) FROM server_config WHERE guild=?", (guild,)) as cur:
+            guilds = await cur.fetchone()
+        if guilds[0]:  # if there already is a row for this guild
+            await database.write(f"UPDATE server_config SET {config} = ? WHERE guild=?", (value, guild))
+        else:  # if not, make one
+            await database.write(f"INSERT INTO server_config(guild, {config}) VALUES (?, ?)", (guild, value))
+        if guild in cache:
+            setattr(cache[guild], config, value)
+
+
+def stats() -> typing.Dict[str, typing.Union[int, float]]:
+    total = hits + misses
+    return {
+        "guilds": len(cache),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0
+    }
@@ -22,6 +22,9 @@ from discord.ext.commands.cooldowns import BucketType
 from faker import Faker
 
 import config
+import database
+import historyscan
+import messagearchive
 import modlog
 import scheduler
 from clogs import logger
@@ -156,10 +159,16 @@ class UtilityCommands(commands.Cog, name="Utility"):
         """
         channel = channel or ctx.channel
         async with ctx.channel.typing():
-            count = 0
-            async for _ in channel.history(limit=None):
-                count += 1
-            await ctx.reply(f"There are {count} messages in {channel.mention}.")
+            skipped = ""
+            if await messagearchive.backfilled(channel.guild.id):
+                async with database.db.execute("SELECT count(*) FROM archived_messages WHERE channel=?",
+                                               (channel.id,)) as cur:
+                    count = (await cur.fetchone())[0]
+            else:
+                scan = await historyscan.scan([channel])
+                count = scan.messages
+                skipped = scan.skipped_message()
+            await ctx.reply(f"There are {count} messages in {channel.mention}.{skipped}")
 
     # @commands.cooldown(1, 60 * 60 * 24 * 7, BucketType.channel)
     @commands.is_owner()
@@ -176,10 +185,14 @@ class UtilityCommands(commands.Cog, name="Utility"):
         async with ctx.channel.typing():
             await destination.send(f"Cloning messages from {target.mention}")
             count = 0
-            async for msg in target.history(limit=None, oldest_first=True):
+
+            async def clone(msg: discord.Message):
+                nonlocal count
                 if await clone_message(msg, destination):
                     count += 1
-            await destination.send(f"Cloned {count} message(s) from {target.mention}")
+
+            scan = await historyscan.scan([target], clone, oldest_first=True)
+            await destination.send(f"Cloned {count} message(s) from {target.mention}{scan.skipped_message()}")
 
     class AdvancedPurgeSettings(commands.FlagConverter, case_insensitive=True):
         limit: int = None
@@ -276,8 +289,10 @@ class UtilityCommands(commands.Cog, name="Utility"):
         if not opts.all_channels and (opts.ac_channels_only or opts.ac_threads_only):
             raise commands.errors.UserInputError("Cannot specify `ac_channels_only` or `ac_threads_only` without "
                                                  "`all_channels`.")
+        # deletes just aren't logged if the bulk log cog isn't loaded
+        bulklog = self.bot.get_cog("BulkLog")
         pargs = {}
-        pargs['check'] = check
+        pargs['check'] = bulklog.suppress_check(check) if bulklog else check
         for flag, value in opts:
             if flag in ["limit", "before", "after", "around", "oldest_first"]:
                 pargs[flag] = value
@@ -328,7 +343,10 @@ class UtilityCommands(commands.Cog, name="Utility"):
                         content=f"Deleting messages from {channel.mention} ({i + 1}/{len(channels)})... "
                                 f"Deleted `{deleted_count}` messages so far...")
                 try:
-                    deleted_count += len(await channel.purge(**pargs))
+                    deleted = await channel.purge(**pargs)
+                    deleted_count += len(deleted)
+                    if bulklog:
+                        await bulklog.log_bulk_delete(deleted, channel, ctx.author)
                 except e:
                     await ctx.reply(f"Failed to delete messages from {channel.mention} due to {e}")
                 if rearchive:
@@ -393,9 +411,13 @@ class UtilityCommands(commands.Cog, name="Utility"):
                     single_delete.append(msg)
                 else:
                     bulk_delete.append(msg)
+            if bulklog := self.bot.get_cog("BulkLog"):
+                bulklog.suppress(msg.id for msg in to_delete)
             # await the deletes all at once frfr
             await asyncio.gather(*([msg.delete() for msg in single_delete] +
                                    [target.delete_messages(msgs) for msgs in slice_per(bulk_delete, 100)]))
+            if bulklog:
+                await bulklog.log_bulk_delete(to_delete, target, ctx.author)
             await ctx.reply(f"Cloned {count} message{'' if count == 1 else 's'} into {destination.mention}")
 
     @commands.cooldown(1, 60 * 60, BucketType.channel)
@@ -410,14 +432,24 @@ class UtilityCommands(commands.Cog, name="Utility"):
         channel = channel or ctx.channel
         async with ctx.channel.typing():
             count = 0
-            async for msg in channel.history(limit=None):
+
+            async def countmedia(msg: discord.Message):
+                nonlocal count
                 if len(msg.embeds):
                     for embed in msg.embeds:
                         if embed.type in ["image", "video", "audio", "gifv"]:
                             count += 1
                 if len(msg.attachments):
                     count += len(msg.attachments)
-            await ctx.reply(f"There are {count} media in {channel.mention}.")
+
+            skipped = ""
+            if await messagearchive.backfilled(channel.guild.id):
+                async with database.db.execute("SELECT total(media) FROM archived_messages WHERE channel=?",
+                                               (channel.id,)) as cur:
+                    count = int((await cur.fetchone())[0])
+            else:
+                skipped = (await historyscan.scan([channel], countmedia)).skipped_message()
+            await ctx.reply(f"There are {count} media in {channel.mention}.{skipped}")
 
     # @commands.cooldown(1, 60 * 60, BucketType.channel)
     @commands.command(hidden=True)
@@ -438,22 +470,27 @@ class UtilityCommands(commands.Cog, name="Utility"):
         channel = ctx.channel
         files = []
         exts = []
-        async with ctx.channel.typing():
-            async for msg in channel.history(limit=None, oldest_first=True):
-                if len(msg.embeds):
-                    for embed in msg.embeds:
-                        if embed.type in ["image", "video", "audio", "gifv"]:
-                            async def save():
-                                return await saveurl(embed.url)
+        async def collect(msg: discord.Message):
+            if len(msg.embeds):
+                for embed in msg.embeds:
+                    if embed.type in ["image", "video", "audio", "gifv"]:
+                        async def save():
+                            return await saveurl(embed.url)
+
+                        files.append(retry_coro(save))
+                        exts.append(get_ext(embed.url))
+                        logger.debug((embed.url, get_ext(embed.url)))
+            if len(msg.attachments):
+                for att in msg.attachments:
+                    files.append(retry_coro(att.read))
+                    exts.append(get_ext(att.url))
+                    logger.debug((att.url, get_ext(att.url)))
 
-                            files.append(retry_coro(save))
-                            exts.append(get_ext(embed.url))
-                            logger.debug((embed.url, get_ext(embed.url)))
-                if len(msg.attachments):
-                    for att in msg.attachments:
-                        files.append(retry_coro(att.read))
-                        exts.append(get_ext(att.url))
-                        logger.debug((att.url, get_ext(att.url)))
+        async with ctx.channel.typing():
+            scan = await historyscan.scan([channel], collect, oldest_first=True)
+            if skipped := scan.skipped_message():
+                await ctx.reply(skipped.strip())
+                return
             if parallel:
                 filebytes = await asyncio.gather(*files)
             else:
@@ -500,25 +537,41 @@ class UtilityCommands(commands.Cog, name="Utility"):
         """
         replystr = f"Gathering emoji statistics for **{ctx.guild.name}**. This may take a while."
         replymsg = await ctx.reply(replystr)
-        messagecount = 0
         emojicount = 0
         async with ctx.channel.typing():
             emojiregex = r"<a?:\w{2,32}:(\d{18,22})>"
             counts = defaultdict(int)
-            for channel in ctx.guild.text_channels:
-                logger.debug(f"counting emojis in {channel}")
-                if channel.id == 830588015243427890:
-                    continue
-                async for msg in channel.history(limit=None):
-                    if messagecount % 1000 == 0:
-                        await replymsg.edit(content=f"{replystr}\nCurrently scanning:{channel.mention}"
-                                                    f"\nScanned {messagecount} messages.\nFound {emojicount} emojis.\n")
-                    messagecount += 1
-                    for match in re.finditer(emojiregex, msg.content):
-                        emoji = match.group(0)
-                        counts[emoji] += 1
-                        emojicount += 1
-            await replymsg.edit(content=f"{replystr}\nScanned {messagecount} messages.\nFound {emojicount} emojis.\n")
+
+            async def countemojis(msg: discord.Message):
+                nonlocal emojicount
+                if scan.messages % 1000 == 0:
+                    await replymsg.edit(content=f"{replystr}\nCurrently scanning:"
+                                                f"{', '.join(ch.mention for ch in scan.active)}"
+                                                f"\nScanned {scan.messages} messages.\nFound {emojicount} emojis.\n")
+                for match in re.finditer(emojiregex, msg.content):
+                    emoji = match.group(0)
+                    counts[emoji] += 1
+                    emojicount += 1
+
+            channels = [ch for ch in ctx.guild.text_channels if ch.id != 830588015243427890]
+            skipped = ""
+            if await messagearchive.backfilled(ctx.guild.id):
+                messagecount = 0
+                channelids = [ch.id for ch in channels]
+                async with database.db.execute(f"SELECT content FROM archived_messages WHERE channel IN "
+                                               f"({','.join('?' * len(channelids))})", channelids) as cur:
+                    async for (content,) in cur:
+                        messagecount += 1
+                        for match in re.finditer(emojiregex, content):
+                            counts[match.group(0)] += 1
+                            emojicount += 1
+            else:
+                scan = historyscan.HistoryScan(channels, countemojis)
+                await scan.run()
+                messagecount = scan.messages
+                skipped = scan.skipped_message()
+            await replymsg.edit(content=f"{replystr}\nScanned {messagecount} messages.\nFound {emojicount} emojis.\n"
+                                        f"{skipped}")
             sortedcount = {k: v for k, v in sorted(counts.items(), key=lambda item: item[1], reverse=True)}
             with io.BytesIO() as buf:
                 buf.write(json.dumps(sortedcount, indent=4).encode())
@@ -724,9 +777,10 @@ class UtilityCommands(commands.Cog, name="Utility"):
     @commands.is_owner()
     async def countvotes(self, ctx: commands.Context):
         await ctx.message.delete()
-        msgs = [msg async for msg in ctx.history(limit=None)]
+        msgs = []
+        scan = await historyscan.scan([ctx.channel], msgs.append)
         if not msgs:
-            await ctx.reply("No messages in channel")
+            await ctx.reply(f"No messages in channel{scan.skipped_message()}")
             return
         msgs.sort(key=self.votes, reverse=True)
 
@@ -1,21 +1,23 @@
+import array
 import asyncio
-import datetime
-import itertools
+import bisect
 import math
-import operator
 import sys
+import time
 import typing
 from collections import defaultdict
 
-import aiosqlite
 import discord
 import si_prefix
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import BucketType
 
 import database
+import historyscan
+import messagearchive
 import moderation
 import modlog
+import serverconfig
 from clogs import logger
 
 
@@ -54,43 +56,138 @@ def xp_to_level(xp: float, xp_per_level: float):
                       + sys.float_info.epsilon)
 
 
-async def sort_messages_in_channel(channel: discord.abc.Messageable):
-    out = defaultdict(list)
-    try:
-        async for msg in channel.history(limit=None, oldest_first=True):
-            if not msg.author.bot:
-                out[msg.author.id].append(msg.created_at)
-    except discord.Forbidden:
-        pass
-    return out
+def timestamps_to_xp(timestamps: array.array, time_between_xp: float) -> int:
+    """
+    count how many XP a user would've gained from a list of messages
+    :param timestamps: sorted message times in ms, as snowflake timestamps (message ID >> 22)
+    :param time_between_xp: guild's XP cooldown in seconds
+    :return: XP gained
+    """
+    xp = 0
+    cooldown = time_between_xp * 1000
+    i = 0
+    n = len(timestamps)
+    # every message gaining XP restarts the cooldown, so jump straight to the first message after it ends
+    while i < n:
+        xp += 1
+        i = bisect.bisect_left(timestamps, timestamps[i] + cooldown, i + 1)
+    return xp
 
 
-dict_of_lists = dict[typing.Any, list]
+class CooldownStore:
+    """
+    keeps track of when each user can next gain XP in each guild.
+    entries are thrown away once their cooldown is over, since an expired entry means the same thing as no entry,
+    so this only ever holds users who gained XP within their guild's cooldown.
+    """
 
+    def __init__(self, maxsize: int = 1_000_000, sweep_interval: float = 300):
+        """
+        :param maxsize: maximum number of entries, the least recently updated ones are dropped past this
+        :param sweep_interval: seconds between passes that drop expired entries
+        """
+        # packed (user, guild) -> unix timestamp the cooldown ends at. dict order is oldest update first.
+        self.expiries: typing.Dict[int, float] = {}
+        self.maxsize = maxsize
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0.0
+        self.evicted = 0
+
+    @staticmethod
+    def key(user: int, guild: int) -> int:
+        # snowflakes fit in 64 bits so both can be packed into one int, no tuple or string to build per message
+        return user << 64 | guild
+
+    def remaining(self, user: int, guild: int, now: float) -> float:
+        """
+        :return: seconds until the user can gain XP in the guild again, 0 if they can now
+        """
+        expiry = self.expiries.get(self.key(user, guild))
+        if expiry is None or expiry <= now:
+            return 0
+        return expiry - now
 
-def lodoltdol(inp: list[dict_of_lists]) -> dict_of_lists:
-    # list_of_dicts_of_lists_to_dict_of_lists
-    # https://stackoverflow.com/a/54108746/9044183
-    # initialise defaultdict of lists
-    dd = defaultdict(list)
+    def set(self, user: int, guild: int, now: float, cooldown: float):
+        """
+        start a cooldown
+        :param user: ID of user
+        :param guild: ID of guild
+        :param now: unix timestamp the cooldown starts at
+        :param cooldown: length of the cooldown in seconds
+        """
+        key = self.key(user, guild)
+        # reinsert so the entry moves to the end of the dict
+        self.expiries.pop(key, None)
+        self.expiries[key] = now + cooldown
+        if len(self.expiries) > self.maxsize:
+            del self.expiries[next(iter(self.expiries))]
+            self.evicted += 1
+        if now - self.last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+    def sweep(self, now: float):
+        """
+        drop every entry whose cooldown is over
+        :param now: current unix timestamp
+        """
+        expired = [key for key, expiry in self.expiries.items() if expiry <= now]
+        for key in expired:
+            del self.expiries[key]
+        self.evicted += len(expired)
+        self.last_sweep = now
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "entries": len(self.expiries),
+            "evicted": self.evicted,
+            # the dict itself plus one int key and one float value per entry
+            "bytes": sys.getsizeof(self.expiries) + sum(sys.getsizeof(k) + sys.getsizeof(v)
+                                                        for k, v in self.expiries.items())
+        }
 
-    # iterate dictionary items
-    dict_items = map(operator.methodcaller('items'), inp)
-    for k, v in itertools.chain.from_iterable(dict_items):
-        dd[k].extend(v)
-    return dd
 
+# XP gains are collected in memory and written in one go when either of these is hit
+xp_flush_interval = 10  # seconds
+xp_flush_size = 100  # pending (user, guild) pairs
+# messages indexed per write/checkpoint during a recalculation scan
+xp_scan_batch_size = 1000
+# the progress message of a recalculation scan is edited at most this often, big guilds finish channels faster than
+# discord allows edits
+xp_scan_progress_interval = 5  # seconds
 
-def list_of_datetimes_to_xp(inp: list[datetime.datetime], time_between_xp: float) -> int:
-    xp = 0
-    inp = sorted(inp)
-    # just some random old date
-    last_xp_gain = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
-    for msg in inp:
-        if (msg - last_xp_gain).total_seconds() >= time_between_xp:
-            xp += 1
-            last_xp_gain = msg
-    return xp
+
+class MessageIndexer(historyscan.Visitor):
+    """
+    adds every non-bot message a scan sees to the message index.
+    each channel's checkpoint is saved with every batch, so an interrupted scan picks up where it left off.
+    """
+
+    def __init__(self):
+        self.rows: typing.DefaultDict[int, list] = defaultdict(list)
+        self.last: typing.Dict[int, int] = {}
+        self.scanned: typing.DefaultDict[int, int] = defaultdict(int)
+
+    async def visit(self, message: discord.Message):
+        channel = message.channel.id
+        self.last[channel] = message.id
+        self.scanned[channel] += 1
+        if not message.author.bot:
+            self.rows[channel].append((message.guild.id, channel, message.author.id, message.id))
+        if self.scanned[channel] % xp_scan_batch_size == 0:
+            await self.save(message.channel)
+
+    async def channel_done(self, channel: historyscan.HistoryChannel):
+        if channel.id in self.last:
+            await self.save(channel)
+
+    async def save(self, channel: historyscan.HistoryChannel):
+        rows = self.rows.pop(channel.id, [])
+        await database.write_all(
+            database.Write("INSERT OR IGNORE INTO xp_message_index (guild, channel, author, message) VALUES (?,?,?,?)",
+                           rows, many=True),
+            database.Write("INSERT INTO xp_scan_checkpoints (guild, channel, last_message) VALUES (?,?,?) "
+                           "ON CONFLICT(channel) DO UPDATE SET last_message = excluded.last_message",
+                           (channel.guild.id, channel.id, self.last[channel.id])))
 
 
 class ExperienceCog(commands.Cog, name="Experience"):
@@ -98,11 +195,73 @@ class ExperienceCog(commands.Cog, name="Experience"):
     def __init__(self, bot):
         self.bot: commands.Bot = bot
         # var and not db for performance and cause it doesnt really matter if its lost
-        self.last_message_in_guild = {
-            "user.guild": "datetime object"
-        }
+        self.cooldowns = CooldownStore()
         # suspend XP gain for recalculation
         self.suspended_guild = []
+        # XP gained since the last flush, keyed by (user, guild)
+        self.pending_xp: typing.DefaultDict[typing.Tuple[int, int], float] = defaultdict(float)
+        # held for a whole flush, so waiting on it means every XP gained so far is in the db
+        self.flush_lock = asyncio.Lock()
+        # excluded user and channel IDs per guild, loaded from the db the first time a guild is seen
+        self.xp_exclusions: typing.Dict[int, typing.FrozenSet[int]] = {}
+
+    async def cog_load(self):
+        self.flush_xp_loop.start()
+
+    async def cog_unload(self):
+        self.flush_xp_loop.cancel()
+        await self.flush_xp()
+
+    async def flush_xp(self):
+        """
+        write all pending XP to the db with one statement and one commit.
+        if a flush is already running this waits for it, so readers that flush first see everything.
+        """
+        async with self.flush_lock:
+            if not self.pending_xp:
+                return
+            # swap the dict out first so XP gained while we write goes into the next batch
+            pending, self.pending_xp = self.pending_xp, defaultdict(float)
+            try:
+                await database.write_many("""INSERT INTO experience(user, guild, experience) VALUES (?,?,?)
+                                ON CONFLICT(user, guild) DO UPDATE SET experience = experience + excluded.experience;""",
+                                          [(user, guild, xp) for (user, guild), xp in pending.items()])
+            except Exception:
+                # put it back so it gets tried again next flush
+                for key, xp in pending.items():
+                    self.pending_xp[key] += xp
+                raise
+            logger.debug(f"flushed XP for {len(pending)} user(s)")
+
+    async def discard_pending_xp(self, guild: int, user: typing.Optional[int] = None):
+        """
+        throw away unflushed XP, for when the db rows are about to be reset or overwritten.
+        waits for a running flush, so XP it fails to write can't be put back after being discarded.
+        :param guild: ID of guild
+        :param user: ID of user, leave blank for everyone in the guild
+        """
+        async with self.flush_lock:
+            for key in [key for key in self.pending_xp if key[1] == guild and (user is None or key[0] == user)]:
+                del self.pending_xp[key]
+
+    async def get_xp_exclusions(self, guild: int) -> typing.FrozenSet[int]:
+        """
+        get the IDs of all users and channels excluded from gaining XP in a guild
+        :param guild: ID of guild
+        :return: frozenset of user and channel IDs
+        """
+        if guild not in self.xp_exclusions:
+            async with database.db.execute("SELECT userorchannel FROM guild_xp_exclusions WHERE guild=?",
+                                           (guild,)) as cur:
+                self.xp_exclusions[guild] = frozenset(row[0] for row in await cur.fetchall())
+        return self.xp_exclusions[guild]
+
+    @tasks.loop(seconds=xp_flush_interval)
+    async def flush_xp_loop(self):
+        try:
+            await self.flush_xp()
+        except Exception as e:
+            logger.error(e, exc_info=(type(e), e, e.__traceback__))
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -115,49 +274,46 @@ class ExperienceCog(commands.Cog, name="Experience"):
         if message.guild.id in self.suspended_guild:
             return
 
-        # we dont care how long the timeout is if there is no entry for last message
-        if f"{message.author.id}.{message.guild.id}" in self.last_message_in_guild:
-            # get timeout between message for this guild
-            async with database.db.execute("SELECT time_between_xp FROM server_config WHERE guild=?",
-                                           (message.guild.id,)) as cur:
-                cur: aiosqlite.Cursor
-                timeout = await cur.fetchone()
-            if timeout and timeout[0]:
-                timeout = timeout[0]
-            else:  # sensible default
-                timeout = 60
-            # make sure the minimum timeout has passed
-            sincelastmsg = discord.utils.utcnow() - self.last_message_in_guild[f"{message.author.id}."
-                                                                               f"{message.guild.id}"]
-            if sincelastmsg.total_seconds() < timeout:
-                logger.debug(f"{message.author} has to wait {round(timeout - sincelastmsg.total_seconds(), 1):g}s"
-                             f" before gaining XP again in {message.guild}.")
-                return
-        # check if user or channel is excluded from gaining XP
-        async with database.db.execute("SELECT userorchannel FROM guild_xp_exclusions WHERE guild=?",
-                                       (message.guild.id,)) as cur:
-            cur: aiosqlite.Cursor
-            async for row in cur:
-                excl = row[0]
-                if message.channel.id == excl or message.author.id == excl:
-                    logger.debug(f"{message.author} tried to gain XP as an excluded user or in an excluded channel"
-                                 f" in {message.guild}. Exclusion is {excl}.")
-                    return
-        # create new record of 1 xp or update by 1
-        await database.db.execute("""INSERT INTO experience(user, guild, experience) VALUES (?,?,1)
-                            ON CONFLICT(user, guild) DO UPDATE SET experience = experience + 1;""",
-                                  (message.author.id, message.guild.id))
-        await database.db.commit()
-        self.last_message_in_guild[f"{message.author.id}.{message.guild.id}"] = message.created_at
+        # make sure the minimum timeout has passed
+        remaining = self.cooldowns.remaining(message.author.id, message.guild.id, discord.utils.utcnow().timestamp())
+        if remaining:
+            logger.debug(f"{message.author} has to wait {round(remaining, 1):g}s"
+                         f" before gaining XP again in {message.guild}.")
+            return
+        # check if user or channel is excluded from gaining XP. threads are excluded if their parent channel is.
+        excl = await self.get_xp_exclusions(message.guild.id)
+        if message.author.id in excl or message.channel.id in excl \
+                or getattr(message.channel, "parent_id", None) in excl:
+            logger.debug(f"{message.author} tried to gain XP as an excluded user or in an excluded channel"
+                         f" in {message.guild}.")
+            return
+        # get timeout between message for this guild
+        timeout = await moderation.get_server_config(message.guild.id, "time_between_xp")
+        if not timeout:  # sensible default
+            timeout = 60
+        self.cooldowns.set(message.author.id, message.guild.id, message.created_at.timestamp(), timeout)
+        # queue 1 xp, its written to the db on the next flush
+        self.pending_xp[(message.author.id, message.guild.id)] += 1
+        if len(self.pending_xp) >= xp_flush_size:
+            await self.flush_xp()
         logger.debug(f"{message.author} gained XP in {message.guild}")
 
     @commands.command()
     @commands.has_permissions(manage_guild=True)
     @commands.cooldown(1, 60 * 60 * 24 * 7, BucketType.guild)
-    async def recalculateguildxp(self, ctx: commands.Context):
+    async def recalculateguildxp(self, ctx: commands.Context, rescan: bool = False):
         """
-        recalculate guild's XP from message history
+        recalculate guild's XP from message history.
+        messages already seen by a previous recalculation aren't fetched again, so only the first run is slow.
+
+        :param ctx: discord context
+        :param rescan: forget what previous recalculations saw and scan all history again, use if the guild's XP
+        cooldown changed a lot or messages were mass deleted.
         """
+        if rescan:
+            await database.write_all(
+                database.Write("DELETE FROM xp_scan_checkpoints WHERE guild=?", (ctx.guild.id,)),
+                database.Write("DELETE FROM xp_message_index WHERE guild=?", (ctx.guild.id,)))
         async with ctx.typing():
             # get text channels and active threads
             channels = set(ctx.guild.text_channels + list(ctx.guild.threads))
@@ -192,33 +348,64 @@ class ExperienceCog(commands.Cog, name="Experience"):
             excl = list(sum(excl, ()))
             # remove all exclusions
             channels = [ch for ch in channels if ch.id not in excl]
-        # search all the channels async at once into a list of datetimes of message sent, since thats all we care about
-        msg = await ctx.reply(f"Scanning {len(channels)} channels... this will take a while...")
-        async with ctx.typing():
-            # gather can cause 429s
-            # res = await asyncio.gather(*[sort_messages_in_channel(ch) for ch in channels])
-            res = [await sort_messages_in_channel(ch) for ch in channels]
-        await msg.edit(content="Gathered messages, calculating and setting XP...")
+        # archived guilds already have every message locally, no need to scan
+        if await messagearchive.backfilled(ctx.guild.id):
+            msg = await ctx.reply("Calculating and setting XP from the message archive...")
+            query = "SELECT author, channel, id FROM archived_messages WHERE guild=? AND NOT bot ORDER BY author, id"
+        else:
+            msg = await ctx.reply(f"Scanning {len(channels)} channels for new messages...")
+            async with ctx.typing():
+                async with database.db.execute("SELECT channel, last_message FROM xp_scan_checkpoints WHERE guild=?",
+                                               (ctx.guild.id,)) as cur:
+                    checkpoints = dict(await cur.fetchall())
+
+                class Progress(historyscan.Visitor):
+                    last_edit = 0.0
+
+                    async def channel_done(self, channel):
+                        if time.monotonic() - self.last_edit < xp_scan_progress_interval:
+                            return
+                        self.last_edit = time.monotonic()
+                        await msg.edit(content=f"Scanning {len(channels)} channels for new messages... "
+                                               f"{progress_bar(scan.channels_done, len(channels))} "
+                                               f"{scan.messages} new messages")
+
+                scan = historyscan.HistoryScan(channels, MessageIndexer(), Progress(), oldest_first=True,
+                                               after=checkpoints)
+                await scan.run()
+            await msg.edit(content=f"Indexed {scan.messages} new messages, calculating and setting XP..."
+                                   f"{scan.skipped_message()}")
+            query = "SELECT author, channel, message FROM xp_message_index WHERE guild=? ORDER BY author, message"
         async with ctx.typing():
-            async with database.db.execute("SELECT time_between_xp FROM server_config WHERE guild=?",
-                                           (ctx.guild.id,)) as cur:
-                cur: aiosqlite.Cursor
-                timeout = await cur.fetchone()
+            timeout = await moderation.get_server_config(ctx.guild.id, "time_between_xp")
             if timeout is None:
                 timeout = 60
-            else:
-                timeout = timeout[0]
-            # flatten indivitual lists from each channel into one big dict
-            res = lodoltdol(res)
-            # calculate xp from lists of message sends and simultaneously do exclusions
-            xps = {k: list_of_datetimes_to_xp(v, timeout) for k, v in res.items() if k not in excl}
+            # only count channels that still exist and aren't excluded
+            channelids = {ch.id for ch in channels}
+            xps = {}
+            # every message in the guild, on a read connection so group commits aren't stuck behind it. the scan's
+            # writes were all awaited, so they're committed and visible there
+            async with database.read() as con, con.execute(query, (ctx.guild.id,)) as cur:
+                # rows come grouped by author, so only one user's messages are ever held at once
+                user = None
+                times = array.array("q")
+                async for author, channel, message in cur:
+                    if author != user:
+                        if times and user not in excl:
+                            xps[user] = timestamps_to_xp(times, timeout)
+                        user = author
+                        times = array.array("q")
+                    if channel in channelids:
+                        # timestamp part of the snowflake, ms since the discord epoch
+                        times.append(message >> 22)
+                if times and user not in excl:
+                    xps[user] = timestamps_to_xp(times, timeout)
             logger.debug(xps)
             try:
                 self.suspended_guild.append(ctx.guild.id)
-                for user, xp in xps.items():
-                    await database.db.execute("INSERT OR REPLACE INTO experience (user, guild, experience) "
-                                              "VALUES (?,?,?)", (user, ctx.guild.id, xp))
-                await database.db.commit()
+                await self.discard_pending_xp(ctx.guild.id)
+                await database.write_many("INSERT OR REPLACE INTO experience (user, guild, experience) VALUES (?,?,?)",
+                                          [(user, ctx.guild.id, xp) for user, xp in xps.items()])
                 self.suspended_guild.remove(ctx.guild.id)
             except Exception as e:
                 self.suspended_guild.remove(ctx.guild.id)
@@ -226,29 +413,29 @@ class ExperienceCog(commands.Cog, name="Experience"):
         await ctx.reply(f"Successfully recalculated {sum(xps.values())} XP points for {len(xps)} users!")
         await msg.delete()
 
-    # TODO: add option to exclude all child threads
     @moderation.mod_only()
     @commands.command()
     async def excludefromxp(self, ctx: commands.Context,
                             userorchannel: typing.Union[discord.User, discord.TextChannel, discord.Thread]):
         """
-        exclude user or channel from gaining XP
+        exclude user or channel from gaining XP. excluding a channel also excludes its threads.
 
         :param ctx: discord context
         :param userorchannel: user or channel to disallow gaining XP.
         """
+        excl = await self.get_xp_exclusions(ctx.guild.id)
         async with database.db.execute("SELECT 1 FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
-                                       (ctx.guild.id, ctx.author.id)) as cur:
-            if await cur.fetchone() is not None:
-                exists = True
-                await database.db.execute("DELETE FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
-                                          (ctx.guild.id, ctx.author.id))
-            else:
-                exists = False
-                await database.db.execute(
-                    "INSERT INTO guild_xp_exclusions(guild, userorchannel, mod_set) VALUES (?,?,true)",
-                    (ctx.guild.id, userorchannel.id))
-            await database.db.commit()
+                                       (ctx.guild.id, userorchannel.id)) as cur:
+            exists = await cur.fetchone() is not None
+        if exists:
+            await database.write("DELETE FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
+                                 (ctx.guild.id, userorchannel.id))
+            excl = excl - {userorchannel.id}
+        else:
+            await database.write("INSERT INTO guild_xp_exclusions(guild, userorchannel, mod_set) VALUES (?,?,true)",
+                                 (ctx.guild.id, userorchannel.id))
+            excl = excl | {userorchannel.id}
+        self.xp_exclusions[ctx.guild.id] = excl
         await ctx.reply(f"✔️ {'Unexcluded' if exists else 'Excluded'} {userorchannel.mention} from XP.")
 
     @commands.command()
@@ -256,22 +443,23 @@ class ExperienceCog(commands.Cog, name="Experience"):
         """
         enable or disable yourself from getting XP.
         """
+        excl = await self.get_xp_exclusions(ctx.guild.id)
         async with database.db.execute("SELECT mod_set FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
                                        (ctx.guild.id, ctx.author.id)) as cur:
             res = await cur.fetchone()
             # user is not excluded from guild
             if res is None:
                 result = "Disabled"
-                await database.db.execute(
+                await database.write(
                     "INSERT INTO guild_xp_exclusions(guild, userorchannel, mod_set) VALUES (?,?,false)",
                     (ctx.guild.id, ctx.author.id))
-                await database.db.commit()
+                self.xp_exclusions[ctx.guild.id] = excl | {ctx.author.id}
             # user is excluded but not by a mod
             elif not res[0]:
                 result = "Enabled"
-                await database.db.execute("DELETE FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
-                                          (ctx.guild.id, ctx.author.id))
-                await database.db.commit()
+                await database.write("DELETE FROM guild_xp_exclusions WHERE guild=? AND userorchannel=?",
+                                     (ctx.guild.id, ctx.author.id))
+                self.xp_exclusions[ctx.guild.id] = excl - {ctx.author.id}
             # user is excluded by a mod, dont let them reenable xp on their own
             else:
                 result = "Blocked"
@@ -292,6 +480,8 @@ class ExperienceCog(commands.Cog, name="Experience"):
         # https://www.wolframalpha.com/input/?i=sum+from+0+to+x+yx
         if user is None:
             user = ctx.author
+        # make sure unflushed XP is counted
+        await self.flush_xp()
         async with database.db.execute("SELECT experience, experience_rank FROM (SELECT experience, RANK() OVER "
                                        "(ORDER BY experience DESC) experience_rank, user FROM experience "
                                        "WHERE guild = ?) WHERE user=?",
@@ -302,14 +492,10 @@ class ExperienceCog(commands.Cog, name="Experience"):
             rank = None
         else:
             exp, rank = exp
-        async with database.db.execute("SELECT xp_change_per_level FROM server_config WHERE guild=?",
-                                       (ctx.guild.id,)) as cur:
-            change_per_level = await cur.fetchone()
+        change_per_level = await moderation.get_server_config(ctx.guild.id, "xp_change_per_level")
         if change_per_level is None:
             # default
             change_per_level = 30
-        else:
-            change_per_level = change_per_level[0]
         level = xp_to_level(exp, change_per_level)
         xp_for_current_level = level_to_xp(level, change_per_level)
         xp_for_next_level = level_to_xp(level + 1, change_per_level)
@@ -347,12 +533,9 @@ class ExperienceCog(commands.Cog, name="Experience"):
                         inline=False)
         embed2 = discord.Embed(color=discord.Color(0xf6f121), title=f"Experience in {ctx.guild}")
         embed2.set_thumbnail(url=ctx.guild.icon.url)
-        async with database.db.execute("SELECT time_between_xp, xp_change_per_level FROM server_config WHERE guild=?",
-                                       (ctx.guild.id,)) as cur:
-            xpinfo = await cur.fetchone()
-        if xpinfo is None:
-            xpinfo = 60, 30
-        time_between_xp, xp_change_per_level = xpinfo
+        xpinfo = await serverconfig.get(ctx.guild.id)
+        time_between_xp = 60 if xpinfo.time_between_xp is None else xpinfo.time_between_xp
+        xp_change_per_level = 30 if xpinfo.xp_change_per_level is None else xpinfo.xp_change_per_level
         embed2.add_field(name="Server Delay Between XP Gain",
                          value=f"You can only gain XP every {time_between_xp:g} seconds in this server.", inline=False)
         embed2.add_field(name="Server XP change per level",
@@ -368,28 +551,26 @@ class ExperienceCog(commands.Cog, name="Experience"):
         :param page: page of results
         """
         assert page > 0, "Page must be 1 or more"
-        async with database.db.execute(f"SELECT user, experience, RANK() OVER (ORDER BY experience DESC) "
-                                       f"experience_rank FROM experience WHERE guild = ? "
-                                       f"LIMIT 10 OFFSET {(page - 1) * 10}",
-                                       (ctx.guild.id,)) as cur:
-            rows = await cur.fetchall()
+        # make sure unflushed XP is counted
+        await self.flush_xp()
+        async with database.read() as con:
+            async with con.execute(f"SELECT user, experience, RANK() OVER (ORDER BY experience DESC) "
+                                   f"experience_rank FROM experience WHERE guild = ? "
+                                   f"LIMIT 10 OFFSET {(page - 1) * 10}",
+                                   (ctx.guild.id,)) as cur:
+                rows = await cur.fetchall()
+            # get top xp to make bar
+            async with con.execute("SELECT max(experience) FROM experience WHERE guild=?", (ctx.guild.id,)) as cur:
+                topxp = (await cur.fetchone())[0]
         embed = discord.Embed(color=discord.Color(0x15fe02), title=ctx.guild.name,
                               description=f"Page {page}")
         embed.set_thumbnail(url=ctx.guild.icon.url)
         if rows:
             # get guild xp settings
-            async with database.db.execute("SELECT xp_change_per_level FROM server_config WHERE guild=?",
-                                           (ctx.guild.id,)) as cur:
-                change_per_level = await cur.fetchone()
+            change_per_level = await moderation.get_server_config(ctx.guild.id, "xp_change_per_level")
             if change_per_level is None:
                 # default
                 change_per_level = 30
-            else:
-                change_per_level = change_per_level[0]
-            # get top xp to make bar
-            async with database.db.execute("SELECT experience FROM experience WHERE guild=? ORDER BY experience DESC",
-                                           (ctx.guild.id,)) as cur:
-                topxp = (await cur.fetchone())[0]
             # format leaderboard
             text = ""
             for row in rows:
@@ -438,8 +619,8 @@ class ExperienceCog(commands.Cog, name="Experience"):
         :param user: the user to reset the XP for
         """
 
-        await database.db.execute("DELETE FROM experience WHERE user=? AND guild=?", (user.id, ctx.guild.id))
-        await database.db.commit()
+        await self.discard_pending_xp(ctx.guild.id, user.id)
+        await database.write("DELETE FROM experience WHERE user=? AND guild=?", (user.id, ctx.guild.id))
         await modlog.modlog(f"{ctx.author.mention} ({ctx.author}) reset {user.mention} ({user})'s XP.",
                             ctx.guild.id, ctx.author.id)
         await ctx.reply(f"✔ Reset {user.mention}'s XP.")
@@ -466,8 +647,8 @@ class ExperienceCog(commands.Cog, name="Experience"):
             if msg.content == confirmstring:
                 try:
                     self.suspended_guild.append(ctx.guild.id)
-                    await database.db.execute("DELETE FROM experience WHERE guild=?", (ctx.guild.id,))
-                    await database.db.commit()
+                    await self.discard_pending_xp(ctx.guild.id)
+                    await database.write("DELETE FROM experience WHERE guild=?", (ctx.guild.id,))
                     self.suspended_guild.remove(ctx.guild.id)
                 except Exception as e:
                     self.suspended_guild.remove(ctx.guild.id)